@@ -0,0 +1,541 @@
+import argparse
+import atexit
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+# the benchmarks run the real peer and server code
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Peer"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RendezvousServer"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Simulation"))
+import codec # pylint: disable=wrong-import-position
+from deck import Deck, CARD_NAMES # pylint: disable=wrong-import-position
+from event_log import EventLog # pylint: disable=wrong-import-position
+from fabric import VirtualClock # pylint: disable=wrong-import-position
+from gameplay import Gameplay # pylint: disable=wrong-import-position
+from logger import Logger, INFO, WARN # pylint: disable=wrong-import-position
+from peer import Peer # pylint: disable=wrong-import-position
+from players import PlayerStates # pylint: disable=wrong-import-position
+from room import Room # pylint: disable=wrong-import-position
+from server import Server # pylint: disable=wrong-import-position
+
+SIZES = [2, 10, 100, 1000, 10000]
+# commands in the event log before recovering, each recovery should take about as long
+HISTORIES = [200, 20000]
+# every client gets the whole player order, so sending it is quadratic in the room size
+MAX_PLAYER_ORDER_SIZE = 1000
+# above every log level
+SILENT = WARN + 1
+# metrics where a higher value in a new run is a regression
+LOWER_IS_BETTER = ("ns_per_op", "turn_latency_p50_ms", "turn_latency_p95_ms", "datagrams_per_game", "bytes_per_game")
+
+
+class NullTransport:
+    """A transport that drops every datagram."""
+
+    def write(self, datagram: bytes, addr):
+        pass
+
+
+class CountingTransport:
+    """Passes datagrams to a real transport and counts them."""
+
+    def __init__(self, transport, counter: Dict[str, int]):
+        self.transport = transport
+        self.counter = counter
+
+    def write(self, datagram: bytes, addr):
+        self.counter["datagrams"] += 1
+        self.counter["bytes"] += len(datagram)
+        self.transport.write(datagram, addr)
+
+
+def measure(operation: Callable[[], None], setup: Optional[Callable[[], None]] = None,
+            min_time: float = 0.2, repeat: int = 3) -> Dict:
+    """Times an operation, the best of several rounds of as many calls as fit in min_time.
+
+    Args:
+        operation: The operation.
+        setup: Called before every call of the operation, and not timed. Default: None.
+        min_time: How long one round runs at least (seconds). Default: 0.2s.
+        repeat: How many rounds are timed. Default: 3.
+
+    Returns:
+        The time per call in nanoseconds and the number of calls per round.
+    """
+    def run(calls: int) -> int:
+        if setup is None:
+            started = time.perf_counter_ns()
+            for _ in range(calls):
+                operation()
+            return time.perf_counter_ns() - started
+        elapsed = 0
+        for _ in range(calls):
+            setup()
+            started = time.perf_counter_ns()
+            operation()
+            elapsed += time.perf_counter_ns() - started
+        return elapsed
+
+    calls = 1
+    while True:
+        elapsed = run(calls)
+        if elapsed >= min_time * 1e9 or calls >= 1 << 24:
+            break
+        calls = max(calls * 2, int(calls * min_time * 1e9 / max(elapsed, 1)))
+    best = min([elapsed] + [run(calls) for _ in range(repeat - 1)])
+    return {"ns_per_op": round(best / calls, 1), "ops": calls}
+
+
+def addresses(count: int) -> List[tuple]:
+    return [("127.0.0.1", 10000 + index) for index in range(count)]
+
+
+def bench_peer(size: int, version: int) -> Peer:
+    """A peer of a table of size players, whose membership table is filled in directly."""
+    peer = Peer("127.0.0.1", 10000, version, reactor=VirtualClock(), input_reader=lambda callback: None)
+    peer.transport = NullTransport()
+    peer.logger.set_level(SILENT)
+    peer.members.reset(addresses(size))
+    peer.peer_versions = dict.fromkeys(peer.members, version)
+    peer.gameplay.connected_peers = size - 1
+    peer.gameplay.own_turn_identifier = 0
+    return peer
+
+
+def bench_gameplay(size: int) -> Gameplay:
+    """A gameplay of a started game with size players, where this player is the first."""
+    logger = Logger(("127.0.0.1", 10000), level=SILENT)
+    gameplay = Gameplay(logger, ("127.0.0.1", 10000))
+    gameplay.connected_peers = size - 1
+    gameplay.own_turn_identifier = 0
+    gameplay.members.reset(addresses(size))
+    gameplay.initialize_players()
+    gameplay.current_turn = 0
+    return gameplay
+
+
+def micro_benchmarks(sizes: List[int], min_time: float) -> Dict[str, Dict]:
+    """Runs every micro-benchmark for every table size."""
+    results = {}
+
+    def record(name: str, size: int, result: Dict):
+        results[f"{name}[n={size}]"] = result
+
+    for size in sizes:
+        # parsing and routing: a heartbeat from the last peer of the table, and a game command
+        # from a text peer that is dropped as old data after it was decoded
+        peer = bench_peer(size, codec.BINARY_VERSION)
+        heartbeat = codec.encode("HEARTBEAT", None, codec.BINARY_VERSION)
+        sender = peer.members[-1]
+        record("peer.datagramReceived.heartbeat", size, measure(
+            lambda: peer.datagramReceived(heartbeat, sender), min_time=min_time))
+
+        text_peer = bench_peer(size, codec.TEXT_VERSION)
+        text_peer.lamport_clock = 10
+        old_draw = codec.encode("DRAW_CARD!H10!40!123456", 1, codec.TEXT_VERSION)
+        record("peer.datagramReceived.old_draw", size, measure(
+            lambda: text_peer.datagramReceived(old_draw, sender), min_time=min_time))
+
+        chat = ["hello", "there"]
+        record("peer.handle_other_datagrams.chat", size, measure(
+            lambda: peer.handle_other_datagrams(chat, 1, sender), min_time=min_time))
+
+        # gameplay
+        gameplay = bench_gameplay(size)
+        gameplay.deck = Deck.shuffled(8)
+        draw_command = []
+
+        def next_draw():
+            if len(gameplay.deck) < 2:
+                gameplay.deck = Deck.shuffled(8)
+            card = gameplay.deck.card_at(gameplay.deck.cursor)
+            draw_command[:] = ["DRAW_CARD", CARD_NAMES[card], str(len(gameplay.deck) - 1)]
+            gameplay.current_turn = 1 % size
+        record("gameplay.draw_card_command", size, measure(
+            lambda: gameplay.draw_card_command(draw_command, 1 % size), setup=next_draw, min_time=min_time))
+
+        gameplay = bench_gameplay(size)
+        record("gameplay.state_digest", size, measure(gameplay.state_digest, min_time=min_time))
+
+        gameplay = bench_gameplay(size)
+        for seat in range(size):
+            gameplay.players.set_passed(seat)
+        record("gameplay.has_everyone_passed", size, measure(gameplay.has_everyone_passed, min_time=min_time))
+
+        gameplay = bench_gameplay(size)
+        full_points = [10] * size
+
+        def reset_table():
+            gameplay.players = PlayerStates.from_masks(full_points, 0, 0)
+            gameplay.connected_peers = size - 1
+            gameplay.own_turn_identifier = size - 1
+            gameplay.current_turn = 0
+        record("gameplay.synchronize_players", size, measure(
+            lambda: gameplay.synchronize_players(size // 2), setup=reset_table, min_time=min_time))
+        record("gameplay.synchronize_turn_orders", size, measure(
+            lambda: gameplay.synchronize_turn_orders(size // 2), setup=reset_table, min_time=min_time))
+
+        if size > MAX_PLAYER_ORDER_SIZE:
+            continue
+        server = Server(max_seats=size, reactor=VirtualClock())
+        server.transport = NullTransport()
+        room = Room("bench", size)
+        for addr in addresses(size):
+            client = (addr[0], addr[1], 0)
+            room.add(client)
+            server.versions[client] = codec.BINARY_VERSION
+        record("server.player_order", size, measure(lambda: server.player_order(room), min_time=min_time))
+
+    # logging does not depend on the table size
+    logger = Logger(("127.0.0.1", 10000), level=WARN)
+    results["logger.debug.disabled"] = measure(lambda: logger.debug("Card %s", 1), min_time=min_time)
+    logger.set_level(INFO)
+    results["logger.log_message.enabled"] = measure(
+        lambda: logger.log_message("A message for the log file", print_message=False), min_time=min_time)
+    logger.close()
+
+    # the event log does not depend on the table size either
+    with tempfile.TemporaryDirectory() as directory:
+        results.update(event_log_benchmarks(directory, min_time))
+    return results
+
+
+def event_log_benchmarks(directory: str, min_time: float) -> Dict[str, Dict]:
+    """Times appending a move to the event log, and recovering a game after a short and after
+    a long history of moves. Only the commands since the last snapshot are replayed, so the
+    recovery should not take longer after the long history."""
+    results = {}
+    moves = [["DRAW_CARD", "H10", "40", "123456"], ["PASS_TURN", "123456"]]
+
+    def write_log(path: str, commands: int):
+        gameplay = bench_gameplay(7)
+        gameplay.create_deck()
+        event_log = EventLog(path, gameplay, gameplay.logger.parent)
+        for index in range(commands):
+            event_log.record(moves[index % 2], index + 1, index % 7)
+        event_log.close()
+        return gameplay, event_log
+
+    gameplay, event_log = write_log(os.path.join(directory, "append"), 0)
+    count = [0]
+
+    def append():
+        count[0] += 1
+        event_log.record(moves[count[0] % 2], count[0], count[0] % 7)
+    results["event_log.record"] = measure(append, min_time=min_time)
+    event_log.close()
+
+    for history in HISTORIES:
+        source = os.path.join(directory, f"history-{history}")
+        write_log(source, history)
+        target = os.path.join(directory, "recover")
+        recovering = []
+
+        def copy_log():
+            shutil.rmtree(target, ignore_errors=True)
+            shutil.copytree(source, target)
+            gameplay = bench_gameplay(7)
+            recovering[:] = [EventLog(target, gameplay, gameplay.logger.parent)]
+
+        def recover():
+            recovering[0].recover()
+            recovering[0].close()
+        results[f"event_log.recover[history={history}]"] = measure(recover, setup=copy_log, min_time=min_time)
+    return results
+
+
+def free_udp_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class LoopbackGames:
+    """Plays games between peers over real UDP sockets on loopback, in this process.
+
+    A peer moves as soon as it sees its own turn: it draws below 17 points and passes otherwise.
+    The turn latency is the time from a move until the next player's peer sees its turn, so it
+    covers encoding, the loopback socket, the reactor and the handling of the command.
+
+    Args:
+        reactor: The reactor to run on.
+        players: Players at the table.
+        games: How many games to play.
+        peer_options: Keyword arguments of every Peer. Default: None.
+        timeout: How long the games may take in total (seconds). Default: 30s.
+        game_pause: How long the leader waits after a game before it starts the next one (seconds).
+            Default: 0.5s.
+    """
+
+    def __init__(self, reactor, players: int, games: int, peer_options: Optional[Dict] = None,
+                 timeout: float = 30.0, game_pause: float = 0.5):
+        self.reactor = reactor
+        self.players = players
+        self.games = games
+        self.peer_options = peer_options or {}
+        self.timeout = timeout
+        self.game_pause = game_pause
+        self.counter = {"datagrams": 0, "bytes": 0}
+        self.turn_latencies: List[float] = []
+        self.games_started = 0
+        self.games_finished = 0
+        self.in_game = False
+        self.last_move_at: Optional[float] = None
+        self.mover: Optional[Peer] = None
+        self.ports = []
+        self.peers: List[Peer] = []
+        self.started_at = 0.0
+        self.finished_at = 0.0
+        self.on_done = None
+        self.timeout_call = None
+
+    def start(self, on_done: Callable[[], None]):
+        """Starts the server and the peers, and calls on_done once the games are over."""
+        self.on_done = on_done
+        self.started_at = time.perf_counter()
+        server_port = free_udp_port()
+        server = Server(max_seats=self.players, reactor=self.reactor)
+        self.ports.append(self.reactor.listenUDP(server_port, server))
+        server.transport = CountingTransport(server.transport, self.counter)
+        for _ in range(self.players):
+            port = free_udp_port()
+            peer = Peer("127.0.0.1", port, codec.BINARY_VERSION, reactor=self.reactor,
+                        input_reader=lambda callback: None, **self.peer_options)
+            peer.server = ("127.0.0.1", server_port)
+            peer.logger.set_level(SILENT)
+            self.watch(peer)
+            self.ports.append(self.reactor.listenUDP(port, peer))
+            peer.transport = CountingTransport(peer.transport, self.counter)
+            self.peers.append(peer)
+        self.timeout_call = self.reactor.callLater(self.timeout, self.finish)
+
+    def watch(self, peer: Peer):
+        """Checks the turns after every datagram the peer handles."""
+        received = peer.datagramReceived
+
+        def datagram_received(datagram, addr):
+            received(datagram, addr)
+            self.check_turns()
+        peer.datagramReceived = datagram_received
+
+    def is_seated(self) -> bool:
+        return len(self.peers) == self.players and all(
+            peer.gameplay.own_turn_identifier >= 0 and peer.gameplay.connected_peers == self.players - 1
+            for peer in self.peers)
+
+    def check_turns(self):
+        if self.mover is not None or self.on_done is None or not self.is_seated():
+            return
+        in_game = any(peer.gameplay.is_game_initiated() for peer in self.peers)
+        if self.in_game and not in_game:
+            self.games_finished += 1
+        self.in_game = in_game
+        if not in_game:
+            if self.games_started == self.games:
+                self.finish()
+                return
+            self.games_started += 1
+            if self.games_started == 1:
+                # the counts cover the games, not the seating
+                self.counter.update(datagrams=0, bytes=0)
+            leader = min(self.peers, key=lambda peer: peer.gameplay.own_turn_identifier)
+            self.move(leader, "INITIATE_GAME", self.game_pause if self.games_started > 1 else 0)
+            return
+        for peer in self.peers:
+            if peer.gameplay.is_game_initiated() and peer.gameplay.is_my_turn():
+                if self.last_move_at is not None:
+                    self.turn_latencies.append(time.perf_counter() - self.last_move_at)
+                points = peer.gameplay.players.points_of(peer.gameplay.own_turn_identifier)
+                self.move(peer, "DRAW_CARD" if points < 17 else "PASS_TURN")
+                return
+
+    def move(self, peer: Peer, command: str, delay: float = 0):
+        # moving from the reactor, like a typed command, and not from inside the handling of a datagram
+        self.mover = peer
+        self.reactor.callLater(delay, self.type_command, peer, command)
+
+    def type_command(self, peer: Peer, command: str):
+        self.mover = None
+        if command == "INITIATE_GAME":
+            self.last_move_at = None
+        else:
+            self.last_move_at = time.perf_counter()
+        peer.handle_user_input(command)
+        self.check_turns()
+
+    def finish(self):
+        if self.on_done is None:
+            return
+        if self.timeout_call is not None and self.timeout_call.active():
+            self.timeout_call.cancel()
+        for port in self.ports:
+            port.stopListening()
+        self.finished_at = time.perf_counter()
+        on_done, self.on_done = self.on_done, None
+        on_done()
+
+    def result(self) -> Dict:
+        latencies = sorted(self.turn_latencies)
+        games = self.games_finished
+        return {
+            "games": self.games_finished,
+            "complete": self.games_finished == self.games,
+            "wall_seconds": round(self.finished_at - self.started_at, 3),
+            "turns": len(latencies),
+            "turn_latency_p50_ms": round(latencies[len(latencies) // 2] * 1000, 3) if latencies else None,
+            "turn_latency_p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 3) if latencies else None,
+            "turn_latency_mean_ms": round(statistics.mean(latencies) * 1000, 3) if latencies else None,
+            "datagrams_per_game": round(self.counter["datagrams"] / games, 1) if games else None,
+            "bytes_per_game": round(self.counter["bytes"] / games, 1) if games else None,
+        }
+
+
+@contextlib.contextmanager
+def quiet():
+    """Keeps the server's console output out of the results."""
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def macro_benchmarks(runtime: str, table_sizes: List[int], games: int) -> Dict[str, Dict]:
+    """Plays the games of every table size, without and with the reliable channel."""
+    results = {}
+    runs = [(f"loopback.{runtime}.{'reliable' if options else 'plain'}[players={players}]", players, options)
+            for players in table_sizes for options in ({}, {"reliable": True})]
+
+    if runtime == "asyncio":
+        # an asyncio loop cannot bind sockets while it runs, so every run gets a loop of its own
+        from aio import AsyncioReactor # pylint: disable=import-outside-toplevel
+        for name, players, options in runs:
+            reactor = AsyncioReactor()
+            games_run = LoopbackGames(reactor, players, games, options)
+            with quiet():
+                games_run.start(reactor.stop)
+                reactor.run()
+            results[name] = games_run.result()
+        return results
+
+    # the Twisted reactor cannot be restarted, so the runs follow each other in one reactor run
+    from twisted.internet import reactor # pylint: disable=import-outside-toplevel
+
+    def next_run():
+        if not runs:
+            reactor.stop()
+            return
+        name, players, options = runs.pop(0)
+        games_run = LoopbackGames(reactor, players, games, options)
+
+        def done():
+            results[name] = games_run.result()
+            # let the stopped ports close before the next run
+            reactor.callLater(0.05, next_run)
+        games_run.start(done)
+
+    reactor.callLater(0, next_run)
+    with quiet():
+        reactor.run()
+    return results
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float) -> List[str]:
+    """Compares results to a baseline and returns the regressions.
+
+    Args:
+        results: The new results.
+        baseline: The results of an earlier run.
+        threshold: How much worse a metric may get before it counts, e.g. 0.1 for 10%.
+    """
+    regressions = []
+
+    def regression(line: str):
+        regressions.append(line)
+        print("REGRESSION " + line)
+
+    for name, metrics in sorted(results.items()):
+        old_metrics = baseline.get(name)
+        if old_metrics is None:
+            continue
+        # the metrics of a run that did not play all of its games are not comparable
+        if metrics.get("complete") is False:
+            regression(f"{name} complete: {old_metrics.get('complete')} -> False")
+        if "games" in old_metrics and (metrics.get("games") or 0) < old_metrics["games"]:
+            regression(f"{name} games: {old_metrics['games']} -> {metrics.get('games')}")
+        for metric in LOWER_IS_BETTER:
+            new, old = metrics.get(metric), old_metrics.get(metric)
+            if new is None and old is not None:
+                regression(f"{name} {metric}: {old} -> missing")
+                continue
+            if new is None or not old:
+                continue
+            change = (new - old) / old
+            line = f"{name} {metric}: {old} -> {new} ({change:+.1%})"
+            if change > threshold:
+                regression(line)
+            else:
+                print("ok         " + line)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks of the protocol and gameplay hot paths")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in SIZES),
+                        help="Comma separated table sizes of the micro-benchmarks.")
+    parser.add_argument("--min-time", type=float, default=0.2,
+                        help="How long each micro-benchmark round runs at least (seconds).")
+    parser.add_argument("--players", default="2,4,7",
+                        help="Comma separated table sizes of the loopback games.")
+    parser.add_argument("--games", type=int, default=5, help="Loopback games per table size.")
+    parser.add_argument("--runtime", choices=["twisted", "asyncio"], default="twisted",
+                        help="Event loop of the loopback games.")
+    parser.add_argument("--skip-micro", action="store_true", help="Only play the loopback games.")
+    parser.add_argument("--skip-macro", action="store_true", help="Only run the micro-benchmarks.")
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file.")
+    parser.add_argument("--compare", default=None, metavar="BASELINE",
+                        help="Compare with the results in this JSON file, and exit with 1 on a regression.")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="How much slower or bigger a result may get before it is a regression. Default: 0.1 (10%%).")
+    args = parser.parse_args()
+
+    # paths on the command line are relative to where the script was started, not to the work directory
+    output_path = os.path.abspath(args.output) if args.output else None
+    baseline_results = None
+    if args.compare:
+        with open(os.path.abspath(args.compare), encoding="utf-8") as baseline_file:
+            baseline_results = json.load(baseline_file)["results"]
+
+    random.seed(0)
+    benchmarks = {}
+    # the loggers of the benchmarked objects write their files here
+    work_directory = tempfile.mkdtemp(prefix="benchmarks-")
+    atexit.register(shutil.rmtree, work_directory, True)
+    os.chdir(work_directory)
+    if not args.skip_micro:
+        benchmarks.update(micro_benchmarks([int(size) for size in args.sizes.split(",")], args.min_time))
+    if not args.skip_macro:
+        benchmarks.update(macro_benchmarks(args.runtime, [int(size) for size in args.players.split(",")], args.games))
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": benchmarks,
+    }
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if baseline_results is not None:
+        if compare(benchmarks, baseline_results, args.threshold):
+            sys.exit(1)
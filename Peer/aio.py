@@ -0,0 +1,161 @@
+import asyncio
+import functools
+import sys
+from time import time
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+
+def new_event_loop() -> asyncio.AbstractEventLoop:
+    """Returns a uvloop event loop if uvloop is installed, otherwise the default asyncio loop."""
+    if uvloop is not None:
+        return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+class DelayedCall:
+    """A call scheduled with AsyncioReactor.callLater, with the methods of Twisted's DelayedCall
+    that the peer and the server use."""
+
+    def __init__(self, handle: asyncio.TimerHandle):
+        self.handle = handle
+        self.called = False
+
+    def active(self) -> bool:
+        return not self.called and not self.handle.cancelled()
+
+    def cancel(self):
+        self.handle.cancel()
+
+
+class DatagramTransport:
+    """Gives an asyncio datagram transport the write(datagram, addr) and stopListening() methods
+    of a Twisted UDP port."""
+
+    def __init__(self, transport: asyncio.DatagramTransport, adapter: 'DatagramAdapter'):
+        self.transport = transport
+        self.adapter = adapter
+
+    def write(self, datagram: bytes, addr):
+        self.transport.sendto(datagram, addr)
+
+    def stopListening(self):
+        self.adapter.stop()
+
+
+class DatagramAdapter(asyncio.DatagramProtocol):
+    """Runs a Twisted DatagramProtocol (the Peer or the Server) on an asyncio datagram endpoint.
+
+    Args:
+        protocol: The Twisted protocol that handles the datagrams.
+    """
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.transport = None
+        self.stopped = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.protocol.transport = DatagramTransport(transport, self)
+        self.protocol.startProtocol()
+
+    def datagram_received(self, data: bytes, addr):
+        self.protocol.datagramReceived(data, addr[:2])
+
+    def error_received(self, exc: Exception):
+        # e.g. ICMP port unreachable from a peer that left, Twisted ignores these as well
+        pass
+
+    def stop(self):
+        """Stops the protocol while it can still send, then closes the socket."""
+        if self.stopped:
+            return
+        self.stopped = True
+        self.protocol.stopProtocol()
+        self.transport.close()
+
+
+class AsyncioReactor:
+    """The part of the Twisted reactor API that the peer and the server use, on an asyncio event
+    loop. Datagrams go through asyncio.DatagramProtocol, and user input is read from stdin by the
+    event loop instead of a thread.
+
+    Args:
+        loop: The event loop to run on. Default: a new uvloop loop if uvloop is installed,
+            otherwise a new asyncio loop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop = None):
+        self.loop = loop if loop is not None else new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.adapters = []
+
+    def seconds(self) -> float:
+        """Returns the current time, like the Twisted reactor (and not the loop's monotonic clock)."""
+        return time()
+
+    def callLater(self, delay: float, f, *args, **kwargs) -> DelayedCall:
+        call = DelayedCall(None)
+
+        def run():
+            call.called = True
+            f(*args, **kwargs)
+
+        call.handle = self.loop.call_later(delay, run)
+        return call
+
+    def callFromThread(self, f, *args, **kwargs):
+        self.loop.call_soon_threadsafe(functools.partial(f, *args, **kwargs))
+
+    def callInThread(self, f, *args, **kwargs):
+        self.loop.run_in_executor(None, functools.partial(f, *args, **kwargs))
+
+    def listenUDP(self, port: int, protocol) -> DatagramTransport:
+        """Binds a UDP port on all interfaces and starts the protocol on it. Returns the port."""
+        adapter = DatagramAdapter(protocol)
+        self.loop.run_until_complete(
+            self.loop.create_datagram_endpoint(lambda: adapter, local_addr=("0.0.0.0", port)))
+        self.adapters.append(adapter)
+        return protocol.transport
+
+    def read_lines(self, callback):
+        """Calls callback with every line typed on stdin, without the newline.
+
+        Args:
+            callback: Called in the event loop thread for each line.
+        """
+        def read_line():
+            line = sys.stdin.readline()
+            if not line:
+                # end of input
+                self.loop.remove_reader(sys.stdin.fileno())
+                return
+            callback(line.rstrip("\n"))
+
+        try:
+            self.loop.add_reader(sys.stdin.fileno(), read_line)
+        except NotImplementedError:
+            # loops without add_reader (Windows) read in a thread and hand the lines to the loop
+            def read():
+                for line in sys.stdin:
+                    self.callFromThread(callback, line.rstrip("\n"))
+            self.callInThread(read)
+
+    def run(self):
+        """Runs the event loop until it is interrupted, then stops the protocols."""
+        try:
+            self.loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for adapter in self.adapters:
+                adapter.stop()
+            self.loop.run_until_complete(asyncio.sleep(0))
+            self.loop.close()
+
+    def stop(self):
+        self.loop.stop()
@@ -0,0 +1,234 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from peer import Peer
+
+CAUSAL_COMMANDS = ("CAUSAL", "GAP_REQUEST")
+
+
+def parse_vector_clock(value: str) -> Dict[Tuple[str, int], int]:
+    """Parses a vector clock of the form "ip:port:count,ip:port:count"."""
+    vector_clock = {}
+    for entry in value.split(",") if value else []:
+        ip, port, count = entry.split(":")
+        vector_clock[(ip, int(port))] = int(count)
+    return vector_clock
+
+
+class HeldMessage:
+    """A received message that waits for the messages it depends on."""
+
+    def __init__(self, sender: Tuple[str, int], vector_clock: Dict[Tuple[str, int], int],
+                 message: List[str], clock: Optional[int], received_at: float):
+        self.sender = sender
+        self.vector_clock = vector_clock
+        self.message = message
+        self.clock = clock
+        self.received_at = received_at
+        self.gap_requested = False
+
+
+class CausalOrder:
+    """Delivers game commands in causal order.
+
+    Every game command a peer broadcasts carries a vector clock: for every peer, how many of its
+    commands the sender had delivered, its own new command included. A command is delivered once
+    it is the next one from its sender and everything the sender had seen was delivered here as
+    well. Until then it is held back, so a command that overtakes the one it answers waits for it
+    instead of being dropped as old data.
+
+    If a held command still waits after hold_timeout, the missing commands are asked for with
+    GAP_REQUEST from the peers that sent them, which keep their last commands for that. If they do
+    not arrive within another hold_timeout, the held command is delivered anyway and the state
+    digests sort out the rest.
+
+    A peer that joins a table during a game has not seen the commands before it joined. It holds
+    every command until it has a snapshot of the game, and then only delivers the commands the
+    snapshot does not include, see wait_for_baseline.
+
+    Args:
+        peer: Reference to the Peer instance.
+        deliver: Called with (fields, clock, addr) for each command, in causal order.
+        hold_timeout: How long a command is held before asking for the missing ones (seconds). Default: 1s.
+        max_held: How many commands are held at most, the oldest is delivered when there are more. Default: 64.
+        history_size: How many of its own commands a peer keeps for gap requests. Default: 64.
+    """
+
+    def __init__(self, peer: 'Peer', deliver, hold_timeout: float = 1.0, max_held: int = 64,
+                 history_size: int = 64):
+        self.peer = peer
+        self.reactor = peer.reactor
+        self.logger = peer.logger.get_module_logger("causal")
+        self.deliver = deliver
+        self.hold_timeout = hold_timeout
+        self.max_held = max_held
+        self.history_size = history_size
+        # how many commands of each peer were delivered, own commands included
+        self.delivered: Dict[Tuple[str, int], int] = {}
+        self.held: List[HeldMessage] = []
+        # own commands by count, as sent
+        self.history: 'OrderedDict[int, str]' = OrderedDict()
+        self.check_call = None
+        # set while a joining peer waits for the vector clock of its game snapshot
+        self.waiting_for_baseline = False
+
+    def vector_clock(self) -> str:
+        """Returns the delivered counts as a vector clock, "ip:port:count,..."."""
+        return ",".join(f"{ip}:{port}:{count}" for (ip, port), count in self.delivered.items() if count)
+
+    def stamp(self, message: str) -> str:
+        """Counts an own command and wraps it with the vector clock, as CAUSAL!clock!<message>.
+
+        Args:
+            message: The command in text form.
+        """
+        own_count = self.delivered.get(self.peer.id, 0) + 1
+        self.delivered[self.peer.id] = own_count
+        stamped = f"CAUSAL!{self.vector_clock()}!{message}"
+        self.history[own_count] = stamped
+        if len(self.history) > self.history_size:
+            self.history.popitem(last=False)
+        return stamped
+
+    def handle_message(self, splitted_command: List[str], clock: Optional[int], addr: Tuple[str, int]):
+        """Handles CAUSAL and GAP_REQUEST messages.
+
+        Args:
+            splitted_command: The message split into fields.
+            clock: The Lamport clock value of the message, or None.
+            addr: The address of the sender.
+        """
+        if splitted_command[0] == "GAP_REQUEST":
+            first_missing = int(splitted_command[1])
+            for count, stamped in self.history.items():
+                if count >= first_missing:
+                    self.peer.queue_message(stamped, addr)
+            return
+
+        vector_clock = parse_vector_clock(splitted_command[1])
+        count = vector_clock.get(addr, 0)
+        if count <= self.delivered.get(addr, 0) or any(
+                held.sender == addr and held.vector_clock.get(addr, 0) == count for held in self.held):
+            self.logger.debug("Duplicate command from %s", addr)
+            return
+        self.held.append(HeldMessage(addr, vector_clock, splitted_command[2:], clock, self.reactor.seconds()))
+        self.deliver_ready()
+        if len(self.held) > self.max_held and not self.waiting_for_baseline:
+            self.logger.warn("Too many commands held back, delivering the oldest one")
+            self.force_deliver(self.held[0])
+        if self.held and self.check_call is None:
+            self.check_call = self.reactor.callLater(self.hold_timeout, self.check_held)
+
+    def is_deliverable(self, held: HeldMessage) -> bool:
+        """Checks that a held command is the next one from its sender and that everything its
+        sender had delivered from the other peers of the table was delivered here too."""
+        for addr, count in held.vector_clock.items():
+            if addr == held.sender:
+                if count != self.delivered.get(addr, 0) + 1:
+                    return False
+            elif addr != self.peer.id and addr in self.peer.members and count > self.delivered.get(addr, 0):
+                return False
+        return True
+
+    def drop_delivered(self):
+        """Drops held commands whose count was delivered meanwhile, e.g. when a command was
+        given up on and the commands before it came later."""
+        self.held = [held for held in self.held
+                     if held.vector_clock.get(held.sender, 0) > self.delivered.get(held.sender, 0)]
+
+    def deliver_ready(self):
+        """Delivers held commands until none of the remaining ones is deliverable."""
+        if self.waiting_for_baseline:
+            return
+        progress = True
+        while progress:
+            progress = False
+            self.drop_delivered()
+            for held in self.held:
+                if self.is_deliverable(held):
+                    self.held.remove(held)
+                    self.delivered[held.sender] = held.vector_clock[held.sender]
+                    self.deliver(held.message, held.clock, held.sender)
+                    progress = True
+                    break
+
+    def force_deliver(self, held: HeldMessage):
+        """Delivers a held command without the commands it depends on, which are given up on."""
+        self.drop_delivered()
+        if held not in self.held:
+            # delivered already, this was a copy
+            return
+        self.held.remove(held)
+        for addr, count in held.vector_clock.items():
+            if addr != self.peer.id and count > self.delivered.get(addr, 0):
+                self.delivered[addr] = count
+        self.deliver(held.message, held.clock, held.sender)
+        self.deliver_ready()
+
+    def check_held(self):
+        """Asks for the commands that held commands have waited for too long, and gives up on
+        the ones that did not come after asking."""
+        self.check_call = None
+        if self.waiting_for_baseline:
+            # set_baseline checks again
+            return
+        self.drop_delivered()
+        now = self.reactor.seconds()
+        for held in list(self.held):
+            if held not in self.held or now - held.received_at < self.hold_timeout:
+                continue
+            if not held.gap_requested:
+                held.gap_requested = True
+                held.received_at = now
+                self.request_gaps(held)
+            else:
+                self.logger.debug("Gave up waiting for the commands before one from %s", held.sender)
+                self.force_deliver(held)
+        if self.held:
+            self.check_call = self.reactor.callLater(self.hold_timeout, self.check_held)
+
+    def request_gaps(self, held: HeldMessage):
+        """Sends GAP_REQUEST to every peer whose commands a held command waits for."""
+        for addr, count in held.vector_clock.items():
+            missing_from = self.delivered.get(addr, 0) + 1
+            if addr != self.peer.id and addr in self.peer.members and count >= missing_from:
+                self.logger.debug("Asking %s for its commands from %s on", addr, missing_from)
+                self.peer.send_message(f"GAP_REQUEST!{missing_from}", addr)
+
+    def wait_for_baseline(self):
+        """Holds every command until set_baseline is called, because the counts of the other
+        peers are not known yet."""
+        self.waiting_for_baseline = True
+
+    def set_baseline(self, vector_clock: Dict[Tuple[str, int], int]):
+        """Starts delivering after the commands a game snapshot includes. Held commands that the
+        snapshot already covers are dropped, the others are delivered in causal order.
+
+        Args:
+            vector_clock: The delivered counts of the peer that took the snapshot, see parse_vector_clock.
+        """
+        self.waiting_for_baseline = False
+        for addr, count in vector_clock.items():
+            if addr != self.peer.id and count > self.delivered.get(addr, 0):
+                self.delivered[addr] = count
+        self.drop_delivered()
+        self.deliver_ready()
+        if self.held and self.check_call is None:
+            self.check_call = self.reactor.callLater(self.hold_timeout, self.check_held)
+
+    def forget(self, addr: Tuple[str, int]):
+        """Drops the count of a peer that left the table. Held commands stop waiting for its commands.
+
+        Args:
+            addr: The address of the peer.
+        """
+        self.delivered.pop(addr, None)
+        self.held = [held for held in self.held if held.sender != addr]
+        self.deliver_ready()
+
+    def stop(self):
+        """Stops the hold-back timer."""
+        if self.check_call is not None and self.check_call.active():
+            self.check_call.cancel()
+        self.check_call = None
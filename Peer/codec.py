@@ -0,0 +1,615 @@
+import socket
+import struct
+from typing import List, Optional, Tuple
+
+# Protocol versions. Version 1 is the original text protocol, e.g. "DRAW_CARD!C05!47^12".
+# Version 2 packs the same messages into binary frames:
+#   MAGIC (1 byte) | opcode (1 byte) | Lamport clock (varint, 0 = no clock) | fields
+# MAGIC can never be the first byte of a UTF-8 string, so both kinds of datagrams
+# can arrive on the same socket.
+# A datagram for one of the tables of a peer host (see host.py) is put into a TABLE frame:
+#   MAGIC | TABLE opcode | table id (varint) | the datagram, text or binary
+# Table 0 is never wrapped, so a peer that plays one table does not need to know about tables.
+TEXT_VERSION = 1
+BINARY_VERSION = 2
+PROTOCOL_VERSION = BINARY_VERSION
+
+MAGIC = 0xB1
+
+SUITS = "CDHS"
+# card codes are suit * 13 + (rank - 2), e.g. "C02" = 0 and "S14" = 51
+CARD_NAMES = [f"{suit}{rank:02d}" for suit in SUITS for rank in range(2, 15)]
+CARD_CODES = {name: code for code, name in enumerate(CARD_NAMES)}
+
+_PORT = struct.Struct("!H")
+
+# message name -> (opcode, field kinds). A variadic kind ("cards", "members", "changes", "updates", "uints",
+# "message", "messages", "text")
+# consumes the rest of the fields and must come last. Trailing fields are optional:
+# a message may stop before its last kinds, e.g. "ready!2" without a room name.
+COMMANDS = {
+    # peer to peer
+    # HEARTBEAT!membership epoch to the server, a plain HEARTBEAT between peers
+    "HEARTBEAT": (1, ("uint",)),
+    "PEER_DISCONNECTED": (2, ("ip", "port")),
+    "CREATE_DECK": (3, ("cards",)),
+    # DRAW_CARD!card!cards left!state digest and PASS_TURN!state digest, see Gameplay.state_digest
+    "DRAW_CARD": (4, ("card", "uint", "uint")),
+    "PASS_TURN": (5, ("uint",)),
+    "END_GAME": (6, ()),
+    "SYNC_ERROR": (7, ()),
+    "REQUEST_DECK": (8, ()),
+    "CHAT": (9, ("text",)),
+    # SYNC_REQUEST!shoe digest, answered with
+    # SYNC_STATE!turn!cursor!pass mask!loser mask!comma separated points!whole shoe (only if the shoes differ)
+    "SYNC_REQUEST": (15, ("uint",)),
+    "SYNC_STATE": (22, ("uint", "uint", "uint", "uint", "str", "cards")),
+    # shoes built from a shared seed: SEED_COMMIT!round!decks!commitment!stamp!ip!port,
+    # SEED_REVEAL!round!share!stamp!ip!port and SEED_DECK!seed!decks!cursor instead of CREATE_DECK.
+    # stamp!ip!port tags the round with the Lamport clock value and the address of its initiator.
+    "SEED_COMMIT": (23, ("uint", "uint", "hex", "uint", "ip", "port")),
+    "SEED_REVEAL": (24, ("uint", "hex", "uint", "ip", "port")),
+    "SEED_DECK": (25, ("hex", "uint", "uint")),
+    # several messages in one datagram, decoded as BATCH!<message>!<message>... with each message
+    # in text form as one field. Only sent in binary, see encode_batch
+    "BATCH": (26, ("messages",)),
+    # causal delivery, CAUSAL!vector clock!<message> where the vector clock is "ip:port:count,..."
+    # and GAP_REQUEST!first missing count, see causal.py
+    "CAUSAL": (27, ("clock", "message")),
+    "GAP_REQUEST": (28, ("uint",)),
+    # a peer that joins a table asks one player for the game in progress with
+    # GAME_SNAPSHOT_REQUEST!request id!shoe digest, answered with
+    # GAME_SNAPSHOT!request id!vector clock!Lamport clock!<SYNC_STATE message, if a game is running>
+    "GAME_SNAPSHOT_REQUEST": (29, ("uint", "uint")),
+    "GAME_SNAPSHOT": (30, ("uint", "clock", "uint", "message")),
+    # SWIM failure detection, updates are "<a|s|d>ip:port:incarnation"
+    "SWIM_PING": (10, ("uint", "updates")),
+    "SWIM_ACK": (11, ("uint", "updates")),
+    "SWIM_PING_REQ": (12, ("uint", "ip", "port", "updates")),
+    # reliable delivery, RELIABLE!seq!<message> and ACK!next expected seq!received seqs above it.
+    # SKIP!first seq!last seq stands in for messages the sender gave up resending or no longer has.
+    "RELIABLE": (13, ("uint", "message")),
+    "ACK": (14, ("uint", "uints")),
+    "SKIP": (32, ("uint", "uint")),
+    # peer to server
+    # ready!version!room!seats, an empty room name means any table with a free seat
+    "ready": (16, ("uint", "str", "uint")),
+    "disconnect": (17, ()),
+    "SNAPSHOT_REQUEST": (21, ()),
+    # server to peer, PLAYER_ORDER!index!epoch!members where members are "ip:port:version".
+    # Text clients get PLAYER_ORDER!index!ip:port!... without an epoch.
+    "PLAYER_ORDER": (18, ("uint", "uint", "members")),
+    "ROOM_FULL": (19, ("str",)),
+    # MEMBERSHIP_DELTA!epoch!changes where changes are "+ip:port:version" or "-ip:port:version"
+    "MEMBERSHIP_DELTA": (20, ("uint", "changes")),
+    # In both, a member that plays at a table other than 0 of its host is "ip:port:version:table".
+    # TABLE!table id is the header of a datagram for that table, see wrap_table. Between peers
+    # and from the server it names the table at the receiving host, to the server the sending one.
+    "TABLE": (31, ("uint",)),
+}
+OPCODES = {opcode: (name, kinds) for name, (opcode, kinds) in COMMANDS.items()}
+VARIADIC_KINDS = ("cards", "members", "changes", "updates", "uints", "message", "messages", "text")
+
+# largest datagram a batch is allowed to grow to, well below the usual 1500 byte MTU
+MAX_DATAGRAM_SIZE = 1200
+
+
+def card_to_int(card: str) -> int:
+    """Converts a card name such as "C05" to its card code."""
+    return CARD_CODES[card]
+
+
+def int_to_card(code: int) -> str:
+    """Converts a card code to its card name."""
+    return CARD_NAMES[code]
+
+
+def is_binary(datagram: bytes) -> bool:
+    """Checks if a datagram is a binary frame."""
+    return bool(datagram) and datagram[0] == MAGIC
+
+
+def negotiate_version(own_version: int, other_version: int) -> int:
+    """Returns the protocol version to use with another party."""
+    return min(own_version, other_version)
+
+
+def wrap_table(table: int, datagram: bytes) -> bytes:
+    """Puts a datagram for one table of a peer host into a TABLE frame. Datagrams for table 0
+    are returned as they are.
+
+    Args:
+        table: The table id.
+        datagram: The encoded datagram.
+    """
+    if not table:
+        return datagram
+    header = bytearray((MAGIC, COMMANDS["TABLE"][0]))
+    _write_varint(header, table)
+    return bytes(header) + datagram
+
+
+def unwrap_table(datagram: bytes) -> Tuple[int, bytes]:
+    """Takes a datagram out of its TABLE frame.
+
+    Args:
+        datagram: The received datagram.
+
+    Returns:
+        The table id, 0 if the datagram has no TABLE frame, and the datagram itself.
+
+    Raises:
+        ValueError: If the TABLE frame is truncated.
+    """
+    if len(datagram) < 2 or datagram[0] != MAGIC or datagram[1] != COMMANDS["TABLE"][0]:
+        return 0, datagram
+    try:
+        table, offset = _read_varint(datagram, 2)
+    except IndexError as e:
+        raise ValueError(f"Malformed table frame: {e}") from e
+    return table, datagram[offset:]
+
+
+def encode(message: str, clock: Optional[int] = None, version: int = TEXT_VERSION) -> bytes:
+    """Encodes a message for the wire.
+
+    Args:
+        message: The message in text form, e.g. "DRAW_CARD!C05!47".
+        clock: The Lamport clock value to attach. Default: None.
+        version: The protocol version of the receiver. Default: TEXT_VERSION.
+    """
+    if version < BINARY_VERSION:
+        if clock is not None:
+            message += f"^{clock}"
+        return message.encode("utf-8")
+    return encode_binary(message.split("!"), clock)
+
+
+def encode_batch(messages: List[str], clock: Optional[int] = None,
+                 max_size: int = MAX_DATAGRAM_SIZE) -> List[bytes]:
+    """Packs messages into as few binary datagrams as possible, in order, each at most max_size
+    bytes unless a single message is larger. A datagram with one message is a plain frame.
+
+    Args:
+        messages: The messages in text form.
+        clock: The Lamport clock value to attach to every datagram. Default: None.
+        max_size: The size limit of a datagram. Default: MAX_DATAGRAM_SIZE.
+    """
+    header = bytearray((MAGIC, COMMANDS["BATCH"][0]))
+    _write_varint(header, clock or 0)
+    datagrams = []
+    batch: List[bytes] = []
+    batch_size = len(header) + 1
+    for message in messages:
+        body = bytearray()
+        _encode_message(body, message.split("!"))
+        size = len(body) + len(_varint_bytes(len(body)))
+        if batch and batch_size + size > max_size:
+            datagrams.append(_pack_batch(header, batch, clock))
+            batch = []
+            batch_size = len(header) + 1
+        batch.append(bytes(body))
+        batch_size += size
+    if batch:
+        datagrams.append(_pack_batch(header, batch, clock))
+    return datagrams
+
+
+def _pack_batch(header: bytearray, bodies: List[bytes], clock: Optional[int]) -> bytes:
+    if len(bodies) == 1:
+        frame = bytearray(header[:1])
+        frame.append(bodies[0][0])
+        _write_varint(frame, clock or 0)
+        frame.extend(bodies[0][1:])
+        return bytes(frame)
+    frame = bytearray(header)
+    _write_varint(frame, len(bodies))
+    for body in bodies:
+        _write_varint(frame, len(body))
+        frame.extend(body)
+    return bytes(frame)
+
+
+def decode(datagram: bytes) -> Tuple[List[str], Optional[int]]:
+    """Decodes a text or binary datagram.
+
+    Args:
+        datagram: The received datagram.
+
+    Returns:
+        The message split into fields (the first field is the command) and the
+        Lamport clock value, or None if the message has none.
+
+    Raises:
+        ValueError: If the datagram is malformed.
+    """
+    if is_binary(datagram):
+        return decode_binary(datagram)
+    try:
+        text = datagram.decode("utf-8")
+    except UnicodeDecodeError as e:
+        raise ValueError(f"Malformed text datagram: {e}") from e
+
+    body, separator, clock = text.rpartition("^")
+    if separator and clock.isdigit():
+        return body.split("!"), int(clock)
+    return text.split("!"), None
+
+
+def encode_binary(fields: List[str], clock: Optional[int] = None) -> bytes:
+    """Packs a message split into fields into a binary frame.
+    Anything that is not a known command is sent as a chat message.
+
+    Args:
+        fields: The message split into fields.
+        clock: The Lamport clock value to attach. Default: None.
+    """
+    opcode, kinds, fields = _lookup_command(fields)
+    frame = bytearray((MAGIC, opcode))
+    _write_varint(frame, clock or 0)
+    _encode_values(frame, kinds, fields[1:])
+    return bytes(frame)
+
+
+def decode_binary(datagram: bytes) -> Tuple[List[str], Optional[int]]:
+    """Unpacks a binary frame into text fields.
+
+    Args:
+        datagram: The received binary frame.
+
+    Raises:
+        ValueError: If the frame is malformed.
+    """
+    try:
+        name, kinds = OPCODES[datagram[1]]
+        clock, offset = _read_varint(datagram, 2)
+        fields = [name]
+        _decode_values(datagram, offset, kinds, fields)
+    except (KeyError, IndexError, struct.error, OSError, UnicodeDecodeError) as e:
+        raise ValueError(f"Malformed binary datagram: {e}") from e
+
+    if name == "CHAT":
+        # chat messages are plain text in the text protocol as well
+        fields = fields[1:]
+    return fields, clock or None
+
+
+def _lookup_command(fields: List[str]) -> Tuple[int, tuple, List[str]]:
+    """Returns the opcode and field kinds of a message, and its fields.
+    Anything that is not a known command becomes a chat message."""
+    entry = COMMANDS.get(fields[0])
+    if entry is None:
+        entry = COMMANDS["CHAT"]
+        fields = ["CHAT", "!".join(fields)]
+    return entry[0], entry[1], fields
+
+
+def _encode_values(buffer: bytearray, kinds: tuple, values: List[str]):
+    """Appends the fields of a message, stopping early if the message omits trailing fields."""
+    for index, kind in enumerate(kinds):
+        if index >= len(values):
+            break
+        if kind in VARIADIC_KINDS:
+            _FIELD_ENCODERS[kind](buffer, values[index:])
+            break
+        _FIELD_ENCODERS[kind](buffer, values[index])
+
+
+def _decode_values(data: bytes, offset: int, kinds: tuple, fields: List[str]) -> int:
+    """Reads the fields of a message until its kinds or the data run out."""
+    for kind in kinds:
+        if offset >= len(data):
+            break
+        offset = _FIELD_DECODERS[kind](data, offset, fields)
+    return offset
+
+
+def _write_varint(buffer: bytearray, value: int):
+    """Appends an unsigned LEB128 varint."""
+    while value > 0x7F:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _varint_bytes(value: int) -> bytes:
+    buffer = bytearray()
+    _write_varint(buffer, value)
+    return bytes(buffer)
+
+
+def _read_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    """Reads an unsigned LEB128 varint. Returns the value and the offset after it."""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def _encode_card(buffer: bytearray, card: str):
+    buffer.append(CARD_CODES[card])
+
+
+def _encode_cards(buffer: bytearray, cards: List[str]):
+    cards = [card for card in cards if card]
+    _write_varint(buffer, len(cards))
+    buffer.extend(CARD_CODES[card] for card in cards)
+
+
+def _encode_uint(buffer: bytearray, value: str):
+    _write_varint(buffer, int(value))
+
+
+def _encode_ip(buffer: bytearray, ip: str):
+    buffer.extend(socket.inet_aton(ip))
+
+
+def _encode_port(buffer: bytearray, port: str):
+    buffer.extend(_PORT.pack(int(port)))
+
+
+def _encode_members(buffer: bytearray, members: List[str], counted: bool = True):
+    if counted:
+        _write_varint(buffer, len(members))
+    for member in members:
+        ip, port, version, *table = member.split(":")
+        buffer.extend(socket.inet_aton(ip))
+        buffer.extend(_PORT.pack(int(port)))
+        if table and int(table[0]):
+            # the high bit of the version byte says that a table id follows
+            buffer.append(int(version) | _TABLE_FLAG)
+            _write_varint(buffer, int(table[0]))
+        else:
+            buffer.append(int(version))
+
+
+def _encode_changes(buffer: bytearray, changes: List[str]):
+    _write_varint(buffer, len(changes))
+    for change in changes:
+        buffer.append(_CHANGE_OPERATIONS.index(change[0]))
+        _encode_members(buffer, [change[1:]], counted=False)
+
+
+def _encode_updates(buffer: bytearray, updates: List[str]):
+    _write_varint(buffer, len(updates))
+    for update in updates:
+        ip, port, incarnation = update[1:].split(":")
+        buffer.append(_MEMBER_STATES.index(update[0]))
+        buffer.extend(socket.inet_aton(ip))
+        buffer.extend(_PORT.pack(int(port)))
+        _write_varint(buffer, int(incarnation))
+
+
+def _encode_uints(buffer: bytearray, values: List[str]):
+    _write_varint(buffer, len(values))
+    for value in values:
+        _write_varint(buffer, int(value))
+
+
+def _encode_message(buffer: bytearray, fields: List[str]):
+    # a message nested in another one: opcode followed by its fields, without MAGIC and clock
+    opcode, kinds, fields = _lookup_command(fields)
+    buffer.append(opcode)
+    _encode_values(buffer, kinds, fields[1:])
+
+
+def _encode_messages(buffer: bytearray, messages: List[str]):
+    _write_varint(buffer, len(messages))
+    for message in messages:
+        body = bytearray()
+        _encode_message(body, message.split("!"))
+        _write_varint(buffer, len(body))
+        buffer.extend(body)
+
+
+def _encode_clock(buffer: bytearray, value: str):
+    entries = value.split(",") if value else []
+    _write_varint(buffer, len(entries))
+    for entry in entries:
+        ip, port, count = entry.split(":")
+        buffer.extend(socket.inet_aton(ip))
+        buffer.extend(_PORT.pack(int(port)))
+        _write_varint(buffer, int(count))
+
+
+def _encode_hex(buffer: bytearray, value: str):
+    data = bytes.fromhex(value)
+    _write_varint(buffer, len(data))
+    buffer.extend(data)
+
+
+def _encode_str(buffer: bytearray, value: str):
+    encoded = value.encode("utf-8")
+    _write_varint(buffer, len(encoded))
+    buffer.extend(encoded)
+
+
+def _encode_text(buffer: bytearray, values: List[str]):
+    buffer.extend("!".join(values).encode("utf-8"))
+
+
+def _decode_card(data: bytes, offset: int, fields: List[str]) -> int:
+    fields.append(CARD_NAMES[data[offset]])
+    return offset + 1
+
+
+def _decode_cards(data: bytes, offset: int, fields: List[str]) -> int:
+    count, offset = _read_varint(data, offset)
+    end = offset + count
+    if end > len(data):
+        raise IndexError("card list is truncated")
+    fields.extend(CARD_NAMES[code] for code in data[offset:end])
+    return end
+
+
+def _decode_uint(data: bytes, offset: int, fields: List[str]) -> int:
+    value, offset = _read_varint(data, offset)
+    fields.append(str(value))
+    return offset
+
+
+def _decode_ip(data: bytes, offset: int, fields: List[str]) -> int:
+    if offset + 4 > len(data):
+        raise IndexError("address is truncated")
+    fields.append(socket.inet_ntoa(data[offset:offset + 4]))
+    return offset + 4
+
+
+def _decode_port(data: bytes, offset: int, fields: List[str]) -> int:
+    fields.append(str(_PORT.unpack_from(data, offset)[0]))
+    return offset + 2
+
+
+def _decode_members(data: bytes, offset: int, fields: List[str], count: int = None) -> int:
+    if count is None:
+        count, offset = _read_varint(data, offset)
+    for _ in range(count):
+        if offset + 7 > len(data):
+            raise IndexError("member list is truncated")
+        ip = socket.inet_ntoa(data[offset:offset + 4])
+        port = _PORT.unpack_from(data, offset + 4)[0]
+        version = data[offset + 6]
+        offset += 7
+        if version & _TABLE_FLAG:
+            table, offset = _read_varint(data, offset)
+            fields.append(f"{ip}:{port}:{version & ~_TABLE_FLAG}:{table}")
+        else:
+            fields.append(f"{ip}:{port}:{version}")
+    return offset
+
+
+def _decode_changes(data: bytes, offset: int, fields: List[str]) -> int:
+    count, offset = _read_varint(data, offset)
+    for _ in range(count):
+        operation = _CHANGE_OPERATIONS[data[offset]]
+        member = []
+        offset = _decode_members(data, offset + 1, member, count=1)
+        fields.append(operation + member[0])
+    return offset
+
+
+def _decode_updates(data: bytes, offset: int, fields: List[str]) -> int:
+    count, offset = _read_varint(data, offset)
+    for _ in range(count):
+        if offset + 7 > len(data):
+            raise IndexError("update list is truncated")
+        state = _MEMBER_STATES[data[offset]]
+        ip = socket.inet_ntoa(data[offset + 1:offset + 5])
+        port = _PORT.unpack_from(data, offset + 5)[0]
+        incarnation, offset = _read_varint(data, offset + 7)
+        fields.append(f"{state}{ip}:{port}:{incarnation}")
+    return offset
+
+
+def _decode_uints(data: bytes, offset: int, fields: List[str]) -> int:
+    count, offset = _read_varint(data, offset)
+    for _ in range(count):
+        value, offset = _read_varint(data, offset)
+        fields.append(str(value))
+    return offset
+
+
+def _decode_message(data: bytes, offset: int, fields: List[str]) -> int:
+    name, kinds = OPCODES[data[offset]]
+    message = [name]
+    offset = _decode_values(data, offset + 1, kinds, message)
+    fields.extend(message[1:] if name == "CHAT" else message)
+    return offset
+
+
+def _decode_messages(data: bytes, offset: int, fields: List[str]) -> int:
+    count, offset = _read_varint(data, offset)
+    for _ in range(count):
+        length, offset = _read_varint(data, offset)
+        end = offset + length
+        if end > len(data):
+            raise IndexError("batched message is truncated")
+        message = []
+        _decode_message(data[:end], offset, message)
+        fields.append("!".join(message))
+        offset = end
+    return offset
+
+
+def _decode_clock(data: bytes, offset: int, fields: List[str]) -> int:
+    count, offset = _read_varint(data, offset)
+    entries = []
+    for _ in range(count):
+        if offset + 6 > len(data):
+            raise IndexError("vector clock is truncated")
+        ip = socket.inet_ntoa(data[offset:offset + 4])
+        port = _PORT.unpack_from(data, offset + 4)[0]
+        value, offset = _read_varint(data, offset + 6)
+        entries.append(f"{ip}:{port}:{value}")
+    fields.append(",".join(entries))
+    return offset
+
+
+def _decode_hex(data: bytes, offset: int, fields: List[str]) -> int:
+    length, offset = _read_varint(data, offset)
+    if offset + length > len(data):
+        raise IndexError("hex string is truncated")
+    fields.append(data[offset:offset + length].hex())
+    return offset + length
+
+
+def _decode_str(data: bytes, offset: int, fields: List[str]) -> int:
+    length, offset = _read_varint(data, offset)
+    if offset + length > len(data):
+        raise IndexError("string is truncated")
+    fields.append(data[offset:offset + length].decode("utf-8"))
+    return offset + length
+
+
+def _decode_text(data: bytes, offset: int, fields: List[str]) -> int:
+    fields.append(data[offset:].decode("utf-8"))
+    return len(data)
+
+
+# membership change operations, a join or a leave
+_CHANGE_OPERATIONS = "+-"
+# SWIM member states: alive, suspect, dead
+_MEMBER_STATES = "asd"
+# set in the version byte of a member that sits at a table other than 0 of its host
+_TABLE_FLAG = 0x80
+
+_FIELD_ENCODERS = {
+    "card": _encode_card,
+    "cards": _encode_cards,
+    "uint": _encode_uint,
+    "ip": _encode_ip,
+    "port": _encode_port,
+    "members": _encode_members,
+    "changes": _encode_changes,
+    "updates": _encode_updates,
+    "uints": _encode_uints,
+    "message": _encode_message,
+    "messages": _encode_messages,
+    "hex": _encode_hex,
+    "clock": _encode_clock,
+    "str": _encode_str,
+    "text": _encode_text,
+}
+
+_FIELD_DECODERS = {
+    "card": _decode_card,
+    "cards": _decode_cards,
+    "uint": _decode_uint,
+    "ip": _decode_ip,
+    "port": _decode_port,
+    "members": _decode_members,
+    "changes": _decode_changes,
+    "updates": _decode_updates,
+    "uints": _decode_uints,
+    "message": _decode_message,
+    "messages": _decode_messages,
+    "hex": _decode_hex,
+    "clock": _decode_clock,
+    "str": _decode_str,
+    "text": _decode_text,
+}
@@ -0,0 +1,119 @@
+import random
+from array import array
+from typing import Iterable, List, Optional
+from codec import CARD_CODES, CARD_NAMES
+from digest import MASK64, mix64
+
+# points of each card code, the same value that int(card[1:]) gives for the card name
+CARD_VALUES = bytes(code % 13 + 2 for code in range(len(CARD_NAMES)))
+
+
+class Deck:
+    """A shoe of one or more decks, stored as card codes (see codec.CARD_NAMES).
+
+    Drawing moves a cursor forward instead of removing cards, so the cards stay in place
+    and the card at any position of the shoe can be looked up when checking that peers
+    are in sync.
+
+    digest is a hash of the cards left, kept up to date as the cursor moves: the sum of one
+    term per card and its position counted from the bottom of the shoe. A shoe that was sent
+    without its drawn cards has the same digest as the full one at the same point.
+
+    Args:
+        cards: The card codes of the shoe, top card first. Default: an empty shoe.
+    """
+
+    def __init__(self, cards: Optional[Iterable[int]] = None):
+        self.cards = array("B", cards if cards is not None else ())
+        self.cursor = 0
+        size = len(self.cards)
+        self.digest = sum(card_term(size - position, card) for position, card in enumerate(self.cards)) & MASK64
+
+    @classmethod
+    def shuffled(cls, number_of_decks: int = 1, rng: random.Random = None) -> 'Deck':
+        """Creates a shuffled shoe.
+
+        Args:
+            number_of_decks: How many 52 card decks the shoe contains. Default: 1.
+            rng: The random number generator to shuffle with. Default: the random module.
+        """
+        cards = list(range(len(CARD_NAMES))) * number_of_decks
+        (rng or random).shuffle(cards)
+        return cls(cards)
+
+    @classmethod
+    def from_names(cls, card_names: Iterable[str]) -> 'Deck':
+        """Creates a shoe from card names such as "C05". Empty names are skipped.
+
+        Args:
+            card_names: The card names, top card first.
+        """
+        return cls(CARD_CODES[name] for name in card_names if name)
+
+    def __len__(self) -> int:
+        """Returns the number of cards left in the shoe."""
+        return len(self.cards) - self.cursor
+
+    def __repr__(self) -> str:
+        return str(self.names())
+
+    def draw(self) -> int:
+        """Draws the top card. The caller has to check that the shoe is not empty."""
+        card = self.cards[self.cursor]
+        self.digest = (self.digest - card_term(len(self.cards) - self.cursor, card)) & MASK64
+        self.cursor += 1
+        return card
+
+    def move_to(self, cursor: int):
+        """Moves the cursor to a position of the shoe, forward or back.
+
+        Args:
+            cursor: The position of the next card to draw.
+        """
+        size = len(self.cards)
+        cursor = max(0, min(cursor, size))
+        digest = self.digest
+        for position in range(self.cursor, cursor):
+            digest -= card_term(size - position, self.cards[position])
+        for position in range(cursor, self.cursor):
+            digest += card_term(size - position, self.cards[position])
+        self.digest = digest & MASK64
+        self.cursor = cursor
+
+    def card_at(self, position: int) -> int:
+        """Returns the card at a position of the shoe, counting drawn cards as well.
+
+        Args:
+            position: The position from the top of the full shoe.
+        """
+        return self.cards[position]
+
+    def match_draw(self, card: int, cards_left: int) -> bool:
+        """Applies a draw made by a peer, who had cards_left cards left after drawing card.
+        The position of the drawn card follows from cards_left, so this does not search the shoe.
+
+        Args:
+            card: The card code the peer drew.
+            cards_left: The size of the peer's shoe after the draw.
+
+        Returns:
+            True if the shoe had that card at that position, False if the shoes are out of sync.
+        """
+        position = len(self.cards) - cards_left - 1
+        if position < self.cursor or position >= len(self.cards) or self.cards[position] != card:
+            return False
+        self.move_to(position + 1)
+        return True
+
+    def remaining(self) -> bytes:
+        """Returns the codes of the cards left in the shoe, top card first."""
+        return self.cards[self.cursor:].tobytes()
+
+    def names(self) -> List[str]:
+        """Returns the names of the cards left in the shoe, top card first."""
+        return [CARD_NAMES[card] for card in self.cards[self.cursor:]]
+
+
+def card_term(position: int, card: int) -> int:
+    """Returns the digest term of a card at a position, counted from the bottom of the shoe."""
+    return mix64(position << 8 | card)
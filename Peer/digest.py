@@ -0,0 +1,13 @@
+# State digests are sums of one hash per card of the shoe and per seat, so a move updates them
+# by replacing a single term instead of hashing the whole state again. The terms are mixed with
+# a non-linear hash: with XOR or CRC terms, points swapped between two seats would not change the sum.
+
+MASK64 = (1 << 64) - 1
+
+
+def mix64(value: int) -> int:
+    """Returns a 64 bit hash of an integer (the splitmix64 finalizer)."""
+    value = (value + 0x9E3779B97F4A7C15) & MASK64
+    value = (value ^ (value >> 30)) * 0xBF58476D1CE4E5B9 & MASK64
+    value = (value ^ (value >> 27)) * 0x94D049BB133111EB & MASK64
+    return value ^ (value >> 31)
@@ -0,0 +1,219 @@
+import os
+import struct
+from typing import BinaryIO, Iterator, List, Optional, Tuple, TYPE_CHECKING
+import codec
+from logger import Logger, WARN
+
+if TYPE_CHECKING:
+    from gameplay import Gameplay
+
+# the commands that change the game state and are appended to the log
+EVENT_COMMANDS = ("CREATE_DECK", "SEED_DECK", "DRAW_CARD", "PASS_TURN", "SYNC_STATE", "END_GAME")
+
+SEGMENT_MAGIC = b"BJL\x01"
+SEGMENT_SUFFIX = ".seg"
+# record kind, seat of the player who made the move, length of the frame that follows
+_RECORD_HEADER = struct.Struct("!BhI")
+EVENT = 0
+SNAPSHOT = 1
+# the port the peer was bound to, so that a restarted peer gets the same address and seat back
+PORT_FILE = "port"
+
+
+def read_port(directory: str) -> Optional[int]:
+    """Returns the port a peer with this event log was bound to, or None if it is not known.
+
+    Args:
+        directory: The directory of the event log.
+    """
+    try:
+        with open(os.path.join(directory, PORT_FILE), encoding="utf-8") as port_file:
+            return int(port_file.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def write_port(directory: str, port: int):
+    """Stores the port a peer with this event log is bound to, see read_port.
+
+    Args:
+        directory: The directory of the event log, created if it does not exist.
+        port: The port of the peer.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, PORT_FILE), "w", encoding="utf-8") as port_file:
+        port_file.write(str(port))
+
+
+def read_segment(path: str) -> Iterator[Tuple[int, int, List[str], Optional[int]]]:
+    """Reads the records of a segment file. A record that was cut off, e.g. by a crash while
+    it was written, ends the segment.
+
+    Args:
+        path: The path of the segment file.
+
+    Returns:
+        An iterator of (kind, seat, message fields, Lamport clock value) tuples.
+    """
+    with open(path, "rb") as segment:
+        data = segment.read()
+    if not data.startswith(SEGMENT_MAGIC):
+        return
+    offset = len(SEGMENT_MAGIC)
+    while offset + _RECORD_HEADER.size <= len(data):
+        kind, seat, length = _RECORD_HEADER.unpack_from(data, offset)
+        offset += _RECORD_HEADER.size
+        if offset + length > len(data):
+            return
+        try:
+            fields, clock = codec.decode(data[offset:offset + length])
+        except ValueError:
+            return
+        offset += length
+        yield kind, seat, fields, clock
+
+
+class EventLog:
+    """An append-only log of the commands a peer applied to its game, so the game can be rebuilt
+    after the peer crashed or was restarted.
+
+    The log is a directory of segment files. Every segment starts with a snapshot of the game,
+    followed by the commands applied after it, each as a binary frame of the wire protocol with
+    its Lamport clock value and the seat of the player who made the move. A new segment is started
+    when a game starts or ends and after every snapshot_interval commands, and only the last
+    keep_segments segments are kept. Recovering replays the last segment, so it takes as long as
+    the commands since the last snapshot, not the whole history.
+
+    With a reactor, the records appended during one reactor iteration, e.g. the commands of a
+    batch datagram, are flushed to the operating system together when the iteration ends, so the
+    reactor thread does not block on a write per command. Without one, every record is flushed as
+    it is appended. Flushed records survive a crash of the peer. With fsync they are also written
+    to disk, which survives a crash of the host but costs a disk write per flush.
+
+    Args:
+        directory: The directory of the segment files, created if it does not exist.
+        gameplay: The game to log and to recover.
+        logger: Reference to the Logger instance.
+        snapshot_interval: How many commands a segment holds before a new snapshot. Default: 256.
+        keep_segments: How many segments are kept. Default: 2.
+        fsync: Write the records to disk when they are flushed. Default: False.
+        reactor: The reactor whose iterations the flushes follow. Default: None, flush every record.
+    """
+
+    def __init__(self, directory: str, gameplay: 'Gameplay', logger: Logger, snapshot_interval: int = 256,
+                 keep_segments: int = 2, fsync: bool = False, reactor=None):
+        self.directory = directory
+        self.gameplay = gameplay
+        self.logger = logger.get_module_logger("event_log")
+        self.snapshot_interval = snapshot_interval
+        self.keep_segments = max(keep_segments, 1)
+        self.fsync = fsync
+        self.reactor = reactor
+        self.flush_call = None
+        os.makedirs(directory, exist_ok=True)
+        self.segment: Optional[BinaryIO] = None
+        self.segment_number = max(self.segment_numbers(), default=0)
+        self.events_since_snapshot = 0
+        # whether a game was running at the last snapshot, a game that starts or ends is snapshot
+        self.game_active = False
+
+    def segment_numbers(self) -> List[int]:
+        """Returns the numbers of the segment files in the directory, oldest first."""
+        numbers = []
+        for name in os.listdir(self.directory):
+            stem, suffix = os.path.splitext(name)
+            if suffix == SEGMENT_SUFFIX and stem.isdigit():
+                numbers.append(int(stem))
+        return sorted(numbers)
+
+    def segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{number:08d}{SEGMENT_SUFFIX}")
+
+    def record(self, splitted_command: List[str], clock: Optional[int], seat: int):
+        """Appends a command the game applied, if it changes the game state, and starts a new
+        segment when the game started or ended or the segment is full. Called after every game
+        command, also for the ones that are not logged, since e.g. the last seed reveal starts
+        a game as well.
+
+        Args:
+            splitted_command: The command split into fields.
+            clock: The Lamport clock value of the command, or None.
+            seat: The seat of the player who sent the command.
+        """
+        if splitted_command[0] in EVENT_COMMANDS:
+            self.append(EVENT, seat, splitted_command, clock)
+            self.events_since_snapshot += 1
+        if self.gameplay.is_game_initiated() != self.game_active \
+                or self.events_since_snapshot >= self.snapshot_interval:
+            self.snapshot()
+
+    def snapshot(self):
+        """Starts a new segment with a snapshot of the game, and removes the old segments."""
+        self.close()
+        self.segment_number += 1
+        self.segment = open(self.segment_path(self.segment_number), "wb")
+        self.segment.write(SEGMENT_MAGIC)
+        for message in self.gameplay.snapshot_messages():
+            self.append(SNAPSHOT, 0, message.split("!"), None)
+        self.events_since_snapshot = 0
+        self.game_active = self.gameplay.is_game_initiated()
+        for number in self.segment_numbers()[:-self.keep_segments]:
+            try:
+                os.remove(self.segment_path(number))
+            except OSError as e:
+                self.logger.warn("Could not remove old event log segment %s: %s", number, e)
+
+    def append(self, kind: int, seat: int, splitted_command: List[str], clock: Optional[int]):
+        """Writes one record to the current segment."""
+        if self.segment is None:
+            self.snapshot()
+        frame = codec.encode_binary(splitted_command, clock)
+        self.segment.write(_RECORD_HEADER.pack(kind, seat, len(frame)))
+        self.segment.write(frame)
+        if self.reactor is None:
+            self.flush()
+        elif self.flush_call is None:
+            self.flush_call = self.reactor.callLater(0, self.flush)
+
+    def flush(self):
+        """Flushes the records appended since the last flush."""
+        self.flush_call = None
+        if self.segment is None:
+            return
+        self.segment.flush()
+        if self.fsync:
+            os.fsync(self.segment.fileno())
+
+    def recover(self) -> int:
+        """Rebuilds the game from the last segment: its snapshot, then the commands after it.
+        The players' seats are not part of the game state, they come from the server's player order.
+        A new segment is started afterwards, so a cut off record is not appended to.
+
+        Returns:
+            The highest Lamport clock value in the segment, 0 if there is none.
+        """
+        numbers = self.segment_numbers()
+        highest_clock = 0
+        events = 0
+        if numbers:
+            # replaying is quiet, the moves were shown when they were made
+            level = self.gameplay.logger.level
+            self.gameplay.logger.level = WARN
+            try:
+                for kind, seat, fields, clock in read_segment(self.segment_path(numbers[-1])):
+                    self.gameplay.apply_event(fields, seat)
+                    highest_clock = max(highest_clock, clock or 0)
+                    events += kind == EVENT
+            finally:
+                self.gameplay.logger.level = level
+            if self.gameplay.is_game_initiated():
+                self.logger.info("Recovered the game in progress from the event log (%s commands replayed)", events)
+        self.snapshot()
+        return highest_clock
+
+    def close(self):
+        """Flushes and closes the current segment."""
+        if self.segment is not None:
+            self.flush()
+            self.segment.close()
+            self.segment = None
@@ -1,6 +1,13 @@
 import random
-from typing import List, Tuple, Optional
+import zlib
+from digest import MASK64, mix64
+from typing import List, Tuple, Optional, Union
 from logger import Logger
+from codec import CARD_CODES, CARD_NAMES
+from deck import Deck, CARD_VALUES
+from membership import MembershipTable
+from players import PlayerStates
+from seed import SeedRound, deck_from_seed, parse_tag
 
 class Gameplay:
     """Handles all gameplay-related tasks.
@@ -8,53 +15,70 @@ class Gameplay:
     Args:
         logger: Reference to the Logger instance.
         player_id: A tuple representing the player's network address (IP, port).
+        number_of_decks: How many decks the shoe has when this player creates it. Default: 1.
+        deck_mode: "full" to send the whole shoe to the other players when starting a game,
+            or "seed" to agree on a seed with a commit-reveal round and shuffle locally. Default: "full".
+        members: The players of the table, shared with the Peer. Default: a new empty table.
+        clock: Returns the Lamport clock value of the peer, which stamps the seed rounds this
+            player starts. Default: None, always 0.
     """
 
-    def __init__(self, logger: Logger, player_id: Tuple[str, int]):
-        self.logger = logger
+    def __init__(self, logger: Logger, player_id: Tuple[str, int], number_of_decks: int = 1,
+                 deck_mode: str = "full", members: Optional[MembershipTable] = None, clock=None):
+        self.logger = logger.get_module_logger("gameplay")
         self.player_id = player_id
+        self.number_of_decks = number_of_decks
+        self.deck_mode = deck_mode
+        self.members = members if members is not None else MembershipTable()
+        self.clock = clock if clock is not None else (lambda: 0)
+        self.seed_round: Optional[SeedRound] = None
+        # the last round that built a shoe, its share is sent again to players that missed it
+        self.finished_seed_round: Optional[SeedRound] = None
+        # tag of the newest round seen, messages of older rounds are late and ignored
+        self.latest_round_tag: Optional[Tuple[int, str, int]] = None
+        # how often the messages of a seed round are sent again before it is given up
+        self.max_seed_resends = 5
+        # seed and deck count of the current shoe, if it was built from a seed
+        self.seed: Optional[bytes] = None
+        self.seed_decks = number_of_decks
         self.connected_peers = 0
-        self.deck: List[str] = []
+        self.deck = Deck()
         self.current_turn = -1 # current_turn is -1 to mark that the game is not active yet
         self.own_turn_identifier = -1
-        self.points = {}
-        self.passes = {}
-        self.losers: List[int] = [] # this is used if someone's point count goes over 21
+        # points, passes and losers (players whose point count went over 21) by seat
+        self.players = PlayerStates()
 
         self.supported_incoming_commands = [
             "CREATE_DECK", "DRAW_CARD",
             "PASS_TURN", "END_GAME",
             "SYNC_ERROR", "REQUEST_DECK",
+            "SYNC_REQUEST", "SYNC_STATE",
+            "SEED_COMMIT", "SEED_REVEAL", "SEED_DECK",
         ]
-
-        self.cards = [
-            "C02", "C03", "C04", "C05", "C06", "C07", "C08", "C09", "C10", "C11", "C12", "C13", "C14",  # Clubs
-            "D02", "D03", "D04", "D05", "D06", "D07", "D08", "D09", "D10", "D11", "D12", "D13", "D14",  # Diamonds
-            "H02", "H03", "H04", "H05", "H06", "H07", "H08", "H09", "H10", "H11", "H12", "H13", "H14",  # Hearts
-            "S02", "S03", "S04", "S05", "S06", "S07", "S08", "S09", "S10", "S11", "S12", "S13", "S14"   # Spades
-        ]
+        # commands that are not checked against the broadcast Lamport order: the sync commands are
+        # sent to a single peer, and every player sends seed commits and reveals at the same time
+        self.unordered_commands = ["SYNC_REQUEST", "SYNC_STATE", "SEED_COMMIT", "SEED_REVEAL"]
 
     def reset_gameplay_variables(self):
         """Reset variables for next game"""
-        self.deck: List[str] = []
+        self.deck = Deck()
         self.current_turn = -1
-        self.points = {}
-        self.passes = {}
-        self.losers: List[int] = []
+        self.players = PlayerStates()
+        self.seed_round = None
+        self.seed = None
 
     def create_deck(self, deck_values: Optional[List[str]] = None):
         """Handles creating or importing the deck
 
         Args:
-            deck_values: A list of cards which are part of the deck.
+            deck_values: A list of card names which are part of the deck.
         """
         if deck_values is None:
-            self.logger.log_message("First turn player, creating a deck")
-            self.deck = self.cards.copy()
-            random.shuffle(self.deck)
+            self.logger.info("First turn player, creating a deck")
+            self.deck = Deck.shuffled(self.number_of_decks)
         else:
-            self.logger.log_message("Importing deck data from a peer")
-            self.deck = deck_values
+            self.logger.info("Importing deck data from a peer")
+            self.deck = Deck.from_names(deck_values)
 
     def handle_input(self, user_input: str):
         """Handles input from the player.
@@ -77,11 +101,10 @@ class Gameplay:
         if upper_input == "PASS_TURN":
             return self.pass_turn_input()
         if upper_input == "INITIATE_GAME":
-            self.initialize_points()
-            self.initialize_passes()
+            self.initialize_players()
             return self.initiate_game_input()
 
-        self.logger.log_message("Unsupported user input: " + user_input, print_message=False)
+        self.logger.debug("Unsupported user input: %s", user_input)
         return ""
 
     def chat_input(self, splitted_input: List[str]) -> str:
@@ -95,27 +118,27 @@ class Gameplay:
     def draw_card_input(self) -> str:
         """Processes DRAW_CARD! input."""
         if not self.is_game_initiated():
-            self.logger.log_message("The game has not been initiated yet!")
+            self.logger.info("The game has not been initiated yet!")
             return "dont-send"
 
         if not self.is_my_turn():
-            self.logger.log_message("It's not your turn!")
+            self.logger.info("It's not your turn!")
             return "dont-send"
 
         if not self.deck:
-            self.logger.log_message("The deck is empty!")
+            self.logger.info("The deck is empty!")
             return "dont-send"
 
-        card_drawn = self.deck.pop(0)
+        card_drawn = self.deck.draw()
         self.add_points(card_drawn)
-        result_message = f"DRAW_CARD!{card_drawn}!{len(self.deck)}"
+        cards_left = len(self.deck)
         self.advance_player_turn(self.own_turn_identifier)
-        return result_message
+        return f"DRAW_CARD!{CARD_NAMES[card_drawn]}!{cards_left}!{self.state_digest()}"
 
     def pass_turn_input(self) -> str:
         """Processes PASS_TURN! input."""
         if not self.is_game_initiated():
-            self.logger.log_message("The game has not been initiated yet!", print_message=False)
+            self.logger.debug("The game has not been initiated yet!")
             return "dont-send"
 
         if self.has_everyone_passed():
@@ -123,13 +146,13 @@ class Gameplay:
             return "END_GAME!"
 
         if not self.is_my_turn():
-            self.logger.log_message("It's not your turn!")
+            self.logger.info("It's not your turn!")
             return "dont-send"
 
-        self.logger.log_message("Passed")
-        self.passes[self.current_turn] = True
+        self.logger.info("Passed")
+        self.players.set_passed(self.current_turn)
         self.advance_player_turn(self.own_turn_identifier)
-        return "PASS_TURN!"
+        return f"PASS_TURN!{self.state_digest()}"
 
     def initiate_game_input(self) -> List[str]:
         """Processes INITIATE_GAME! input - this can only be done by the leading player.
@@ -138,46 +161,75 @@ class Gameplay:
             A list of deck data.
         """
         if self.own_turn_identifier != 0:
-            self.logger.log_message("You are not the first player; you cannot initiate the game")
+            self.logger.info("You are not the first player; you cannot initiate the game")
             return []
 
+        if self.deck_mode == "seed":
+            self.logger.info("Agreeing on a shared seed for the deck")
+            # a new round cancels the current game, like it does for the other players
+            self.reset_gameplay_variables()
+            # the commit goes out with the next clock value, the stamp is newer than any round seen
+            latest_stamp = self.latest_round_tag[0] if self.latest_round_tag is not None else 0
+            tag = (max(self.clock(), latest_stamp) + 1, *self.player_id)
+            self.latest_round_tag = tag
+            self.seed_round = SeedRound(random.getrandbits(32), self.number_of_decks,
+                                        self.connected_peers + 1, self.own_turn_identifier, tag)
+            return [self.seed_round.commit_message(), *self.advance_seed_round()]
+
         self.current_turn = 0
         self.create_deck()
-        self.logger.log_message(f"Deck host created deck: {self.deck}", print_message=False)
+        self.logger.debug("Deck host created deck: %s", self.deck)
         deck_message = self.send_deck()
         return [deck_message]
 
-    def handle_incoming_commands(self, datagram: str, peer_index: int) -> List[str]:
+    def handle_incoming_commands(self, splitted_command: List[str],
+                                 peer_index: int) -> List[Union[str, Tuple[str, int]]]:
         """Handles the commands sent to connected peers (players).
 
         Args:
-            datagram: incoming message command as a datagram.
+            splitted_command: incoming message command, already split into fields by the codec.
             peer_index: index of the peer sending the command.
 
         Returns:
-            A list of resulting commands after processing.
+            A list of resulting commands after processing. A command is either a message for
+            every peer, or a (message, peer index) tuple for a single peer.
         """
         resulting_commands = []
-        splitted_command = datagram.split("!")
         command = splitted_command[0].upper()
 
-        self.logger.log_message(f"Handling command from peer: {datagram}", print_message=False)
+        self.logger.debug("Handling command from peer: %s", lambda: "!".join(splitted_command))
 
         if command == "CREATE_DECK":
             # incoming CREATE_DECK command is the same as starting the game
-            self.initialize_points()
-            self.initialize_passes()
+            self.initialize_players()
             self.create_deck_command(splitted_command)
+        elif command in ("SEED_COMMIT", "SEED_REVEAL"):
+            # return early, the game has not started yet
+            return self.seed_round_command(splitted_command, peer_index)
+        elif command == "SEED_DECK":
+            self.initialize_players()
+            self.seed_deck_command(splitted_command)
         elif command == "DRAW_CARD":
             resulting_commands.extend(self.draw_card_command(splitted_command, peer_index))
         elif command == "PASS_TURN":
             self.pass_turn_command(peer_index)
+            resulting_commands.extend(self.check_state_digest(splitted_command, 1, peer_index))
         elif command == "SYNC_ERROR":
-            self.logger.log_message("Sync error detected")
+            self.logger.info("Sync error detected")
             resulting_commands.append("REQUEST_DECK")
         elif command == "REQUEST_DECK":
-            self.logger.log_message("Peer requests deck values", print_message=False)
+            self.logger.debug("Peer requests deck values")
             resulting_commands.append(self.send_deck())
+        elif command == "SYNC_REQUEST":
+            # only the first player answers, a request that reached another seat, e.g. one sent
+            # before the seats changed, is left to the next digest check
+            if self.own_turn_identifier == 0:
+                self.logger.debug("Peer %s requests the game state", peer_index)
+                resulting_commands.append((self.sync_state_message(int(splitted_command[1])), peer_index))
+            else:
+                self.logger.debug("Ignoring a game state request of peer %s, only the first player answers", peer_index)
+        elif command == "SYNC_STATE":
+            self.apply_sync_state(splitted_command)
         elif command == "END_GAME":
             self.end_game()
             # return early so the peer doesn't send another end game command
@@ -189,9 +241,9 @@ class Gameplay:
             return ["END_GAME!"]
 
         if self.is_my_turn() and self.has_current_turn_passed():
-            self.logger.log_message("Automatically passed.")
-            resulting_commands.append("PASS_TURN!")
+            self.logger.info("Automatically passed.")
             self.advance_player_turn(self.own_turn_identifier)
+            resulting_commands.append(f"PASS_TURN!{self.state_digest()}")
 
         return resulting_commands
 
@@ -204,7 +256,110 @@ class Gameplay:
         """
         deck_values = splitted_command[1:]
         self.create_deck(deck_values)
-        self.logger.log_message(f"Deck created: {self.deck}", print_message=False)
+        self.logger.debug("Deck created: %s", self.deck)
+        if self.current_turn == -1:
+            self.current_turn = 0
+
+    def seed_round_command(self, splitted_command: List[str], peer_index: int) -> List[str]:
+        """Processes SEED_COMMIT! and SEED_REVEAL! commands.
+        The first commitment of a new round makes this player join the round with its own commitment.
+        Messages of a round older than the newest one seen, e.g. resent late, are ignored, so they
+        do not cancel the game a newer round started.
+
+        Args:
+            splitted_command: seed message syntax.
+            peer_index: index of the peer sending the command.
+
+        Returns:
+            A list of resulting commands.
+        """
+        resulting_commands = []
+        round_id = int(splitted_command[1])
+        finished = self.finished_seed_round
+        if finished is not None and finished.round_id == round_id:
+            # the player resends because it lacks a share, everyone had all commitments before revealing
+            return [(finished.share_message(), peer_index)]
+        current = self.seed_round is not None and self.seed_round.round_id == round_id
+        if splitted_command[0] == "SEED_COMMIT":
+            tag = parse_tag(splitted_command[4:7])
+            if not current:
+                if self.latest_round_tag is not None and tag <= self.latest_round_tag:
+                    self.logger.debug("Ignoring a seed commitment of an earlier round %s", round_id)
+                    return []
+                self.reset_gameplay_variables()
+                self.latest_round_tag = tag
+                self.seed_round = SeedRound(round_id, int(splitted_command[2]),
+                                            self.connected_peers + 1, self.own_turn_identifier, tag)
+                resulting_commands.append(self.seed_round.commit_message())
+            self.seed_round.add_commit(peer_index, splitted_command[3])
+        elif current:
+            self.seed_round.add_reveal(peer_index, splitted_command[2])
+        else:
+            self.logger.debug("Ignoring a seed share of an unknown round")
+
+        resulting_commands.extend(self.advance_seed_round())
+        return resulting_commands
+
+    def advance_seed_round(self) -> List[str]:
+        """Reveals the own share once everyone has committed, and starts the game once
+        every share is revealed.
+
+        Returns:
+            The SEED_REVEAL message, if it is time to reveal.
+        """
+        if self.seed_round is None:
+            return []
+        reveal = self.seed_round.reveal_message()
+        try:
+            seed = self.seed_round.seed()
+        except ValueError as e:
+            self.logger.warn("Seed round failed: %s", e, print_message=True)
+            self.seed_round = None
+            return []
+
+        if seed is not None:
+            self.logger.info("Deck created from a shared seed")
+            self.seed = seed
+            self.seed_decks = self.seed_round.number_of_decks
+            self.deck = deck_from_seed(seed, self.seed_decks)
+            self.finished_seed_round = self.seed_round
+            self.seed_round = None
+            self.initialize_players()
+            self.current_turn = 0
+            if self.is_my_turn():
+                self.logger.info("It's now your turn!")
+        return [reveal] if reveal else []
+
+    def resend_seed_round(self) -> List[str]:
+        """Returns the own messages of the seed round in progress again, in case some were lost.
+        The round is given up after max_seed_resends, e.g. because a player left during it.
+
+        Returns:
+            The SEED_COMMIT and, once revealed, the SEED_REVEAL message, or [] if there is no round.
+        """
+        if self.seed_round is None:
+            return []
+        if self.seed_round.resends >= self.max_seed_resends:
+            self.logger.warn("Seed round got no answer from every player, start the game again",
+                             print_message=True)
+            self.seed_round = None
+            return []
+        self.seed_round.resends += 1
+        self.logger.debug("Sending seed round %s again", self.seed_round.round_id)
+        return self.seed_round.resend_messages()
+
+    def seed_deck_command(self, splitted_command: List[str]):
+        """Processes SEED_DECK! command, rebuilds the shoe from its seed and moves to the cursor.
+        Also, initializes the game if game has not been started yet.
+
+        Args:
+            splitted_command: seed deck message syntax.
+        """
+        self.seed = bytes.fromhex(splitted_command[1])
+        self.seed_decks = int(splitted_command[2])
+        self.deck = deck_from_seed(self.seed, self.seed_decks)
+        self.deck.move_to(int(splitted_command[3]))
+        self.logger.debug("Deck rebuilt from seed: %s", self.deck)
         if self.current_turn == -1:
             self.current_turn = 0
 
@@ -219,27 +374,26 @@ class Gameplay:
             A list of resulting commands.
         """
         resulting_commands = []
-        card_drawn = splitted_command[1]
+        card_drawn = CARD_CODES[splitted_command[1]]
         deck_length = int(splitted_command[2])
-        self.logger.log_message(f"Peer drew card: {card_drawn}")
+        self.logger.info("Peer drew card: %s", splitted_command[1])
         self.add_points(card_drawn)
 
-        self.logger.log_message(f"Current length of peer's deck: {deck_length}", False)
+        self.logger.debug("Current length of peer's deck: %s", deck_length)
 
-        if card_drawn in self.deck:
-            drawn_card_index = self.deck.index(card_drawn)
-            self.deck = self.deck[drawn_card_index + 1:]
-        else:
-            self.logger.log_message("Card not found in deck; possible desynchronization", False)
-            resulting_commands.extend(["SYNC_ERROR!", "REQUEST_DECK"])
+        # the peer's deck length tells where in the shoe the card was drawn from
+        in_sync = self.deck.match_draw(card_drawn, deck_length)
+        self.advance_player_turn(peer_index)
 
-        if deck_length != len(self.deck):
-            self.logger.log_message("Detected different deck lengths.", False)
-            self.logger.log_message(f"Own deck length: {len(self.deck)}. Peer deck length: {deck_length}", False)
-            self.logger.log_message("Sending a sync error message", False)
+        if len(splitted_command) > 3:
+            # the digest covers the shoe as well, so it also catches a card that did not match
+            return self.check_state_digest(splitted_command, 3, peer_index)
+        if not in_sync:
+            # peers without state digests only understand a full deck resend
+            self.logger.debug("Card not found at the peer's deck position; possible desynchronization")
+            self.logger.debug("Own deck length: %s. Peer deck length: %s", len(self.deck), deck_length)
+            self.logger.debug("Sending a sync error message")
             resulting_commands.extend(["SYNC_ERROR!", "REQUEST_DECK"])
-
-        self.advance_player_turn(peer_index)
         return resulting_commands
 
     def pass_turn_command(self, peer_index: int):
@@ -248,17 +402,122 @@ class Gameplay:
         Args:
             peer_index: The index of the peer.
         """
-        self.logger.log_message("Peer passed their turn")
-        self.passes[self.current_turn] = True
+        self.logger.info("Peer passed their turn")
+        self.players.set_passed(self.current_turn)
         self.advance_player_turn(peer_index)
 
+    def state_digest(self) -> int:
+        """Returns a 32 bit hash of the game state every peer should agree on:
+        the cards left in the shoe, the turn, the points, the passes and the losers.
+        The shoe and the seats keep their own digests up to date, so this does not walk them."""
+        players_digest = mix64((self.players.digest + (self.current_turn & MASK64)) & MASK64)
+        return mix64(self.deck.digest ^ players_digest) & 0xFFFFFFFF
+
+    def shoe_digest(self) -> int:
+        """Returns a 32 bit hash of the whole shoe, drawn cards included."""
+        return zlib.crc32(self.deck.cards.tobytes())
+
+    def check_state_digest(self, splitted_command: List[str], digest_index: int,
+                           peer_index: int) -> List[Tuple[str, int]]:
+        """Compares the state digest of a DRAW_CARD or PASS_TURN with the own state after applying it.
+
+        The first player's state is the reference. If the states differ, the first player sends
+        its state to the sender of the command, and every other player asks the first player for
+        its state, so a desync costs a message or two per peer that noticed it.
+
+        Args:
+            splitted_command: The command split into fields.
+            digest_index: The field of the command that holds the digest.
+            peer_index: The index of the peer that sent the command.
+
+        Returns:
+            The SYNC_STATE or SYNC_REQUEST to send if the states differ, otherwise nothing.
+        """
+        if len(splitted_command) <= digest_index or not self.is_game_initiated():
+            return []
+        if int(splitted_command[digest_index]) == self.state_digest():
+            return []
+        if self.own_turn_identifier == 0:
+            self.logger.debug("Game state of peer %s differs, sending it our state", peer_index)
+            return [(self.sync_state_message(), peer_index)]
+        self.logger.debug("Game state differs from peer %s, requesting the first player's state", peer_index)
+        return [(f"SYNC_REQUEST!{self.shoe_digest()}", 0)]
+
+    def sync_state_message(self, requester_shoe_digest: Optional[int] = None) -> str:
+        """Creates a SYNC_STATE message with the own game state. The whole shoe, drawn cards
+        included, is only sent if the requester's shoe differs from ours, otherwise the cursor is enough.
+
+        Args:
+            requester_shoe_digest: The shoe digest of the requesting peer. Default: None, unknown.
+        """
+        message = (f"SYNC_STATE!{self.current_turn}!{self.deck.cursor}!{self.players.pass_mask}"
+                   f"!{self.players.loser_mask}!{self.players.points_field()}")
+        if requester_shoe_digest != self.shoe_digest():
+            message += "!" + "!".join(CARD_NAMES[card] for card in self.deck.cards)
+        return message
+
+    def apply_sync_state(self, splitted_command: List[str]):
+        """Replaces the own game state with the state of a SYNC_STATE message.
+
+        Args:
+            splitted_command: The SYNC_STATE message split into fields.
+        """
+        self.logger.info("Synchronizing the game state with a peer")
+        cards = [card for card in splitted_command[6:] if card]
+        if cards:
+            # the whole shoe, so the shoe digest matches the sender's from now on
+            self.deck = Deck.from_names(cards)
+        self.deck.move_to(int(splitted_command[2]))
+        self.current_turn = int(splitted_command[1])
+        points = [int(value) for value in splitted_command[5].split(",") if value]
+        self.players = PlayerStates.from_masks(points, int(splitted_command[3]), int(splitted_command[4]))
+
+    def snapshot_messages(self) -> List[str]:
+        """Returns the messages that rebuild the current game with apply_event: the whole shoe,
+        drawn cards included, and a SYNC_STATE without cards. Nothing if no game is running."""
+        if not self.is_game_initiated():
+            return []
+        if self.seed is not None:
+            deck_message = f"SEED_DECK!{self.seed.hex()}!{self.seed_decks}!{self.deck.cursor}"
+        else:
+            deck_message = "CREATE_DECK!" + "!".join(CARD_NAMES[card] for card in self.deck.cards)
+        return [deck_message, self.sync_state_message(self.shoe_digest())]
+
+    def apply_event(self, splitted_command: List[str], seat: int):
+        """Applies a command of the event log again. Unlike handle_incoming_commands it does not
+        check digests, answer or pass automatically: the messages this player sent in response
+        are in the log as well.
+
+        Args:
+            splitted_command: The command split into fields.
+            seat: The seat of the player who sent the command.
+        """
+        command = splitted_command[0]
+        if command == "CREATE_DECK":
+            self.initialize_players()
+            self.create_deck_command(splitted_command)
+        elif command == "SEED_DECK":
+            self.initialize_players()
+            self.seed_deck_command(splitted_command)
+        elif command == "DRAW_CARD":
+            card_drawn = CARD_CODES[splitted_command[1]]
+            self.add_points(card_drawn)
+            self.deck.match_draw(card_drawn, int(splitted_command[2]))
+            self.advance_player_turn(seat)
+        elif command == "PASS_TURN":
+            self.pass_turn_command(seat)
+        elif command == "SYNC_STATE":
+            self.apply_sync_state(splitted_command)
+        elif command == "END_GAME":
+            self.end_game()
+
     def has_current_turn_passed(self) -> bool:
         """Checks if the player whose turn it is has passed.
 
         Returns:
             True if the current player has passed, False otherwise.
         """
-        return self.passes[self.current_turn]
+        return self.players.has_passed(self.current_turn)
 
     def is_my_turn(self) -> bool:
         """Checks if it's the player's turn.
@@ -291,47 +550,52 @@ class Gameplay:
             self.current_turn = peer_index+1
 
         # keep current_turn in bounds
-        while self.current_turn > self.connected_peers:
-            self.current_turn -= (self.connected_peers + 1)
+        seats = self.seats_in_game()
+        while self.current_turn >= seats:
+            self.current_turn -= seats
 
         if self.is_my_turn():
-            self.logger.log_message("It's now your turn!")
-        self.logger.log_message(str(self.current_turn) + "th player's turn", False)
+            self.logger.info("It's now your turn!")
+        self.logger.debug("%sth player's turn", self.current_turn)
 
     def send_deck(self) -> str:
         """Creates a CREATE_DECK! request, send deck data to the peers.
+        A shoe built from a seed is sent as SEED_DECK!seed!decks!cursor instead.
 
         Returns:
             The deck data to the peers.
         """
-        deck_message = "CREATE_DECK!" + "!".join(self.deck)
-        self.logger.log_message(f"Created a deck importation request: {deck_message}", print_message=False)
+        if self.seed is not None:
+            return f"SEED_DECK!{self.seed.hex()}!{self.seed_decks}!{self.deck.cursor}"
+        deck_message = "CREATE_DECK!" + "!".join(self.deck.names())
+        self.logger.debug("Created a deck importation request: %s", deck_message)
         return deck_message
 
-    def add_points(self, card: str):
+    def add_points(self, card: int):
         """Adds points to player's total point value based on the value of the drawn card.
 
         Args:
-            card: The card drawn.
+            card: The code of the card drawn.
         """
-        card_value = int(card[1:])
+        card_value = CARD_VALUES[card]
 
-        self.points[self.current_turn] += card_value
-        self.logger.log_message("Updated points: " + str(self.points), False)
+        points = self.players.add_points(self.current_turn, card_value)
+        self.logger.debug("Updated points: %s", self.players)
 
         own_turn = self.is_my_turn()
         if own_turn:
-            self.logger.log_message(f"Added {card_value} points for card: {card}. Your point total: {self.points[self.current_turn]}")
+            self.logger.info("Added %s points for card: %s. Your point total: %s",
+                             card_value, CARD_NAMES[card], points)
         else:
-            self.logger.log_message(f"Added {card_value} points for card: {card}. Peer's point total: {self.points[self.current_turn]}")
+            self.logger.info("Added %s points for card: %s. Peer's point total: %s",
+                             card_value, CARD_NAMES[card], points)
 
-        if self.points[self.current_turn] > 21:
-            self.passes[self.current_turn] = True
-            self.losers.append(self.current_turn)
+        if points > 21:
+            self.players.set_lost(self.current_turn)
             if own_turn:
-                self.logger.log_message("Points went over 21, you lost this game and automatically passed for the rest of the game.")
+                self.logger.info("Points went over 21, you lost this game and automatically passed for the rest of the game.")
             else:
-                self.logger.log_message("Points of a peer went over 21, they lost this game and automatically passed for the rest of the game.")
+                self.logger.info("Points of a peer went over 21, they lost this game and automatically passed for the rest of the game.")
 
     def update_order_number(self, order_number):
         """Update own turn identifier.
@@ -340,105 +604,124 @@ class Gameplay:
             order_number: The order number of the player.
         """
         self.own_turn_identifier = int(order_number)
-        self.logger.log_message("own_turn_identifier: " + str(order_number), False)
+        self.logger.debug("own_turn_identifier: %s", order_number)
 
     def increment_connected_peers_count(self):
         """Increment value to know which player is the last."""
         self.connected_peers += 1
-        self.logger.log_message("connected_peers: " + str(self.connected_peers), False)
+        self.logger.debug("connected_peers: %s", self.connected_peers)
 
     def end_game(self):
         """Ends the game."""
-        self.logger.log_message("Ending the game, calculating winner...")
+        self.logger.info("Ending the game, calculating winner...")
         self.decide_winner()
-        self.logger.log_message("Game ended, ready for a new game.")
+        self.logger.info("Game ended, ready for a new game.")
         self.reset_gameplay_variables()
 
         # return value is only used during development
         return "END_GAME!"
 
     def decide_winner(self):
-        """Calculate which player won."""
-        for i in self.losers:
-            self.points[i] = 0
-
-        most_points = 0
-        draw = False
-        for key in self.points:
-            if self.points[key] > most_points:
-                draw = False
-                most_points = self.points[key]
-            elif self.points[key] == most_points:
-                draw = True
-                most_points = self.points[key]
+        """Calculate which player won. Losers score 0, and nobody wins if the most points are
+        shared or 0."""
+        most_points, leaders = self.players.leader()
+        draw = leaders > 1 or (leaders == 1 and most_points == 0)
+        own_seat = self.own_turn_identifier
 
         if draw:
-            self.logger.log_message("Draw!")
-        elif self.points[self.own_turn_identifier] == most_points:
-            self.logger.log_message("You won!")
+            self.logger.info("Draw!")
+        elif 0 <= own_seat < len(self.players) and self.players.score(own_seat) == most_points:
+            self.logger.info("You won!")
         else:
-            self.logger.log_message("You lost!")
+            self.logger.info("You lost!")
 
     def has_everyone_passed(self):
         """Checks if everyone has passed."""
-        self.logger.log_message("Checking if everyone has passed: " + str(self.passes), False)
-        return all(value is True for value in self.passes.values())
-
-    def initialize_passes(self):
-        """Adds all uninitialized pass values."""
-        self.logger.log_message("Initializing self.passes", False)
-        # +1 in range to iniate this peer as well
-        for i in range(self.connected_peers+1):
-            if not i in self.passes:
-                self.passes[i] = False
-        self.logger.log_message("Completed self.passes: " + str(self.passes), False)
-
-    def initialize_points(self):
-        """Adds all uninitialized points values."""
-        self.logger.log_message("Initializing self.points", False)
-        # +1 in range to iniate this peer as well
-        for i in range(self.connected_peers+1):
-            if not i in self.points:
-                self.points[i] = 0
-        self.logger.log_message("Completed self.points: " + str(self.points), False)
-
-    def synchronize_turn_orders(self, disconnected_peer_index: int, addresses: List[Tuple[str, int]]):
+        self.logger.debug("Checking if everyone has passed: %s", self.players)
+        return self.players.everyone_passed()
+
+    def initialize_players(self):
+        """Adds the seats that have no points and passes yet. Players who joined during a game
+        only get a seat when the next game starts, so a resent deck does not seat them."""
+        if self.is_game_initiated():
+            return
+        # +1 to iniate this peer as well
+        self.players.resize(self.connected_peers + 1)
+        self.logger.debug("Initialized players: %s", self.players)
+
+    def seats_in_game(self) -> int:
+        """Returns how many seats take turns: the seats of the current game, or every player of
+        the table between games."""
+        return len(self.players) if self.players else self.connected_peers + 1
+
+    def is_spectator(self, seat: int) -> bool:
+        """Checks if a seat only watches the current game, because its player joined during it.
+
+        Args:
+            seat: The seat of the player.
+        """
+        return self.is_game_initiated() and seat >= len(self.players)
+
+    def remove_spectator(self, seat: int):
+        """Handles a player who left while watching the current game. The seats of the game
+        do not change, only the players after it move up one seat.
+
+        Args:
+            seat: The seat of the player that left.
+        """
+        own_index = self.members.seat(self.player_id)
+        if own_index is not None and own_index > seat:
+            self.own_turn_identifier -= 1
+        self.connected_peers -= 1
+
+    def apply_game_snapshot(self, splitted_command: List[str]):
+        """Takes over the game in progress from the SYNC_STATE message of a game snapshot.
+        A player who joined during the game watches it and is seated from the next game on.
+
+        Args:
+            splitted_command: The SYNC_STATE message split into fields.
+        """
+        self.apply_sync_state(splitted_command)
+        if self.is_spectator(self.own_turn_identifier):
+            self.logger.info("A game is in progress, you are watching it and will be seated for the next game.")
+
+    def synchronize_turn_orders(self, disconnected_peer_index: int):
         """Adjusts the states related to the turn orders based on the position of the disconnected peer.
+        The disconnected peer has to still be in self.members.
 
         Args:
             disconnected_peer_index: The index of the peer that disconnected.
-            addresses: player network addresses
         """
 
         # case in which disconnected peer was the first element of the list
         if disconnected_peer_index == 0:
             self._synch_turn_top()
             if self.is_my_turn() and not self.has_current_turn_passed():
-                self.logger.log_message("It's now your turn!")
+                self.logger.info("It's now your turn!")
             elif self.is_my_turn():
                 return self.pass_turn_input()
             return
 
-        # case in which disconnected peer was the last element of the list
-        if disconnected_peer_index == len(addresses) - 1:
+        # case in which disconnected peer was the last element of the list, or the last seat
+        # of the game if players who joined during it are watching
+        last_seat = len(self.players) if self.is_game_initiated() else len(self.members) - 1
+        if disconnected_peer_index == last_seat:
             self._synch_turn_bottom(disconnected_peer_index)
             if self.is_my_turn() and not self.has_current_turn_passed():
-                self.logger.log_message("It's now your turn!")
+                self.logger.info("It's now your turn!")
             elif self.is_my_turn():
                 return self.pass_turn_input()
             return
 
         # all the other cases which do not fit the first two
-        for index, (ip, port) in enumerate(addresses):
-            if (ip, port) == self.player_id:
-                if index > disconnected_peer_index:
-                    self.own_turn_identifier -= 1
-                break
+        own_index = self.members.seat(self.player_id)
+        if own_index is not None and own_index > disconnected_peer_index:
+            self.own_turn_identifier -= 1
 
         self.connected_peers -= 1
 
         if self.is_my_turn() and not self.has_current_turn_passed():
-            self.logger.log_message("It's now your turn!")
+            self.logger.info("It's now your turn!")
         elif self.is_my_turn():
             return self.pass_turn_input()
         return None
@@ -459,33 +742,18 @@ class Gameplay:
         Args:
             disconnected_peer_index: The index of the disconnected peer.
         """
-        if self.connected_peers == 1 and self.current_turn > 0:
-            self.current_turn -= 1
-            self.connected_peers -= 1
-        elif self.connected_peers == disconnected_peer_index and self.current_turn == self.connected_peers:
+        # players watching the game are seated after the last seat
+        own_index = self.members.seat(self.player_id)
+        if own_index is not None and own_index > disconnected_peer_index:
+            self.own_turn_identifier -= 1
+        if self.current_turn == disconnected_peer_index:
             self.current_turn = 0
-            self.connected_peers -= 1
-        else:
-            self.connected_peers -= 1
-
-    def synchronize_passes(self, disconnected_peer_index: int):
-        """Removes the disconnected peer's data from the passes dictionary and re-indexes the keys accordingly.
-
-        Args:
-            disconnected_peer_index: The index of the disconnected peer.
-        """
-        if self.passes:
-            if disconnected_peer_index in self.passes:
-                self.passes.pop(disconnected_peer_index)
-            self.passes = {index: value for index, value in enumerate(self.passes.values())}
+        self.connected_peers -= 1
 
-    def synchronize_points(self, disconnected_peer_index: int):
-        """Removes the disconnected peer's data from the points dictionary and re-indexes the keys accordingly.
+    def synchronize_players(self, disconnected_peer_index: int):
+        """Removes the disconnected peer's points and passes, the players after it move down one seat.
 
         Args:
             disconnected_peer_index: The index of the disconnected peer.
         """
-        if self.points:
-            if disconnected_peer_index in self.points:
-                self.points.pop(disconnected_peer_index)
-            self.points = {index: value for index, value in enumerate(self.points.values())}
+        self.players.remove(disconnected_peer_index)
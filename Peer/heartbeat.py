@@ -1,6 +1,7 @@
-from typing import Tuple, Dict, TYPE_CHECKING
-from time import time
-from twisted.internet import reactor
+from typing import Tuple, Dict, Optional, TYPE_CHECKING
+from phi_accrual import PhiAccrualDetector
+from swim import SwimDetector
+from membership import LEFT
 
 if TYPE_CHECKING:
     from peer import Peer
@@ -8,83 +9,109 @@ if TYPE_CHECKING:
 class HeartbeatManager:
     """Manages heartbeat by constantly checking peers to detect any faults within the system.
 
+    In the default "all-to-all" mode every peer sends a heartbeat to every other peer each
+    interval, unless it already sent that peer something else within the interval: every
+    message from a peer counts as a heartbeat, so during play few pure heartbeats are sent.
+    A heartbeat to a peer is due one interval after the last message to it, and the send loop
+    wakes up at the earliest such deadline.
+    In "swim" mode failure detection is done by a SwimDetector instead, which pings one peer
+    per interval and gossips suspicions and failures.
+
+    If phi_threshold is given, "all-to-all" mode uses a PhiAccrualDetector instead of the fixed
+    timeout, which adapts to how regular each peer's heartbeats are.
+
     Args:
         peer: Reference to the Peer instance.
         heartbeat_interval: How often to send heartbeats (seconds). Default: 1s.
         timeout: How long to wait before considering a peer disconnected (seconds). Default: 2s.
+        mode: "all-to-all" or "swim". Default: "all-to-all".
+        phi_threshold: Use phi accrual detection with this threshold instead of the timeout.
+            Default: None, use the timeout.
     """
 
     def __init__(self, peer: 'Peer', heartbeat_interval: float = 1.0,
-                 timeout: float = 2.0):
+                 timeout: float = 2.0, mode: str = "all-to-all", phi_threshold: Optional[float] = None):
         self.peer = peer # we can't import the Peer type, because that would lead to circular import
+        self.reactor = peer.reactor
+        self.members = peer.members
+        self.logger = peer.logger.get_module_logger("heartbeat")
         self.heartbeat_interval = heartbeat_interval
         self.timeout = timeout
         self.last_heartbeats: Dict[Tuple[str, int], float] = {}
         self.check_loop = None
         self.send_loop = None
+        # a heartbeat that is due this close to now is sent already, so the send loop does not
+        # wake up again for every few milliseconds of clock drift
+        self.send_slack = heartbeat_interval / 100
         self.max_send_retries = 3
         self.retry_delay = 0.5
+        self.mode = mode
+        self.swim = SwimDetector(self) if mode == "swim" else None
+        self.phi = (PhiAccrualDetector(heartbeat_interval, phi_threshold)
+                    if phi_threshold is not None else None)
+        self.members.subscribe(self.handle_membership_change)
 
     def start(self):
         """Start the heartbeat checking and sending loops."""
         try:
-            self.send_loop = reactor.callLater(0, self.send_heartbeats)
-            self.check_loop = reactor.callLater(0, self.check_connections)
+            if self.swim is not None:
+                self.swim.start()
+                return
+            self.send_loop = self.reactor.callLater(0, self.send_heartbeats)
+            self.check_loop = self.reactor.callLater(0, self.check_connections)
         except Exception as e:
-            self.peer.logger.log_message(
-                f"Error starting heartbeat manager: {e}",
-                print_message=False)
+            self.logger.warn("Error starting heartbeat manager: %s", e)
 
     def stop(self):
         """Stop the heartbeat checking and sending loops."""
         try:
+            if self.swim is not None:
+                self.swim.stop()
             if self.check_loop and self.check_loop.active():
                 self.check_loop.cancel()
             if self.send_loop and self.send_loop.active():
                 self.send_loop.cancel()
         except Exception as e:
-            self.peer.logger.log_message(
-                f"Error stopping heartbeat manager: {e}",
-                print_message=False)
+            self.logger.warn("Error stopping heartbeat manager: %s", e)
 
     def send_heartbeats(self, retry_count: int = 0):
-        """Send heartbeat messages to all connected peers with retry logic.
+        """Send heartbeat messages, with retry logic, to the connected peers that were not sent
+        anything else within the last interval, and wake up again when the next one is due.
 
         Args:
             retry_count: Number of retries attempted so far for failed heartbeats.
         """
         try:
-            for peer_address in self.peer.addresses:
+            now = self.reactor.seconds()
+            next_send = now + self.heartbeat_interval
+            for peer_address in self.members:
+                if peer_address == self.peer.id:
+                    continue
+                due = self.peer.last_sent.get(peer_address, 0.0) + self.heartbeat_interval
+                if due > now + self.send_slack:
+                    next_send = min(next_send, due)
+                    continue
                 try:
-                    self.peer.transport.write(
-                        "HEARTBEAT!".encode("utf-8"), peer_address)
+                    self.peer.send_message("HEARTBEAT", peer_address)
                 except PermissionError:
                     if retry_count < self.max_send_retries:
-                        reactor.callLater(
+                        self.reactor.callLater(
                             self.retry_delay,
                             self.send_heartbeats,
                             retry_count + 1
                         )
                         return
                     else:
-                        self.peer.logger.log_message(
-                            f"Failed to send heartbeat to {peer_address} after {self.max_send_retries} retries",
-                            print_message=False
-                        )
+                        self.logger.warn("Failed to send heartbeat to %s after %s retries", peer_address, self.max_send_retries)
                         self.handle_send_failure(peer_address)
                 except Exception as e:
-                    self.peer.logger.log_message(
-                        f"Error sending heartbeat to {peer_address}: {e}",
-                        print_message=False
-                    )
+                    self.logger.warn("Error sending heartbeat to %s: %s", peer_address, e)
                     self.handle_send_failure(peer_address)
-            self.send_loop = reactor.callLater(
-                self.heartbeat_interval, self.send_heartbeats, 0)
+            self.send_loop = self.reactor.callLater(
+                max(next_send - now, self.send_slack), self.send_heartbeats, 0)
         except Exception as e:
-            self.peer.logger.log_message(
-                f"Error in send_heartbeats: {e}",
-                print_message=False)
-            self.send_loop = reactor.callLater(
+            self.logger.warn("Error in send_heartbeats: %s", e)
+            self.send_loop = self.reactor.callLater(
                 self.heartbeat_interval, self.send_heartbeats, 0)
 
     def handle_send_failure(self, peer_address: Tuple[str, int]):
@@ -98,25 +125,31 @@ class HeartbeatManager:
     def check_connections(self):
         """Check for peers that haven't sent heartbeats recently."""
         try:
-            current_time = time()
+            current_time = self.reactor.seconds()
             disconnected_peers = []
 
-            for peer_address in self.peer.addresses:
+            for peer_address in self.members:
+                if peer_address == self.peer.id:
+                    continue
                 if peer_address not in self.last_heartbeats:
-                    self.last_heartbeats[peer_address] = current_time
+                    self.record_heartbeat(peer_address)
+                elif self.phi is not None:
+                    if not self.phi.is_available(peer_address, current_time):
+                        disconnected_peers.append(peer_address)
                 elif current_time - self.last_heartbeats[peer_address] > self.timeout:
                     disconnected_peers.append(peer_address)
 
+            if self.phi is not None:
+                self.logger.debug("phi: %s", self.phi_values)
+
             for peer_address in disconnected_peers:
                 self.notify_disconnection_to_peers(peer_address)
 
-            self.check_loop = reactor.callLater(
+            self.check_loop = self.reactor.callLater(
                 self.heartbeat_interval, self.check_connections)
         except Exception as e:
-            self.peer.logger.log_message(
-                f"Error in check_connections: {e}",
-                print_message=True)
-            self.check_loop = reactor.callLater(
+            self.logger.warn("Error in check_connections: %s", e, print_message=True)
+            self.check_loop = self.reactor.callLater(
                 self.heartbeat_interval, self.check_connections)
 
     def notify_disconnection_to_peers(self, peer_address: Tuple[str, int]):
@@ -125,21 +158,29 @@ class HeartbeatManager:
         Args:
             peer_address: Address of disconnected peer.
         """
-        if peer_address in self.peer.addresses:
-            self.peer.logger.log_message(
-                "Peer disconnected due to heartbeat timeout.", print_message=True
-            )
-            self.peer.logger.log_message(f"{peer_address} timeouted.",False)
+        if peer_address in self.members:
+            self.logger.info("Peer disconnected due to heartbeat timeout.")
+            self.logger.debug("%s timeouted.", peer_address)
 
             message = f"PEER_DISCONNECTED!{peer_address[0]}!{peer_address[1]}"
-            for addr in self.peer.addresses:
+            for addr in self.members:
                 try:
-                    self.peer.transport.write(message.encode("utf-8"), addr)
+                    self.peer.send_message(message, addr)
                 except Exception as e:
-                    self.peer.logger.log_message(
-                        f"Error notifying {addr} about disconnect: {e}",
-                        print_message=False
-                    )
+                    self.logger.warn("Error notifying %s about disconnect: %s", addr, e)
+
+    def handle_membership_change(self, change: str, peer_address: Tuple[str, int], seat: int):
+        """Forgets a peer that left, so a peer that rejoins from the same address starts fresh.
+
+        Args:
+            change: membership.JOINED or membership.LEFT.
+            peer_address: Address of the peer.
+            seat: Seat of the peer.
+        """
+        if change == LEFT:
+            self.last_heartbeats.pop(peer_address, None)
+            if self.phi is not None:
+                self.phi.forget(peer_address)
 
     def record_heartbeat(self, peer_address: Tuple[str, int]):
         """Record that we received a heartbeat from a peer.
@@ -148,9 +189,40 @@ class HeartbeatManager:
             peer_address: Address of the peer that sent the heartbeat.
         """
         try:
-            self.last_heartbeats[peer_address] = time()
+            now = self.reactor.seconds()
+            self.last_heartbeats[peer_address] = now
+            if self.phi is not None:
+                self.phi.heartbeat(peer_address, now)
         except Exception as e:
-            self.peer.logger.log_message(
-                f"Error recording heartbeat from {peer_address}: {e}",
-                print_message=False
-            )
+            self.logger.warn("Error recording heartbeat from %s: %s", peer_address, e)
+
+    def get_phi(self, peer_address: Tuple[str, int]) -> Optional[float]:
+        """Returns the current phi of a peer, or None if phi accrual detection is not used.
+
+        Args:
+            peer_address: Address of the peer.
+        """
+        if self.phi is None:
+            return None
+        return self.phi.phi(peer_address, self.reactor.seconds())
+
+    def phi_values(self) -> Dict[Tuple[str, int], float]:
+        """Returns the current phi of every peer, for tuning the threshold."""
+        if self.phi is None:
+            return {}
+        now = self.reactor.seconds()
+        return {addr: round(self.phi.phi(addr, now), 2) for addr in self.members if addr != self.peer.id}
+
+    def handle_swim_message(self, splitted_command, peer_address: Tuple[str, int]):
+        """Passes a SWIM message to the SWIM detector. Ignored outside "swim" mode.
+
+        Args:
+            splitted_command: The message split into fields.
+            peer_address: Address of the peer that sent the message.
+        """
+        if self.swim is None:
+            return
+        try:
+            self.swim.handle_message(splitted_command, peer_address)
+        except (IndexError, ValueError) as e:
+            self.logger.warn("Error handling SWIM message from %s: %s", peer_address, e)
@@ -0,0 +1,157 @@
+import functools
+import os
+from typing import Dict, List, Tuple
+from twisted.internet.protocol import DatagramProtocol
+from twisted.internet import reactor as twisted_reactor
+import codec
+from logger import Logger
+from membership import JOINED, LEFT
+from peer import Peer
+
+
+class PeerHost(DatagramProtocol):
+    """Plays the seats of many tables in one process, on one UDP socket.
+
+    Every table is played by its own Peer, with its own Gameplay, clocks, reliable channel and
+    membership, but they share the socket, the log writer, and what was last sent to each host.
+    Datagrams for a table other than 0 come in a TABLE frame with the table id (see codec.py), and
+    the host passes them to the Peer of that table. The server seats a host at most once per table,
+    so the peers of a table still know each other by (IP, port).
+
+    Liveness is shared per remote host as well: a datagram from a host counts as a heartbeat for
+    every table we play with it, and a message to a host from any table counts as sent to it, so
+    two hosts exchange one heartbeat per interval however many tables they share.
+
+    Args:
+        host: The server host address (network address or 'localhost').
+        own_port: The port number of the host.
+        rooms: The name of the room each table joins, "" to let the server pick one.
+        reactor: The reactor that runs the timers, e.g. an aio.AsyncioReactor. Default: the Twisted reactor.
+        input_reader: Called with a callback for every line of user input, to read input in the
+            reactor thread. Default: None, input() is called in a thread of the reactor.
+        event_log: Directory of the event logs, each table logs to its own subdirectory. Default: None, no log.
+        peer_options: Passed on to every Peer, e.g. protocol_version, max_seats or reliable.
+    """
+
+    def __init__(self, host, own_port, rooms: List[str], reactor=None, input_reader=None,
+                 event_log: str = None, **peer_options):
+        self.reactor = reactor if reactor is not None else twisted_reactor
+        self.input_reader = input_reader
+        # the tables log through their own Loggers into this one, which owns the writer thread
+        self.logger = Logger(("host", own_port))
+        self.sessions: Dict[int, Peer] = {}
+        # the tables each remote host plays with us, so its datagrams count as heartbeats for all of them
+        self.remote_tables: Dict[Tuple[str, int], Dict[int, Peer]] = {}
+        # the line handlers of the tables that are seated, see add_input_handler
+        self.input_handlers = {}
+        self.reading_input = False
+        self.last_sent = {}
+        for table, room in enumerate(rooms):
+            session = Peer(host, own_port, room=room, reactor=self.reactor,
+                           input_reader=functools.partial(self.add_input_handler, table),
+                           event_log=os.path.join(event_log, f"table-{table}") if event_log is not None else None,
+                           table=table, log_sink=self.logger, **peer_options)
+            session.last_sent = self.last_sent
+            session.members.subscribe(functools.partial(self.handle_membership_change, session))
+            self.sessions[table] = session
+
+    def startProtocol(self):
+        """Starts every table on the shared socket, which asks the server for a seat."""
+        for session in self.sessions.values():
+            session.transport = self.transport
+            session.startProtocol()
+
+    def stopProtocol(self):
+        """Stops every table, which tells the server that it left."""
+        for session in self.sessions.values():
+            session.stopProtocol()
+        self.logger.close()
+
+    def configure_levels(self, level_specs: List[str]):
+        """Applies level settings given at startup to the logger of every table.
+
+        Args:
+            level_specs: The level settings, see Logger.configure_levels.
+        """
+        self.logger.configure_levels(level_specs)
+        for session in self.sessions.values():
+            session.logger.configure_levels(level_specs)
+
+    def datagramReceived(self, datagram: bytes, addr):
+        """Passes a datagram to the Peer of its table, and counts it as a heartbeat for the
+        other tables played with the sender.
+
+        Args:
+            datagram: The received message as a datagram.
+            addr: The address of the sender.
+        """
+        try:
+            table, datagram = codec.unwrap_table(datagram)
+        except ValueError as e:
+            self.logger.warn("Could not decode datagram from %s: %s", addr, e)
+            return
+        session = self.sessions.get(table)
+        if session is None:
+            self.logger.debug("Dropping a datagram from %s for unknown table %s", addr, table)
+            return
+        for other in self.remote_tables.get(addr, {}).values():
+            if other is not session:
+                other.heartbeat_manager.record_heartbeat(addr)
+        session.handle_datagram(datagram, addr)
+
+    def handle_membership_change(self, session: Peer, change: str, addr: Tuple[str, int], seat: int):
+        """Keeps track of the tables each remote host plays with us.
+
+        Args:
+            session: The Peer of the table that changed.
+            change: membership.JOINED or membership.LEFT.
+            addr: The address of the peer.
+            seat: The seat of the peer.
+        """
+        if addr == session.id:
+            return
+        if change == JOINED:
+            self.remote_tables.setdefault(addr, {})[session.table] = session
+        elif change == LEFT:
+            tables = self.remote_tables.get(addr, {})
+            tables.pop(session.table, None)
+            if not tables:
+                self.remote_tables.pop(addr, None)
+
+    def add_input_handler(self, table: int, callback):
+        """Used as the input_reader of every table: sends the lines that start with the table id
+        to callback, once the table is seated. Input is read from the first seated table on.
+
+        Args:
+            table: The table id.
+            callback: Called with the rest of every line for the table.
+        """
+        self.input_handlers[table] = callback
+        if self.reading_input:
+            return
+        self.reading_input = True
+        if self.input_reader is not None:
+            self.input_reader(self.handle_input_line)
+        else:
+            self.reactor.callInThread(self.read_input)
+
+    def read_input(self):
+        """Reads user input in a thread of the reactor, the lines are handled in the reactor thread."""
+        while True:
+            self.reactor.callFromThread(self.handle_input_line, input())
+
+    def handle_input_line(self, user_input: str):
+        """Passes a line of user input such as "3 DRAW_CARD" to the table it starts with.
+        With a single table the table id can be left out.
+
+        Args:
+            user_input: The line the user typed.
+        """
+        table, _, command = user_input.strip().partition(" ")
+        if table.isdigit() and int(table) in self.input_handlers:
+            self.input_handlers[int(table)](command)
+        elif len(self.sessions) == 1 and self.input_handlers:
+            next(iter(self.input_handlers.values()))(user_input)
+        else:
+            self.logger.info("Start the command with a seated table: %s, e.g. \"%s DRAW_CARD\"",
+                             sorted(self.input_handlers), min(self.input_handlers, default=0))
@@ -1,16 +1,187 @@
-class Logger():
+import threading
+from collections import deque
+from typing import Dict, List
+
+DEBUG = 10
+INFO = 20
+WARN = 30
+
+LEVELS = {"DEBUG": DEBUG, "INFO": INFO, "WARN": WARN}
+
+
+def parse_level(level_name: str) -> int:
+    """Converts a level name such as "debug" or "WARN" to its numeric value.
+
+    Args:
+        level_name: The name of the level.
+    """
+    try:
+        return LEVELS[level_name.strip().upper()]
+    except KeyError as e:
+        raise ValueError(f"Unknown log level: {level_name}") from e
+
+
+def format_message(message: str, args) -> str:
+    """Builds the final log line. Only called once a level check has passed.
+
+    Callable arguments are called first, so expensive values can be deferred with a lambda.
+
+    Args:
+        message: The message, with %-style placeholders if args are given.
+        args: The values for the placeholders.
+    """
+    if not args:
+        return message
+    return message % tuple(arg() if callable(arg) else arg for arg in args)
+
+
+class ModuleLogger():
+    """A view of a Logger with its own level, used by one module (e.g. gameplay or heartbeat).
+
+    Messages are written through the parent Logger, so all modules share one buffer and log file.
+
+    Args:
+        parent: The Logger that writes the messages.
+        name: The name of the module.
+    """
+    def __init__(self, parent: 'Logger', name: str):
+        self.parent = parent
+        self.name = name
+        self.level = parent.level
+
+    def log_message(self, message, print_message=True):
+        """Log a message at INFO level if it is printed, otherwise at DEBUG level.
+
+        Args:
+            message: The message to be logged.
+            print_message: Whether to print the message to the console. Default: True.
+        """
+        if (INFO if print_message else DEBUG) < self.level:
+            return
+        self.parent.write_message(message, print_message)
+
+    def debug(self, message, *args):
+        """Log a message that is only written to the log file.
+
+        Args:
+            message: The message, with %-style placeholders for args.
+            args: Values (or callables returning values) formatted into the message.
+        """
+        if DEBUG < self.level:
+            return
+        self.parent.write_message(format_message(message, args), False)
+
+    def info(self, message, *args, print_message=True):
+        """Log a message meant for the player, printed to the console by default.
+
+        Args:
+            message: The message, with %-style placeholders for args.
+            args: Values (or callables returning values) formatted into the message.
+            print_message: Whether to print the message to the console. Default: True.
+        """
+        if INFO < self.level:
+            return
+        self.parent.write_message(format_message(message, args), print_message)
+
+    def warn(self, message, *args, print_message=False):
+        """Log an error or unexpected situation.
+
+        Args:
+            message: The message, with %-style placeholders for args.
+            args: Values (or callables returning values) formatted into the message.
+            print_message: Whether to print the message to the console. Default: False.
+        """
+        if WARN < self.level:
+            return
+        self.parent.write_message(format_message(message, args), print_message)
+
+
+class Logger(ModuleLogger):
     """Handles logging of the messages. Includes an optional to print the message to the console.
 
+    Messages are not written to the log file by the caller. They are appended to an in-memory
+    ring buffer, and a background writer thread flushes them to disk in batches, either when
+    flush_batch_size messages are waiting or every flush_interval seconds. If the buffer is full,
+    the oldest message is dropped and counted, so logging never blocks the reactor thread.
+
+    Messages have a level (DEBUG, INFO or WARN). Messages below the level of the logger are
+    discarded before they are formatted, so a disabled debug call costs one comparison.
+    The Logger itself is the logger of the peer module, other modules get their own level
+    through get_module_logger().
+
+    The tables of a peer host log through one Logger each, with their own address and levels,
+    which hand their lines to the host's Logger, so they share its buffer and writer thread.
+
     Args:
         own_address: The address of the peer
-        peer_number: An identifier of the peer
+        level: The lowest level that is logged. Default: DEBUG.
+        buffer_size: Maximum number of messages kept in memory before dropping the oldest. Default: 8192.
+        flush_batch_size: Number of buffered messages that wakes the writer thread. Default: 256.
+        flush_interval: Maximum time a message waits in the buffer (seconds). Default: 0.5s.
+        sink: The Logger whose buffer and writer thread the messages go to. Default: None, its own.
     """
-    def __init__(self, own_address):
+    def __init__(self, own_address, level: int = DEBUG, buffer_size: int = 8192,
+                 flush_batch_size: int = 256, flush_interval: float = 0.5, sink: 'Logger' = None):
+        self.sink = sink if sink is not None else self
+        self.level = level
+        self.parent = self
+        self.name = "peer"
+        self.module_loggers: Dict[str, ModuleLogger] = {}
         self.own_address = own_address
         self.peer_number = -1
+        self.buffer_size = buffer_size
+        self.flush_batch_size = flush_batch_size
+        self.flush_interval = flush_interval
+        self.dropped_messages = 0
+        self._buffer = deque()
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._writer = None
+        self._closed = False
 
-    def log_message(self, message, print_message=True):
-        """Log a message to the log file and optionally print it to the console.
+    def get_module_logger(self, name: str) -> ModuleLogger:
+        """Returns the logger of a module, creating it if needed.
+
+        Args:
+            name: The name of the module, e.g. "gameplay".
+        """
+        if name == self.name:
+            return self
+        if name not in self.module_loggers:
+            self.module_loggers[name] = ModuleLogger(self, name)
+        return self.module_loggers[name]
+
+    def set_level(self, level: int, module: str = None):
+        """Sets the level of one module, or of every module if no module is given.
+
+        Args:
+            level: The lowest level that is logged.
+            module: The name of the module. Default: None.
+        """
+        if module is None:
+            self.level = level
+            for module_logger in self.module_loggers.values():
+                module_logger.level = level
+        else:
+            self.get_module_logger(module).level = level
+
+    def configure_levels(self, level_specs: List[str]):
+        """Applies level settings given at startup, e.g. ["INFO", "gameplay=DEBUG"].
+        A setting without a module name applies to every module, so it should come first.
+
+        Args:
+            level_specs: The level settings.
+        """
+        for spec in level_specs:
+            if "=" in spec:
+                module, level_name = spec.split("=", 1)
+                self.set_level(parse_level(level_name), module.strip())
+            else:
+                self.set_level(parse_level(spec))
+
+    def write_message(self, message, print_message=True):
+        """Write a message to the log buffer and optionally print it to the console.
+        Level checks are done by the caller.
 
         Args:
             message: The message to be logged.
@@ -19,19 +190,101 @@ class Logger():
         if print_message:
             print(message)
 
+        self.sink.enqueue(self.get_log_name(), f"{self.own_address}: " + message + "\n")
+
+    def enqueue(self, log_name: str, line: str):
+        """Appends a line to the buffer and wakes the writer thread if a batch is ready.
+
+        Args:
+            log_name: The name of the log file.
+            line: The line, with its address prefix and newline.
+        """
+        with self._condition:
+            if len(self._buffer) >= self.buffer_size:
+                self._buffer.popleft()
+                self.dropped_messages += 1
+            self._buffer.append((log_name, line))
+            if self._writer is None and not self._closed:
+                self._start_writer()
+            if len(self._buffer) >= self.flush_batch_size:
+                self._condition.notify()
+
+        if self._closed:
+            self.flush()
+
+    def get_log_name(self):
+        """Returns the name of this peer's log file."""
         peer_log_name = "logs.txt"
 
         if self.peer_number != -1:
             peer_log_name = str(self.peer_number) + peer_log_name
-        
-        with open(peer_log_name, "a", encoding="utf-8") as log_file:
-            log_file.write(f"{self.own_address}: " + message + "\n")
+        return peer_log_name
+
+    def flush(self):
+        """Writes all buffered messages to the log file(s) immediately."""
+        if self.sink is not self:
+            self.sink.flush()
+            return
+        with self._write_lock:
+            with self._condition:
+                batch = list(self._buffer)
+                self._buffer.clear()
+                dropped = self.dropped_messages
+                self.dropped_messages = 0
+            self._write_batch(batch, dropped)
+
+    def close(self):
+        """Stops the writer thread and flushes the remaining messages. A Logger with another
+        Logger as its sink only flushes, the sink is closed by its owner."""
+        if self.sink is not self:
+            self.sink.flush()
+            return
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._writer is not None and self._writer is not threading.current_thread():
+            self._writer.join(timeout=2 * self.flush_interval + 1)
+        self.flush()
 
     def clear_logs(self):
         """Clears the contents of the log file(s)."""
-        peer_log_name = "logs.txt"
+        self.flush()
+        open(self.get_log_name(), "w", encoding="utf-8").close()
 
-        if self.peer_number != -1:
-            peer_log_name = str(self.peer_number) + peer_log_name
+    def _start_writer(self):
+        """Starts the background writer thread. Must be called with self._condition held."""
+        self._writer = threading.Thread(target=self._writer_loop, name="logger-writer", daemon=True)
+        self._writer.start()
+
+    def _writer_loop(self):
+        """Flushes the buffer in batches until the logger is closed."""
+        while True:
+            with self._condition:
+                if not self._closed and len(self._buffer) < self.flush_batch_size:
+                    self._condition.wait(self.flush_interval)
+                closed = self._closed
+            self.flush()
+            if closed:
+                return
+
+    def _write_batch(self, batch, dropped: int = 0):
+        """Writes a batch of (file name, line) pairs, opening each file once.
+        Must be called with self._write_lock held.
+
+        Args:
+            batch: The buffered messages.
+            dropped: How many messages were dropped because the buffer was full.
+        """
+        if not batch and not dropped:
+            return
+
+        lines_by_file = {}
+        for log_name, line in batch:
+            lines_by_file.setdefault(log_name, []).append(line)
+        if dropped:
+            lines_by_file.setdefault(self.get_log_name(), []).append(
+                f"{self.own_address}: {dropped} log messages dropped, log buffer was full\n")
 
-        open(peer_log_name, "w", encoding="utf-8").close()
+        for log_name, lines in lines_by_file.items():
+            with open(log_name, "a", encoding="utf-8") as log_file:
+                log_file.writelines(lines)
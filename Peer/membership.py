@@ -0,0 +1,113 @@
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# the kinds of membership changes listeners are called with
+JOINED = "joined"
+LEFT = "left"
+
+
+class MembershipTable:
+    """The players of the table in seat (turn) order, shared by the Peer, its Gameplay and its
+    HeartbeatManager.
+
+    The seats are kept in a list and every address's seat in a dict, so looking up the seat of a
+    sender, the address of a seat or whether an address is a member is O(1). Removing a player
+    moves the players after it up one seat, like the server does, which is O(n) once per leave.
+
+    Every change increases version, and listeners are called with (change, address, seat) for
+    every player that joined or left. The seat of a player that left is the one it had before.
+    """
+
+    def __init__(self):
+        self.seats: List[Tuple[str, int]] = []
+        self.seat_of: Dict[Tuple[str, int], int] = {}
+        self.version = 0
+        self.listeners: List[Callable[[str, Tuple[str, int], int], None]] = []
+
+    def __len__(self) -> int:
+        return len(self.seats)
+
+    def __iter__(self) -> Iterator[Tuple[str, int]]:
+        return iter(self.seats)
+
+    def __contains__(self, addr) -> bool:
+        return addr in self.seat_of
+
+    def __getitem__(self, seat: int) -> Tuple[str, int]:
+        return self.seats[seat]
+
+    def __repr__(self) -> str:
+        return str(self.seats)
+
+    def subscribe(self, listener: Callable[[str, Tuple[str, int], int], None]):
+        """Calls listener with (JOINED or LEFT, address, seat) on every change.
+
+        Args:
+            listener: The function to call.
+        """
+        self.listeners.append(listener)
+
+    def seat(self, addr: Tuple[str, int]) -> Optional[int]:
+        """Returns the seat of an address, or None if it is not a member.
+
+        Args:
+            addr: The address (IP, port) of the player.
+        """
+        return self.seat_of.get(addr)
+
+    def add(self, addr: Tuple[str, int]) -> bool:
+        """Seats a player after the last one.
+
+        Args:
+            addr: The address (IP, port) of the player.
+
+        Returns:
+            Whether the player was added, False if it was already a member.
+        """
+        if addr in self.seat_of:
+            return False
+        self.seat_of[addr] = len(self.seats)
+        self.seats.append(addr)
+        self.version += 1
+        self.notify(JOINED, addr, self.seat_of[addr])
+        return True
+
+    def remove(self, addr: Tuple[str, int]) -> Optional[int]:
+        """Removes a player, the players after it move up one seat.
+
+        Args:
+            addr: The address (IP, port) of the player.
+
+        Returns:
+            The seat the player had, or None if it was not a member.
+        """
+        seat = self.seat_of.pop(addr, None)
+        if seat is None:
+            return None
+        del self.seats[seat]
+        for index in range(seat, len(self.seats)):
+            self.seat_of[self.seats[index]] = index
+        self.version += 1
+        self.notify(LEFT, addr, seat)
+        return seat
+
+    def reset(self, addresses: Iterable[Tuple[str, int]]):
+        """Replaces the whole table, e.g. with a player order from the server. Listeners hear of
+        the players that are not in the new order and of the new ones.
+
+        Args:
+            addresses: The addresses in seat order. Repeated addresses are only seated once.
+        """
+        previous_seats = self.seat_of
+        self.seats = list(dict.fromkeys(addresses))
+        self.seat_of = {addr: seat for seat, addr in enumerate(self.seats)}
+        self.version += 1
+        for addr, seat in previous_seats.items():
+            if addr not in self.seat_of:
+                self.notify(LEFT, addr, seat)
+        for addr, seat in self.seat_of.items():
+            if addr not in previous_seats:
+                self.notify(JOINED, addr, seat)
+
+    def notify(self, change: str, addr: Tuple[str, int], seat: int):
+        for listener in self.listeners:
+            listener(change, addr, seat)
@@ -1,143 +1,476 @@
+import argparse
 import random
 import socket
 import os
+import codec
+from collections import deque
 from twisted.internet.protocol import DatagramProtocol
-from twisted.internet import reactor
+from twisted.internet import reactor as twisted_reactor
 from gameplay import Gameplay
-from logger import Logger
+from logger import Logger, DEBUG
 from heartbeat import HeartbeatManager
+from swim import SWIM_COMMANDS
+from reliable import ReliableChannel, RELIABLE_COMMANDS
+from causal import CausalOrder, CAUSAL_COMMANDS, parse_vector_clock
+from membership import MembershipTable, LEFT
+from event_log import EventLog, read_port, write_port
 from twisted.internet.task import LoopingCall
 from typing_extensions import Tuple
 
+# a joining peer takes over the game in progress from one player, see request_game_snapshot
+SNAPSHOT_COMMANDS = ("GAME_SNAPSHOT_REQUEST", "GAME_SNAPSHOT")
+
 class Peer(DatagramProtocol):
     """Handles message sending and receiving.
 
     Args:
         host: The server host address (network address or 'localhost').
         own_port: The port number of the peer.
+        protocol_version: The highest wire protocol version this peer speaks. Default: codec.PROTOCOL_VERSION.
+        room: The name of the table to join, or "" to let the server pick one. Default: "".
+        max_seats: The seat count of the table, if this peer creates it. Default: the server's default.
+        failure_detector: "all-to-all" heartbeats or "swim". Default: "all-to-all".
+        phi_threshold: Use phi accrual detection with this threshold for "all-to-all" heartbeats
+            instead of a fixed timeout. Default: None.
+        reliable: Send game commands to binary peers over the reliable channel, which resends
+            lost commands. Default: False.
+        deck_mode: "full" to send the whole shoe when starting a game, or "seed" to build it
+            from a seed all players contribute to. Default: "full".
+        reactor: The reactor that runs the timers, e.g. an aio.AsyncioReactor. Default: the Twisted reactor.
+        input_reader: Called with a callback for every line of user input, to read input in the
+            reactor thread. Default: None, input() is called in a thread of the reactor.
+        event_log: Directory of an event log of the game, see event_log.py. A game in progress is
+            recovered from it when the peer starts. Default: None, no log.
+        table: The id of the table at a peer host that plays many tables on one socket, see
+            host.py. Default: 0, the only table of the peer.
+        log_sink: The Logger that writes this peer's log messages, e.g. the one of its peer host.
+            Default: None, the peer's own Logger writes them.
+        log_level: The lowest level the peer logs, from the start on. Default: DEBUG.
     """
-    def __init__(self, host, own_port):
+    def __init__(self, host, own_port, protocol_version: int = codec.PROTOCOL_VERSION,
+                 room: str = "", max_seats: int = None, failure_detector: str = "all-to-all",
+                 phi_threshold: float = None, reliable: bool = False, deck_mode: str = "full",
+                 reactor=None, input_reader=None, event_log: str = None, table: int = 0,
+                 log_sink: Logger = None, log_level: int = DEBUG):
         if host == "localhost":
             host = "127.0.0.1"
 
         self.id = (host, own_port) if host == "127.0.0.1" else (self.get_peer_local_address(), own_port)
-        self.addresses = [] # for some reason, this array should not be given a type
+        # the players of the table in turn order, own address included
+        self.members = MembershipTable()
         self.server = (host, 9999)
+        self.server_heartbeat_interval = 5.0
+        self.protocol_version = protocol_version
+        # the server's version is unknown until it answers, so the first ready goes out as text,
+        # which every server understands, and carries our version for the server to pick from
+        self.server_version = codec.TEXT_VERSION
+        self.peer_versions = {}
+        self.table = table
+        # the table id of each peer at its host, peers without an entry play table 0
+        self.peer_tables = {}
+        # epoch of the last membership update from a binary server, None before the first snapshot
+        self.membership_epoch = None
+        self.room = room
+        self.max_seats = max_seats
+        # a peer the server turned away does not ask for a seat again
+        self.room_full = False
         self.send_message_thread_active = False
-        self.logger = Logger(self.id)
-        self.gameplay = Gameplay(self.logger, self.id)
-        self.heartbeat_manager = HeartbeatManager(self)
+        self.reactor = reactor if reactor is not None else twisted_reactor
+        self.input_reader = input_reader
+        # typed lines waiting for the reactor thread, as (line, when it was read)
+        self.input_queue = deque()
+        # the most lines that were waiting at once, and how long the last commands waited until sent
+        self.input_queue_peak = 0
+        self.input_latencies = deque(maxlen=100)
+        self.logger = Logger(self.id if not table else (*self.id, table), level=log_level, sink=log_sink)
+        self.gameplay = Gameplay(self.logger, self.id, deck_mode=deck_mode, members=self.members,
+                                 clock=lambda: self.lamport_clock)
+        self.heartbeat_manager = HeartbeatManager(self, mode=failure_detector, phi_threshold=phi_threshold)
         self.lamport_clock: int = 0
-        self.logger.log_message("Own address: " + str(self.id), print_message=False)
+        # when we last sent anything to each address, so heartbeats can be skipped while other traffic flows
+        self.last_sent = {}
+        # messages to binary peers waiting for the end of the reactor iteration, see queue_message
+        self.outbox = {}
+        self.flush_scheduled = False
+        # reliable messages from other peers are always accepted, sending them is optional
+        self.reliable = ReliableChannel(self, self.handle_reliable_message)
+        self.send_reliably = reliable
+        # game commands between binary peers carry a vector clock and are delivered in causal order
+        self.causal = CausalOrder(self, self.handle_causal_message)
+        self.members.subscribe(self.handle_membership_change)
+        # how long a joining peer waits for its game snapshot before following the game without one
+        self.snapshot_timeout = 3.0
+        self.snapshot_call = None
+        # id of the last snapshot request, answers to earlier ones are ignored
+        self.snapshot_request_id = 0
+        # the game recovered from the event log when the snapshot was asked for, None if there was none
+        self.snapshot_recovered_deck = None
+        # lost seed commitments or shares are sent again while a seed round is in progress
+        self.seed_resend_interval = 1.0
+        self.seed_resend_call = None
+        self.event_log = None
+        if event_log is not None:
+            self.event_log = EventLog(event_log, self.gameplay, self.logger, reactor=self.reactor)
+            self.lamport_clock = self.event_log.recover()
+        self.logger.debug("Own address: %s", self.id)
 
     def startProtocol(self):
         """Send a message to the server to get connected to other peers"""
-        self.send_message("ready", self.server)
+        self.send_message(self.get_ready_message(), self.server)
         self.send_heartbeat_to_server = LoopingCall(self.send_heartbeat_to_server)
-        self.send_heartbeat_to_server.start(5.0)
+        self.send_heartbeat_to_server.clock = self.reactor
+        self.send_heartbeat_to_server.start(self.server_heartbeat_interval)
 
     def stopProtocol(self):
         """Notify the server about disconnection and stop heartbeat."""
+        self.flush_outbox()
         try:
             self.send_message("disconnect", self.server)
-            self.logger.log_message("Sent disconnect message to server.", print_message=False)
+            self.logger.debug("Sent disconnect message to server.")
         except Exception as e:
-            self.logger.log_message(f"Error notifying server about disconnection: {e}", print_message=False)
+            self.logger.warn("Error notifying server about disconnection: %s", e)
+        queue_peak, mean_latency, max_latency = self.input_stats()
+        self.logger.debug("User input: at most %s lines waiting, latency %.1f ms mean, %.1f ms highest",
+                          queue_peak, mean_latency * 1000, max_latency * 1000)
         self.heartbeat_manager.stop()
+        self.reliable.stop()
+        self.causal.stop()
+        if self.snapshot_call is not None and self.snapshot_call.active():
+            self.snapshot_call.cancel()
+        if self.seed_resend_call is not None and self.seed_resend_call.active():
+            self.seed_resend_call.cancel()
         self.send_heartbeat_to_server.stop()
+        if self.event_log is not None:
+            self.event_log.close()
+        # the logger buffers messages in memory, write them out before the process exits
+        self.logger.close()
+
+
+    def get_ready_message(self):
+        """Builds the message that asks the server for a seat: ready!version!room!seats."""
+        if self.protocol_version == codec.TEXT_VERSION and not self.room and self.max_seats is None:
+            # old text servers only understand a plain "ready"
+            return "ready"
+        ready_message = f"ready!{self.protocol_version}!{self.room}"
+        if self.max_seats is not None:
+            ready_message += f"!{self.max_seats}"
+        return ready_message
+
+    def send_message(self, message, target_addr, clock=None):
+        """Send a message to a target address, encoded in the protocol version of the target.
+
+        Args:
+            message: The message to send.
+            target_addr: The target address (host, port).
+            clock: The Lamport clock value to attach. Default: None.
+        """
+        self.write(codec.encode(message, clock, self.get_protocol_version(target_addr)), target_addr)
+        self.last_sent[target_addr] = self.reactor.seconds()
+
+    def write(self, datagram: bytes, target_addr):
+        """Writes an encoded datagram to the transport, in a TABLE frame for a peer that plays
+        another table than 0 of its host. The server is told which of our tables it is from.
 
+        Args:
+            datagram: The encoded message.
+            target_addr: The target address (host, port).
+        """
+        table = self.table if target_addr == self.server else self.peer_tables.get(target_addr, 0)
+        self.transport.write(codec.wrap_table(table, datagram), target_addr)
 
-    def send_message(self, message, target_addr):
-        """Send a message to a target address.
+    def queue_message(self, message, target_addr):
+        """Queues a message for a binary peer. Everything queued during one reactor iteration is sent
+        at its end, packed into as few datagrams per peer as possible with one Lamport clock value.
 
         Args:
             message: The message to send.
             target_addr: The target address (host, port).
         """
-        self.transport.write(message.encode('utf-8'), target_addr)
+        self.outbox.setdefault(target_addr, []).append(message)
+        self.last_sent[target_addr] = self.reactor.seconds()
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.reactor.callLater(0, self.flush_outbox)
+
+    def flush_outbox(self):
+        """Sends the queued messages, one batch datagram per peer unless it exceeds the MTU."""
+        self.flush_scheduled = False
+        outbox, self.outbox = self.outbox, {}
+        # peers that get the same messages get the same datagrams
+        encoded_batches = {}
+        for peer_address, messages in outbox.items():
+            key = tuple(messages)
+            if key not in encoded_batches:
+                encoded_batches[key] = codec.encode_batch(messages, self.lamport_clock)
+            for datagram in encoded_batches[key]:
+                try:
+                    self.write(datagram, peer_address)
+                except Exception as e:
+                    self.logger.warn("Error sending message to %s: %s", peer_address, e)
+
+    def get_protocol_version(self, addr):
+        """Returns the wire protocol version to use with a peer or the server.
+
+        Args:
+            addr: The address (IP, port) of the peer or the server.
+        """
+        if addr == self.server:
+            return self.server_version
+        return self.peer_versions.get(addr, codec.TEXT_VERSION)
 
     def send_heartbeat_to_server(self):
-        """Send heartbeat message to all connected peers."""
-        self.send_message("HEARTBEAT", self.server)
+        """Send a heartbeat to the server, unless another message was sent to it within the interval.
+        The server renews our seat on any message. Binary peers report their membership epoch,
+        0 before the first player order, and the server sends the player order if it is behind."""
+        if self.reactor.seconds() - self.last_sent.get(self.server, 0.0) < self.server_heartbeat_interval:
+            return
+        if self.id not in self.members and not self.room_full:
+            # the ready or the player order was lost, a peer that is not seated asks again
+            self.send_message(self.get_ready_message(), self.server)
+        elif self.protocol_version >= codec.BINARY_VERSION:
+            self.send_message(f"HEARTBEAT!{self.membership_epoch or 0}", self.server)
+        else:
+            self.send_message("HEARTBEAT", self.server)
 
     def handle_type_command(self):
-        """Handles gathering user input and sending messages to connected peers."""
+        """Reads user input in a thread of the reactor. The lines are handled in the reactor thread,
+        like incoming datagrams, so only one thread changes the game state."""
         while True:
-            self.logger.log_message("Type a command: ")
-            user_input = input()
-            self.logger.log_message(user_input, False)
+            self.enqueue_input(input())
+            self.reactor.callFromThread(self.handle_queued_input)
 
-            # Decide what to send to peers
-            message_to_send = self.gameplay.handle_input(user_input)
+    def handle_input_line(self, user_input):
+        """Handles a line of user input read by the input_reader in the reactor thread.
 
-            if not message_to_send:
-                self.logger.log_message("Unsupported command")
-                continue
-            elif message_to_send == "dont-send":
-                continue
+        Args:
+            user_input: The line the user typed.
+        """
+        self.enqueue_input(user_input)
+        self.handle_queued_input()
+
+    def enqueue_input(self, user_input):
+        """Queues a line of user input for the reactor thread. Safe to call from any thread.
 
-            # Ensure message_to_send is a list
-            if not isinstance(message_to_send, list):
-                message_to_send = [message_to_send]
+        Args:
+            user_input: The line the user typed.
+        """
+        self.input_queue.append((user_input, self.reactor.seconds()))
+        self.input_queue_peak = max(self.input_queue_peak, len(self.input_queue))
+
+    def handle_queued_input(self):
+        """Handles the oldest queued line of user input, and prompts for the next one."""
+        user_input, read_at = self.input_queue.popleft()
+        self.handle_user_input(user_input)
+        latency = self.reactor.seconds() - read_at
+        self.input_latencies.append(latency)
+        self.logger.debug("Input handled %.1f ms after it was typed, %s more waiting",
+                          latency * 1000, len(self.input_queue))
+        self.logger.info("Type a command: ")
+
+    def input_stats(self):
+        """Returns the most lines of input that waited at once, and the mean and the highest time
+        from typing a command until it was handled and its messages queued for sending (seconds),
+        over the last 100 commands."""
+        if not self.input_latencies:
+            return self.input_queue_peak, 0.0, 0.0
+        return (self.input_queue_peak, sum(self.input_latencies) / len(self.input_latencies),
+                max(self.input_latencies))
+
+    def handle_user_input(self, user_input):
+        """Handles a line of user input and sends the resulting messages to connected peers.
+
+        Args:
+            user_input: The line the user typed.
+        """
+        self.logger.debug(user_input)
 
-            # Log and send each message
-            self._log_and_send_messages(message_to_send)
+        # Decide what to send to peers
+        message_to_send = self.gameplay.handle_input(user_input)
+
+        if not message_to_send:
+            self.logger.info("Unsupported command")
+            return
+        elif message_to_send == "dont-send":
+            return
+
+        # Ensure message_to_send is a list
+        if not isinstance(message_to_send, list):
+            message_to_send = [message_to_send]
+
+        # Log and send each message
+        self._log_and_send_messages(message_to_send)
 
     def _log_and_send_messages(self, messages):
         """Logs and sends messages to all connected peers with error tolerance.
 
         Args:
-            messages: The messages to be logged and sent.
+            messages: The messages to be logged and sent. A (message, peer index) tuple
+                is only sent to that peer.
         """
-        # increment logical clock
-        self.lamport_clock += 1
-
         if not isinstance(messages, list):
             messages = [messages]
 
+        # increment logical clock, messages to a single peer do not take part in the broadcast order
+        if not all(isinstance(message, tuple) for message in messages):
+            self.lamport_clock += 1
+
         for message in messages:
-            self.logger.log_message("Supported command: " + message, False)
-            for peer_address in self.addresses:
+            targets = self.members
+            if isinstance(message, tuple):
+                message, peer_index = message
+                if not 0 <= peer_index < len(self.members):
+                    continue
+                targets = [self.members[peer_index]]
+            elif self.event_log is not None:
+                # own moves and automatic passes were applied when they were made
+                self.event_log.record(message.split("!"), self.lamport_clock, self.gameplay.own_turn_identifier)
+            self.logger.debug("Supported command: %s", message)
+            command = message.split("!", 1)[0]
+            reliable = self.send_reliably and command in self.gameplay.supported_incoming_commands
+            # broadcast game commands are stamped once, every binary peer gets the same vector clock
+            causal = len(targets) > 1 and command in self.gameplay.supported_incoming_commands \
+                and command not in self.gameplay.unordered_commands
+            stamped_message = None
+            # encode the message (with the local timestamp) once for the text peers
+            encoded_messages = {}
+            for peer_address in targets:
                 if peer_address == self.id:
                     continue
                 try:
-                    self.logger.log_message("Sending a message to: " + str(peer_address), False)
-                    
-                    # attach local timestamp
-                    message += f"^{self.lamport_clock}"
-                    self.send_message(message, peer_address)
+                    self.logger.debug("Sending a message to: %s", peer_address)
+
+                    version = self.get_protocol_version(peer_address)
+                    if version >= codec.BINARY_VERSION:
+                        # text peers predate the reliable channel, batches and causal delivery
+                        binary_message = message
+                        if causal:
+                            if stamped_message is None:
+                                stamped_message = self.causal.stamp(message)
+                            binary_message = stamped_message
+                        if reliable:
+                            self.reliable.send(binary_message, self.lamport_clock, peer_address)
+                        else:
+                            self.queue_message(binary_message, peer_address)
+                        continue
+                    if version not in encoded_messages:
+                        encoded_messages[version] = codec.encode(message, self.lamport_clock, version)
+                    self.write(encoded_messages[version], peer_address)
+                    self.last_sent[peer_address] = self.reactor.seconds()
                 except Exception as e:
-                    self.logger.log_message(f"Error sending message to {peer_address}: {e}", print_message=False)
+                    self.logger.warn("Error sending message to %s: %s", peer_address, e)
+
+        if self.gameplay.seed_round is not None and self.seed_resend_call is None:
+            self.seed_resend_call = self.reactor.callLater(self.seed_resend_interval, self.resend_seed_round)
+
+    def resend_seed_round(self):
+        """Sends the own messages of the seed round in progress again, until the round is over."""
+        self.seed_resend_call = None
+        messages = self.gameplay.resend_seed_round()
+        if messages:
+            self._log_and_send_messages(messages)
 
 
     def datagramReceived(self, datagram: bytes, addr):
-        """Handles routing of the messages to the their corresponding handlers.
+        """Handles a datagram from the socket. Datagrams for another table are dropped.
 
         Args:
             datagram: The received message as a datagram.
             addr: The address of the sender.
         """
-        datagram = datagram.decode("utf-8")
-        if "HEARTBEAT" not in datagram:
-            self.logger.log_message(f"Received datagram: {datagram}", False)
+        try:
+            table, datagram = codec.unwrap_table(datagram)
+        except ValueError as e:
+            self.logger.warn("Could not decode datagram from %s: %s", addr, e)
+            return
+        if table != self.table:
+            self.logger.debug("Dropping a datagram from %s for table %s", addr, table)
+            return
+        self.handle_datagram(datagram, addr)
+
+    def handle_datagram(self, datagram: bytes, addr):
+        """Handles routing of the messages to the their corresponding handlers.
+
+        Args:
+            datagram: The received message as a datagram, without its TABLE frame.
+            addr: The address of the sender.
+        """
+        try:
+            splitted_command, clock = codec.decode(datagram)
+        except ValueError as e:
+            self.logger.warn("Could not decode datagram from %s: %s", addr, e)
+            return
+
+        if splitted_command[0] != "HEARTBEAT":
+            self.logger.debug("Received datagram: %s", lambda: "!".join(splitted_command))
         if addr == self.server:
-            self.handle_datagram_from_server(datagram)
+            received_version = codec.BINARY_VERSION if codec.is_binary(datagram) else codec.TEXT_VERSION
+            self.server_version = codec.negotiate_version(self.protocol_version, received_version)
+            self.handle_datagram_from_server(splitted_command)
         else:
-            self.handle_other_datagrams(datagram, addr)
+            # any datagram from a peer of the table shows that it is alive, not only heartbeats.
+            # It is recorded once, a batch of several commands is still one arrival.
+            if addr in self.members:
+                self.heartbeat_manager.record_heartbeat(addr)
+            self.handle_other_datagrams(splitted_command, clock, addr)
+
+    def handle_reliable_message(self, splitted_command, clock, addr):
+        """Handles a message delivered by the reliable channel. The channel already drops duplicates
+        and keeps the sender's order, so a resent command is not dropped for its old clock value.
+
+        Args:
+            splitted_command: The message split into fields.
+            clock: The Lamport clock value of the message, or None.
+            addr: The address of the sender.
+        """
+        self.handle_other_datagrams(splitted_command, clock, addr, ordered=True)
 
-    def handle_other_datagrams(self, datagram: str, addr):
+    def handle_causal_message(self, splitted_command, clock, addr):
+        """Handles a game command the causal order delivered. Its clock value is not checked,
+        the commands it depends on were handled before it.
+
+        Args:
+            splitted_command: The message split into fields.
+            clock: The Lamport clock value of the message, or None.
+            addr: The address of the sender.
+        """
+        self.handle_other_datagrams(splitted_command, clock, addr, ordered=True)
+
+    def handle_other_datagrams(self, splitted_command, clock, addr, ordered=False):
         """Handles the incoming messages from peers or heartbeat manager.
 
         Args:
-            datagram: The received message as a datagram.
+            splitted_command: The received message split into fields.
+            clock: The Lamport clock value of the message, or None.
             addr: The address of the sender.
+            ordered: Whether the message is already known to be in order, because the reliable
+                channel or the causal order delivered it, or it is part of a batch with a new
+                clock value. Its clock value is not checked then. Default: False.
         """
         try:
-            lamport = datagram.split("^")
-            splitted_command = lamport[0].split("!")
+            if splitted_command[0] == "BATCH":
+                # the batch has one clock value, if it is new then so is every command in it
+                fresh = clock is not None and clock > self.lamport_clock
+                for message in splitted_command[1:]:
+                    self.handle_other_datagrams(message.split("!"), clock, addr, ordered or fresh)
+                return
 
             if splitted_command[0] == "HEARTBEAT":
-                self.heartbeat_manager.record_heartbeat(addr)
+                return
+
+            if splitted_command[0] in RELIABLE_COMMANDS:
+                self.reliable.handle_message(splitted_command, clock, addr)
+                return
+
+            if splitted_command[0] in CAUSAL_COMMANDS:
+                self.causal.handle_message(splitted_command, clock, addr)
+                return
+
+            if splitted_command[0] in SWIM_COMMANDS:
+                self.heartbeat_manager.handle_swim_message(splitted_command, addr)
+                return
+
+            if splitted_command[0] in SNAPSHOT_COMMANDS:
+                self.handle_snapshot_message(splitted_command, addr)
                 return
 
             if splitted_command[0] == "PEER_DISCONNECTED":
@@ -145,24 +478,27 @@ class Peer(DatagramProtocol):
                     disconnected_peer = (splitted_command[1], int(splitted_command[2]))
                     self.handle_peer_disconnection(disconnected_peer)
                 except Exception as e:
-                    self.logger.log_message(f"Error processing PEER_DISCONNECTED: {str(e)}", False)
+                    self.logger.warn("Error processing PEER_DISCONNECTED: %s", e)
                 return
 
             if splitted_command[0].upper() in self.gameplay.supported_incoming_commands:
-                self.logger.log_message(f"Command from {addr}: {splitted_command[0]}", False)
+                self.logger.debug("Command from %s: %s", addr, splitted_command[0])
 
                 # check message logical clock value
-                if int(lamport[-1]) <= self.lamport_clock:
-                    self.logger.log_message(f"Received old data: {datagram}", False)
+                if splitted_command[0] in self.gameplay.unordered_commands:
+                    pass
+                elif clock is None or (clock <= self.lamport_clock and not ordered):
+                    self.logger.debug("Received old data: %s", lambda: "!".join(splitted_command))
                     return
                 else:
-                    self.lamport_clock = int(lamport[-1])
+                    self.lamport_clock = max(self.lamport_clock, clock)
 
-                command = "!".join(splitted_command)
                 sender_index = self.get_peer_index(addr)
                 if sender_index is None:
                     return
-                messages_to_send = self.gameplay.handle_incoming_commands(command, sender_index)
+                messages_to_send = self.gameplay.handle_incoming_commands(splitted_command, sender_index)
+                if self.event_log is not None:
+                    self.event_log.record(splitted_command, clock, sender_index)
                 if messages_to_send:
                     if not isinstance(messages_to_send, list):
                         messages_to_send = [messages_to_send]
@@ -173,28 +509,36 @@ class Peer(DatagramProtocol):
                 sender_index = self.get_peer_index(addr)
                 if sender_index is None:
                     sender_index = ""
-                self.logger.log_message(f"Message from peer {sender_index}: {chat_message}")
-                self.logger.log_message(f"Message from {addr}: {datagram}", False)
-                self.logger.log_message("Type a command: ", print_message=True)
+                self.logger.info("Message from peer %s: %s", sender_index, chat_message)
+                self.logger.debug("Message from %s: %s^%s", addr, chat_message, clock)
+                self.logger.info("Type a command: ")
 
         except Exception as e:
-            self.logger.log_message(f"Error handling datagram from {addr}: {e}", print_message=False)
+            self.logger.warn("Error handling datagram from %s: %s", addr, e)
 
-    def handle_datagram_from_server(self, datagram: str):
+    def handle_datagram_from_server(self, datagram_data):
         """Handles messages from the rendezvous server.
 
         Args:
-            datagram: The received message as a datagram.
+            datagram_data: The received message split into fields.
         """
-        datagram_data = datagram.split("!")
         if datagram_data[0] == "PLAYER_ORDER":
             self.handle_player_order(datagram_data)
+        elif datagram_data[0] == "MEMBERSHIP_DELTA":
+            self.handle_membership_delta(datagram_data)
         elif datagram_data[0] == "PEER_DISCONNECTED":
             self.handle_server_disconnection(datagram_data)
+        elif datagram_data[0] == "ROOM_FULL":
+            self.room_full = True
+            self.logger.info("Table %s is full, restart the peer to join another table.", self.room)
         # If this is called here, the first player can't issue commands
         # until at least 1 other peer is connected
-        if not self.send_message_thread_active and self.addresses:
-            reactor.callInThread(self.handle_type_command)
+        if not self.send_message_thread_active and self.members:
+            self.logger.info("Type a command: ")
+            if self.input_reader is not None:
+                self.input_reader(self.handle_input_line)
+            else:
+                self.reactor.callInThread(self.handle_type_command)
             self.send_message_thread_active = True
             self.heartbeat_manager.start()
 
@@ -206,56 +550,121 @@ class Peer(DatagramProtocol):
         """
         try:
             player_order_number = int(datagram_data[1])
+            peer_list = datagram_data[2:]
+            if self.server_version >= codec.BINARY_VERSION:
+                # binary servers send PLAYER_ORDER!index!epoch!members
+                self.membership_epoch = int(datagram_data[2])
+                peer_list = datagram_data[3:]
 
             if player_order_number == 0:
-                self.logger.log_message("You are the first player online, waiting for connections")
+                self.logger.info("You are the first player online, waiting for connections")
 
-            if self.gameplay.own_turn_identifier == -1:
-                self.gameplay.update_order_number(player_order_number)
+            if self.logger.peer_number == -1:
                 self.logger.peer_number = player_order_number
+            # the player order is a full snapshot, so it also decides this peer's turn
+            self.gameplay.update_order_number(player_order_number)
 
-            # cancel the current game
-            self.gameplay.reset_gameplay_variables()
-
-            # Clear addresses list to ensure that every peer has the addresses in the same order
-            self.addresses = []
-            self.gameplay.connected_peers = 0
-
-            peer_list = datagram_data[2:]
+            # replace the whole table to ensure that every peer has the addresses in the same order
+            self.peer_versions = {}
+            self.peer_tables = {}
+            peer_addresses = []
             for peer in peer_list:
                 try:
-                    ip, peer_port = peer.split(":")
-                    peer_tuple = (ip, int(peer_port))
-                    self.add_peer_address(peer_tuple)
+                    peer_addresses.append(self.parse_member(peer))
                 except ValueError as e:
-                    self.logger.log_message(f"Error parsing peer address {peer}: {e}", print_message=False)
+                    self.logger.warn("Error parsing peer address %s: %s", peer, e)
+
+            # players who joined are seated after the others, so the current game goes on as long
+            # as its seats are still the first ones. The new players watch it until the next game.
+            game_seats = list(self.members)[:len(self.gameplay.players)]
+            if not self.gameplay.is_game_initiated() or peer_addresses[:len(game_seats)] != game_seats:
+                # cancel the current game
+                self.gameplay.reset_gameplay_variables()
+
+            joined = self.id not in self.members
+            self.members.reset(peer_addresses)
+            self.gameplay.connected_peers = len(self.members) - (1 if self.id in self.members else 0)
+            self.logger.debug("Player order: %s", self.members)
+            # seat 0 and the seats of a room's first update joined a table where no game ran yet.
+            # Text player orders have no epoch to tell, so text peers watch a running game without it.
+            if joined and player_order_number > 0 and self.membership_epoch not in (None, 1):
+                self.request_game_snapshot()
 
         except (IndexError, ValueError) as e:
-            self.logger.log_message(f"Error processing player order message: {e}", print_message=False)
+            self.logger.warn("Error processing player order message: %s", e)
+
+    def handle_membership_delta(self, datagram_data):
+        """Applies the joins and leaves of a MEMBERSHIP_DELTA!epoch!changes message.
+        If an update was missed, asks the server for the full player order instead.
+
+        Args:
+            datagram_data: The message from the server.
+        """
+        try:
+            epoch = int(datagram_data[1])
+            if self.membership_epoch is not None and epoch <= self.membership_epoch:
+                self.logger.debug("Ignoring old membership update %s", epoch)
+                return
+            if self.membership_epoch is None or epoch != self.membership_epoch + 1:
+                self.logger.debug("Missed membership updates (%s -> %s), requesting snapshot",
+                                  self.membership_epoch, epoch)
+                self.send_message("SNAPSHOT_REQUEST", self.server)
+                return
+            self.membership_epoch = epoch
+
+            for change in datagram_data[2:]:
+                peer_tuple = self.parse_member(change[1:])
+                if change[0] == "+":
+                    # a new player is seated after the others and watches the current game
+                    self.add_peer_address(peer_tuple)
+                elif peer_tuple == self.id:
+                    self.logger.warn("The server removed this peer, asking for a seat again")
+                    self.ask_for_seat_again()
+                else:
+                    self.handle_peer_disconnection(peer_tuple)
+                    self.peer_versions.pop(peer_tuple, None)
+                    self.peer_tables.pop(peer_tuple, None)
+        except (IndexError, ValueError) as e:
+            self.logger.warn("Error processing membership update: %s", e)
+
+    def parse_member(self, member: str) -> Tuple[str, int]:
+        """Parses a peer address of a player order, and records the peer's protocol version and
+        the table it plays at its host.
+
+        Args:
+            member: "ip:port", or "ip:port:version" or "ip:port:version:table" from a binary server.
+
+        Returns:
+            The address (IP, port) of the peer.
+        """
+        ip, peer_port, *version = member.split(":")
+        peer_tuple = (ip, int(peer_port))
+        peer_version = int(version[0]) if version else codec.TEXT_VERSION
+        self.peer_versions[peer_tuple] = codec.negotiate_version(self.protocol_version, peer_version)
+        if len(version) > 1 and int(version[1]):
+            self.peer_tables[peer_tuple] = int(version[1])
+        else:
+            self.peer_tables.pop(peer_tuple, None)
+        return peer_tuple
 
     def add_peer_address(self, peer_address: Tuple[str, int]):
-        """Adds a peer address to self.addresses.
+        """Seats a peer after the last player of the table.
 
         Args:
             peer_address: The address (IP, port) of the peer to add.
         """
         if not isinstance(peer_address, tuple) or len(peer_address) != 2:
-            self.logger.log_message(f"Invalid peer address format: {peer_address}", print_message=False)
+            self.logger.warn("Invalid peer address format: %s", peer_address)
             return False
 
-        if peer_address not in self.addresses:
-            # even own address should be in self.addresses, for player order
-            self.addresses.append(peer_address)
+        # even own address should be in self.members, for player order
+        if self.members.add(peer_address):
             if peer_address != self.id:
                 self.gameplay.increment_connected_peers_count()
-            self.logger.log_message(
-                f"Peer {peer_address} added to addresses. Current addresses: {self.addresses}",
-            False)
+            self.logger.debug("Peer %s added to addresses. Current addresses: %s", peer_address, self.members)
             return True
         else:
-            self.logger.log_message(
-                f"Peer {peer_address} already exists in addresses or is self.", print_message=False
-            )
+            self.logger.debug("Peer %s already exists in addresses or is self.", peer_address)
             return False
 
     def handle_peer_disconnection(self, disconnected_peer: Tuple[str, int]):
@@ -264,27 +673,129 @@ class Peer(DatagramProtocol):
         Args:
             disconnected_peer: The address of the disconnected peer.
         """
+        if disconnected_peer == self.id:
+            if self.id in self.members:
+                # the others missed our heartbeats and dropped us, but the server still has our seat
+                self.logger.warn("Another peer dropped this peer, asking for a seat again")
+                self.ask_for_seat_again()
+            return
         try:
-            disconnected_peer_index = None
-            try:
-                self.logger.log_message(f"Disconnected peer: {disconnected_peer}", False)
-                disconnected_peer_index = self.addresses.index(disconnected_peer)
-            except ValueError as _: # sometimes peers also can try to access the same value
-                pass
-
-            if disconnected_peer_index is not None:
-                self.gameplay.synchronize_passes(disconnected_peer_index)
-                self.gameplay.synchronize_points(disconnected_peer_index)
-                response = self.gameplay.synchronize_turn_orders(disconnected_peer_index, self.addresses)
+            self.logger.debug("Disconnected peer: %s", disconnected_peer)
+            # None if it was already removed, sometimes peers also can try to access the same value
+            disconnected_peer_index = self.members.seat(disconnected_peer)
+
+            if disconnected_peer_index is not None and self.gameplay.is_spectator(disconnected_peer_index):
+                self.gameplay.remove_spectator(disconnected_peer_index)
+            elif disconnected_peer_index is not None:
+                self.gameplay.synchronize_players(disconnected_peer_index)
+                response = self.gameplay.synchronize_turn_orders(disconnected_peer_index)
                 if response:
                     self._log_and_send_messages([response])
-
-            if disconnected_peer in self.addresses:
-                self.addresses.remove(disconnected_peer)
+                if self.event_log is not None and self.gameplay.is_game_initiated():
+                    # the seats of the game changed without a command
+                    self.event_log.snapshot()
         except KeyError as _:
             pass # all peers will try to access the key, which may not exist, so this is passed
         except Exception as e:
-            self.logger.log_message(f"Error handling PEER_DISCONNECTED: {str(e)}")
+            self.logger.warn("Error handling PEER_DISCONNECTED: %s", e, print_message=True)
+        finally:
+            # membership deltas do not rebuild the table, so the peer has to be removed here
+            self.members.remove(disconnected_peer)
+
+    def ask_for_seat_again(self):
+        """Leaves the table and sends the server a new ready. The seat comes back with a new
+        player order for the whole table, and a game in progress with a snapshot."""
+        self.gameplay.reset_gameplay_variables()
+        self.members.reset([])
+        self.send_message(self.get_ready_message(), self.server)
+
+    def handle_membership_change(self, change: str, addr: Tuple[str, int], seat: int):
+        """Drops the channel state of a peer that left the table, so a peer that rejoins from
+        the same address starts fresh.
+
+        Args:
+            change: membership.JOINED or membership.LEFT.
+            addr: The address of the peer.
+            seat: The seat of the peer.
+        """
+        if change == LEFT:
+            self.reliable.forget(addr)
+            self.causal.forget(addr)
+
+    def request_game_snapshot(self):
+        """Asks one player of the table for the game in progress, after joining it. Game commands
+        are held until the snapshot arrives, so only the commands after it are applied.
+        A binary peer is asked if there is one, only they keep causal delivery counts."""
+        others = [addr for addr in self.members if addr != self.id]
+        binary_peers = [addr for addr in others if self.get_protocol_version(addr) >= codec.BINARY_VERSION]
+        source = binary_peers[0] if binary_peers else others[0]
+        self.logger.debug("Asking %s for the game in progress", source)
+        self.causal.wait_for_baseline()
+        self.snapshot_request_id += 1
+        # every game starts with a new shoe, so the shoe tells if the recovered game is still running
+        self.snapshot_recovered_deck = self.gameplay.deck if self.gameplay.is_game_initiated() else None
+        # a peer that recovered the game from its event log has the shoe already
+        self.send_snapshot_message(
+            f"GAME_SNAPSHOT_REQUEST!{self.snapshot_request_id}!{self.gameplay.shoe_digest()}", source)
+        if self.snapshot_call is not None and self.snapshot_call.active():
+            self.snapshot_call.cancel()
+        self.snapshot_call = self.reactor.callLater(self.snapshot_timeout, self.handle_snapshot_timeout)
+
+    def handle_snapshot_message(self, splitted_command, addr):
+        """Answers GAME_SNAPSHOT_REQUEST!request id!shoe digest with the own game state, and takes
+        over the game state of a GAME_SNAPSHOT!request id!vector clock!Lamport clock!<SYNC_STATE message>
+        that answers the last request.
+
+        Args:
+            splitted_command: The message split into fields.
+            addr: The address of the sender.
+        """
+        if splitted_command[0] == "GAME_SNAPSHOT_REQUEST":
+            snapshot = f"GAME_SNAPSHOT!{splitted_command[1]}!{self.causal.vector_clock()}!{self.lamport_clock}"
+            if self.gameplay.is_game_initiated():
+                shoe_digest = int(splitted_command[2]) if len(splitted_command) > 2 else None
+                snapshot += "!" + self.gameplay.sync_state_message(shoe_digest)
+            self.logger.debug("Sending the game in progress to %s", addr)
+            self.send_snapshot_message(snapshot, addr)
+            return
+
+        if self.snapshot_call is None or int(splitted_command[1]) != self.snapshot_request_id:
+            self.logger.debug("Ignoring a game snapshot that was not asked for")
+            return
+        if self.snapshot_call.active():
+            self.snapshot_call.cancel()
+        self.snapshot_call = None
+        self.lamport_clock = max(self.lamport_clock, int(splitted_command[3]))
+        if len(splitted_command) > 4 and splitted_command[4] == "SYNC_STATE":
+            self.gameplay.apply_game_snapshot(splitted_command[4:])
+        elif self.snapshot_recovered_deck is not None and self.gameplay.deck is self.snapshot_recovered_deck:
+            # no game is running, also not the one recovered from the event log. A game that
+            # started after the request is newer than the snapshot and stays.
+            self.gameplay.reset_gameplay_variables()
+        self.snapshot_recovered_deck = None
+        if self.event_log is not None:
+            self.event_log.snapshot()
+        self.causal.set_baseline(parse_vector_clock(splitted_command[2]))
+
+    def send_snapshot_message(self, message, addr):
+        """Sends a snapshot request or snapshot over the reliable channel to a binary peer, a lost
+        one would hold the game commands of the joining peer until the snapshot timeout.
+
+        Args:
+            message: The message to send.
+            addr: The address of the peer.
+        """
+        if self.get_protocol_version(addr) >= codec.BINARY_VERSION:
+            self.reliable.send(message, None, addr)
+        else:
+            self.send_message(message, addr)
+
+    def handle_snapshot_timeout(self):
+        """Follows the game without a snapshot if none came, the state digests sort out the rest."""
+        self.snapshot_call = None
+        self.snapshot_recovered_deck = None
+        self.logger.debug("No game snapshot arrived, following the game without one")
+        self.causal.set_baseline({})
 
     def handle_server_disconnection(self, datagram_data):
         """Handle disconnection messages from the server.
@@ -297,9 +808,9 @@ class Peer(DatagramProtocol):
             disconnected_peer_port = int(datagram_data[2])
             disconnected_peer = (disconnected_peer_ip, disconnected_peer_port)
             self.handle_peer_disconnection(disconnected_peer)
-            self.logger.log_message(f"Peer {disconnected_peer} disconnected (by server).", print_message=False)
+            self.logger.debug("Peer %s disconnected (by server).", disconnected_peer)
         except (IndexError, ValueError) as e:
-            self.logger.log_message(f"Error processing server disconnection message: {e}", False)
+            self.logger.warn("Error processing server disconnection message: %s", e)
 
     def get_peer_index(self, addr: Tuple[int, str]):
         """Tries to get the turn index of a peer.
@@ -307,13 +818,11 @@ class Peer(DatagramProtocol):
         Args:
             addr: The address (IP, port) of the peer.
         """
-        try:
-            # self.addresses has to have self.id for this to work
-            sender_index = self.addresses.index(addr)
-            return sender_index
-        except Exception as e:
-            self.logger.log_message(f"Could not get message sender index, error: {e}")
-            return None
+        # self.members has to have self.id for this to work
+        sender_index = self.members.seat(addr)
+        if sender_index is None:
+            self.logger.warn("Could not get message sender index, %s is not at the table", addr, print_message=True)
+        return sender_index
 
     def get_peer_local_address(self):
         """Gets the peer's local network address from link-local address."""
@@ -324,13 +833,24 @@ class Peer(DatagramProtocol):
             s.close()
             return local_address
         except Exception as e:
-            self.logger.log_message(f"Could not get Peer's local network address. Defaulting to loopback address.", False)
+            self.logger.warn("Could not get Peer's local network address. Defaulting to loopback address.")
             return "127.0.0.1"
 
-def peer_start():
-    """Finds an available port for the peer to use"""
+def peer_start(preferred_port: int = None):
+    """Finds an available port for the peer to use
+
+    Args:
+        preferred_port: The port to use if it is available, e.g. the one of an earlier run. Default: None.
+    """
     os.system('clear')
     print("Starting peer...")
+    if preferred_port is not None:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            try:
+                s.bind(('localhost', preferred_port))
+                return preferred_port
+            except OSError:
+                print(f"Port {preferred_port} of the earlier run is in use, the game can not be recovered")
     while True:
         port = random.randint(1024, 65535)
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -341,10 +861,65 @@ def peer_start():
                 continue
 
 if __name__ == '__main__':
-    port = peer_start()
+    parser = argparse.ArgumentParser(description="Peer-To-Peer Blackjack peer")
+    parser.add_argument("--log-level", action="append", default=[], metavar="[MODULE=]LEVEL",
+                        help="DEBUG, INFO or WARN, optionally for one module (peer, gameplay, heartbeat, reliable, causal, "
+                        "event_log). "
+                        "Can be given several times.")
+    parser.add_argument("--protocol", choices=["text", "binary"], default="binary",
+                        help="Wire protocol to offer. Binary peers fall back to text with text peers.")
+    parser.add_argument("--room", default="",
+                        help="Name of the table to join. By default the server picks a table with a free seat.")
+    parser.add_argument("--seats", type=int, default=None,
+                        help="Seat count of the table, if this peer is the first one to join it.")
+    parser.add_argument("--failure-detector", choices=["all-to-all", "swim"], default="all-to-all",
+                        help="Heartbeat every peer each second, or use SWIM-style probing and gossip.")
+    parser.add_argument("--reliable", action="store_true",
+                        help="Resend lost game commands instead of resynchronizing the whole deck.")
+    parser.add_argument("--deck", choices=["full", "seed"], default="full",
+                        help="Send the whole shoe when starting a game, or agree on a shared seed and "
+                        "shuffle locally. Every player at the table needs a peer that knows seed mode.")
+    parser.add_argument("--runtime", choices=["twisted", "asyncio"], default="twisted",
+                        help="Event loop to run on. asyncio uses uvloop if it is installed.")
+    parser.add_argument("--phi-threshold", type=float, default=None,
+                        help="Detect failed peers with a phi accrual detector instead of a fixed 2 s timeout. "
+                        "8 is a good start, higher values are more tolerant of delays.")
+    parser.add_argument("--event-log", default=None, metavar="DIR",
+                        help="Log the game to this directory, and recover a game in progress from it on start.")
+    parser.add_argument("--tables", type=int, default=1,
+                        help="Play this many tables on one socket. Commands start with the table id, e.g. "
+                        "\"2 DRAW_CARD\". With --room the tables join ROOM-0, ROOM-1 and so on.")
+    args = parser.parse_args()
+
+    if args.runtime == "asyncio":
+        from aio import AsyncioReactor
+        reactor = AsyncioReactor()
+        input_reader = reactor.read_lines
+    else:
+        reactor = twisted_reactor
+        input_reader = None
+
+    # a restarted peer binds the port of its last run, so it rejoins with the same address and
+    # the server gives it back its seat in the game recovered from the event log
+    port = peer_start(read_port(args.event_log) if args.event_log else None)
+    if args.event_log:
+        write_port(args.event_log, port)
     print(f"Using port number: {port}")
     address = input("Enter the IP address of the server: ")
     if address == "":
         address = "localhost"
-    reactor.listenUDP(port, Peer(address, port))
+    protocol_version = codec.BINARY_VERSION if args.protocol == "binary" else codec.TEXT_VERSION
+    if args.tables > 1:
+        from host import PeerHost # pylint: disable=wrong-import-position
+        rooms = [f"{args.room}-{table}" if args.room else "" for table in range(args.tables)]
+        peer = PeerHost(address, port, rooms, reactor, input_reader, args.event_log,
+                        protocol_version=protocol_version, max_seats=args.seats,
+                        failure_detector=args.failure_detector, phi_threshold=args.phi_threshold,
+                        reliable=args.reliable, deck_mode=args.deck)
+        peer.configure_levels(args.log_level)
+    else:
+        peer = Peer(address, port, protocol_version, args.room, args.seats, args.failure_detector,
+                    args.phi_threshold, args.reliable, args.deck, reactor, input_reader, args.event_log)
+        peer.logger.configure_levels(args.log_level)
+    reactor.listenUDP(port, peer)
     reactor.run()
@@ -0,0 +1,130 @@
+import math
+from collections import deque
+from typing import Dict, Tuple
+
+
+class ArrivalWindow:
+    """The last inter-arrival times of one peer's heartbeats.
+
+    The sum and the sum of squares are kept up to date as intervals enter and leave
+    the window, so adding an interval and reading the mean or deviation is O(1).
+
+    Args:
+        size: How many intervals the window holds.
+    """
+
+    def __init__(self, size: int):
+        self.intervals = deque(maxlen=size)
+        self.interval_sum = 0.0
+        self.squared_sum = 0.0
+        self.last_arrival = None
+
+    def add(self, interval: float):
+        """Adds an interval, dropping the oldest one if the window is full.
+
+        Args:
+            interval: Seconds between two heartbeats.
+        """
+        if len(self.intervals) == self.intervals.maxlen:
+            oldest = self.intervals[0]
+            self.interval_sum -= oldest
+            self.squared_sum -= oldest * oldest
+        self.intervals.append(interval)
+        self.interval_sum += interval
+        self.squared_sum += interval * interval
+
+    def mean(self) -> float:
+        return self.interval_sum / len(self.intervals)
+
+    def std_deviation(self) -> float:
+        mean = self.mean()
+        # max() guards against tiny negative values from floating point error
+        return math.sqrt(max(0.0, self.squared_sum / len(self.intervals) - mean * mean))
+
+
+class PhiAccrualDetector:
+    """Phi accrual failure detection, used by HeartbeatManager when a phi threshold is given.
+
+    Instead of a fixed timeout, each peer gets a suspicion level phi that grows with the time
+    since its last heartbeat, scaled by how regular that peer's heartbeats have been so far.
+    phi = -log10(P(a heartbeat arrives later than now)), so phi 8 means that a heartbeat
+    this late would happen about once in 10^8 times if the peer were still alive.
+    A peer with jittery heartbeats, e.g. on a loaded host, is given more time.
+
+    Args:
+        heartbeat_interval: The expected time between heartbeats (seconds).
+        threshold: The phi above which a peer is considered disconnected. Default: 8.
+        window_size: How many inter-arrival times are remembered per peer. Default: 100.
+        min_std_deviation: Lower bound of the deviation, so that very regular heartbeats
+            do not make a slightly late one look fatal. Default: heartbeat_interval / 4.
+    """
+
+    def __init__(self, heartbeat_interval: float, threshold: float = 8.0,
+                 window_size: int = 100, min_std_deviation: float = None):
+        self.heartbeat_interval = heartbeat_interval
+        self.threshold = threshold
+        self.window_size = window_size
+        self.min_std_deviation = (min_std_deviation if min_std_deviation is not None
+                                  else heartbeat_interval / 4)
+        self.windows: Dict[Tuple[str, int], ArrivalWindow] = {}
+
+    def heartbeat(self, addr: Tuple[str, int], now: float):
+        """Records a heartbeat from a peer.
+
+        Args:
+            addr: The address of the peer.
+            now: The arrival time.
+        """
+        window = self.windows.get(addr)
+        if window is None:
+            window = self.windows[addr] = ArrivalWindow(self.window_size)
+            # until real intervals arrive, assume heartbeats come every interval, give or take a quarter
+            deviation = self.heartbeat_interval / 4
+            window.add(self.heartbeat_interval - deviation)
+            window.add(self.heartbeat_interval + deviation)
+        elif window.last_arrival is not None:
+            window.add(now - window.last_arrival)
+        window.last_arrival = now
+
+    def phi(self, addr: Tuple[str, int], now: float) -> float:
+        """Returns the current phi of a peer, or 0 if nothing was heard from it yet.
+
+        Args:
+            addr: The address of the peer.
+            now: The current time.
+        """
+        window = self.windows.get(addr)
+        if window is None:
+            return 0.0
+        elapsed = now - window.last_arrival
+        mean = window.mean()
+        y = (elapsed - mean) / max(window.std_deviation(), self.min_std_deviation)
+        # logistic approximation of the normal distribution's tail, 1 / (1 + e^-exponent). The
+        # exponent is negative for late heartbeats and positive for early ones, each branch
+        # raises e to a non-positive power, so a heartbeat far from the mean cannot overflow.
+        exponent = -y * (1.5976 + 0.070566 * y * y)
+        if elapsed > mean:
+            e = math.exp(exponent)
+            p_later = e / (1.0 + e)
+        else:
+            p_later = 1.0 / (1.0 + math.exp(-exponent))
+        if p_later <= 0.0:
+            return math.inf
+        return max(0.0, -math.log10(p_later))
+
+    def is_available(self, addr: Tuple[str, int], now: float) -> bool:
+        """Returns whether a peer's phi is still below the threshold.
+
+        Args:
+            addr: The address of the peer.
+            now: The current time.
+        """
+        return self.phi(addr, now) < self.threshold
+
+    def forget(self, addr: Tuple[str, int]):
+        """Drops the statistics of a peer that left the table.
+
+        Args:
+            addr: The address of the peer.
+        """
+        self.windows.pop(addr, None)
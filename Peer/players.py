@@ -0,0 +1,183 @@
+from array import array
+from typing import List, Tuple
+from digest import MASK64, mix64
+
+# the highest score that does not lose
+MAX_SCORE = 21
+
+
+class PlayerStates:
+    """The points, passes and losses of every seat of the current game.
+
+    Points are kept in an array indexed by seat, passes and losses in bit masks (bit i is seat i),
+    and the number of passed seats is counted as bits are set, so checking whether everyone
+    passed does not walk the seats. For the winner, the number of seats at each score from 0 to
+    21 is kept up to date, a loser scoring 0, so the leader is found without walking the seats
+    either. Removing a seat moves the later seats down with one array move and two shifts.
+
+    digest is a hash of every seat's points, pass and loss, the sum of one term per seat. A
+    change of a seat replaces its term, only removing a seat hashes the seats again.
+
+    Seats outside the table have no points and have not passed.
+
+    Args:
+        size: The number of seats. Default: 0.
+    """
+
+    def __init__(self, size: int = 0):
+        self.points = array("I", [0]) * size
+        self.pass_mask = 0
+        self.loser_mask = 0
+        self.pass_count = 0
+        self.score_counts = [0] * (MAX_SCORE + 1)
+        self.score_counts[0] = size
+        self.digest = sum(seat_term(seat, 0, False, False) for seat in range(size)) & MASK64
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def __repr__(self) -> str:
+        return (f"points={self.points.tolist()} passes={self.pass_mask:b} "
+                f"losers={self.loser_mask:b}")
+
+    @classmethod
+    def from_masks(cls, points: List[int], pass_mask: int, loser_mask: int) -> 'PlayerStates':
+        """Creates the states from the fields of a SYNC_STATE message.
+
+        Args:
+            points: The points of every seat.
+            pass_mask: The passes, bit i is set if seat i has passed.
+            loser_mask: The losers, bit i is set if seat i went over 21.
+        """
+        players = cls()
+        players.points = array("I", points)
+        full_mask = (1 << len(points)) - 1
+        players.pass_mask = pass_mask & full_mask
+        players.loser_mask = loser_mask & full_mask
+        players.pass_count = bin(players.pass_mask).count("1")
+        players.score_counts = [0] * (MAX_SCORE + 1)
+        for seat in range(len(points)):
+            players.score_counts[players.score(seat)] += 1
+        players.digest = players.full_digest()
+        return players
+
+    def resize(self, size: int):
+        """Adds seats with no points until there are size seats. Existing seats are kept.
+
+        Args:
+            size: The number of seats.
+        """
+        added = size - len(self.points)
+        if added > 0:
+            first = len(self.points)
+            self.points.extend(array("I", [0]) * added)
+            self.score_counts[0] += added
+            self.digest = (self.digest + sum(seat_term(seat, 0, False, False)
+                                             for seat in range(first, size))) & MASK64
+
+    def score(self, seat: int) -> int:
+        """Returns the score of a seat for deciding the winner, 0 if it went over 21."""
+        points = self.points[seat]
+        return 0 if self.loser_mask >> seat & 1 or points > MAX_SCORE else points
+
+    def points_of(self, seat: int) -> int:
+        """Returns the points of a seat, 0 for a seat outside the table."""
+        return self.points[seat] if 0 <= seat < len(self.points) else 0
+
+    def add_points(self, seat: int, value: int) -> int:
+        """Adds points to a seat. The caller marks the seat as lost if it went over 21.
+
+        Args:
+            seat: The seat.
+            value: The points to add.
+
+        Returns:
+            The new points of the seat.
+
+        Raises:
+            IndexError: If the seat is outside the table.
+        """
+        if not 0 <= seat < len(self.points):
+            raise IndexError(f"No seat {seat} at the table")
+        old_score = self.score(seat)
+        old_term = self.term(seat)
+        self.points[seat] += value
+        self.score_counts[old_score] -= 1
+        self.score_counts[self.score(seat)] += 1
+        self.digest = (self.digest - old_term + self.term(seat)) & MASK64
+        return self.points[seat]
+
+    def has_passed(self, seat: int) -> bool:
+        """Checks if a seat has passed."""
+        return 0 <= seat < len(self.points) and bool(self.pass_mask >> seat & 1)
+
+    def set_passed(self, seat: int):
+        """Marks a seat as passed. Seats outside the table are ignored."""
+        if 0 <= seat < len(self.points) and not self.pass_mask >> seat & 1:
+            old_term = self.term(seat)
+            self.pass_mask |= 1 << seat
+            self.pass_count += 1
+            self.digest = (self.digest - old_term + self.term(seat)) & MASK64
+
+    def set_lost(self, seat: int):
+        """Marks a seat as lost, which also passes it for the rest of the game."""
+        if not 0 <= seat < len(self.points):
+            return
+        self.set_passed(seat)
+        if not self.loser_mask >> seat & 1:
+            old_term = self.term(seat)
+            self.score_counts[self.score(seat)] -= 1
+            self.loser_mask |= 1 << seat
+            self.score_counts[0] += 1
+            self.digest = (self.digest - old_term + self.term(seat)) & MASK64
+
+    def everyone_passed(self) -> bool:
+        """Checks if every seat has passed."""
+        return self.pass_count == len(self.points)
+
+    def leader(self) -> Tuple[int, int]:
+        """Returns the highest score and how many seats have it."""
+        for score in range(MAX_SCORE, -1, -1):
+            if self.score_counts[score]:
+                return score, self.score_counts[score]
+        return 0, 0
+
+    def remove(self, seat: int):
+        """Removes a seat, the seats after it move down one.
+
+        Args:
+            seat: The seat of the player that left.
+        """
+        if not 0 <= seat < len(self.points):
+            return
+        self.score_counts[self.score(seat)] -= 1
+        if self.pass_mask >> seat & 1:
+            self.pass_count -= 1
+        del self.points[seat]
+        self.pass_mask = remove_bit(self.pass_mask, seat)
+        self.loser_mask = remove_bit(self.loser_mask, seat)
+        # the seats after it have moved, their terms change
+        self.digest = self.full_digest()
+
+    def term(self, seat: int) -> int:
+        """Returns the digest term of a seat."""
+        return seat_term(seat, self.points[seat], bool(self.pass_mask >> seat & 1), bool(self.loser_mask >> seat & 1))
+
+    def full_digest(self) -> int:
+        """Hashes every seat, see digest."""
+        return sum(self.term(seat) for seat in range(len(self.points))) & MASK64
+
+    def points_field(self) -> str:
+        """Returns the points of every seat, comma separated in seat order."""
+        return ",".join(map(str, self.points))
+
+
+def seat_term(seat: int, points: int, passed: bool, lost: bool) -> int:
+    """Returns the digest term of a seat with its points, pass and loss."""
+    return mix64(seat << 34 | points << 2 | passed << 1 | lost)
+
+
+def remove_bit(mask: int, index: int) -> int:
+    """Removes bit index from a mask, the higher bits move down one."""
+    low = mask & ((1 << index) - 1)
+    return low | (mask >> (index + 1) << index)
@@ -0,0 +1,318 @@
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from peer import Peer
+
+RELIABLE_COMMANDS = ("RELIABLE", "ACK", "SKIP")
+
+
+class PendingMessage:
+    """A sent message that has not been acknowledged yet."""
+
+    def __init__(self, message: str, clock: Optional[int], sent_at: float):
+        self.message = message
+        self.clock = clock
+        self.sent_at = sent_at
+        self.retransmits = 0
+        self.fast_retransmitted = False
+        # the sender gave up on the message and sends SKIP for its sequence number instead
+        self.skipped = False
+        self.timer = None
+
+
+class ChannelState:
+    """Sequence numbers, retransmission timer values and received messages of one peer."""
+
+    def __init__(self, initial_rto: float):
+        # sending side
+        self.next_seq = 0
+        self.unacked: Dict[int, PendingMessage] = {}
+        # the highest expected_seq an ACK of the peer carried, ACKs below it were overtaken by later ones
+        self.acked_seq = 0
+        self.srtt: Optional[float] = None
+        self.rttvar = 0.0
+        self.rto = initial_rto
+        # receiving side: every seq below expected_seq was delivered, held are the ones received above it
+        self.expected_seq = 0
+        # a skipped sequence number is held with None as its message
+        self.held: Dict[int, Tuple[Optional[List[str]], Optional[int]]] = {}
+
+
+class ReliableChannel:
+    """Reliable delivery of game commands over UDP.
+
+    Every message to a peer gets the next sequence number of that peer and is resent until the
+    peer acknowledges it. An ACK carries the next sequence number the receiver expects (everything
+    below it arrived) and the sequence numbers it received above that, so only the missing messages
+    are resent. The retransmission timeout follows the measured round trip time (RFC 6298), and is
+    doubled on each retransmission.
+
+    Received messages are delivered once each and in the order the sender sent them, messages
+    that arrive early are held until the gap before them is filled.
+
+    A message that is still not acknowledged after max_retransmits is given up on. Its sequence
+    number is then sent as SKIP!seq!seq, which is resent like a message until it is acknowledged,
+    so the peer stops waiting for it and delivers the messages it holds after it. SKIP!first!last
+    also tells a peer that lost track of the channel to stop waiting for older messages.
+
+    Args:
+        peer: Reference to the Peer instance.
+        deliver: Called with (fields, clock, addr) for each message, in order.
+        initial_rto: Retransmission timeout before the first round trip is measured (seconds). Default: 1s.
+        min_rto: Lower bound of the retransmission timeout (seconds). Default: 0.2s.
+        max_rto: Upper bound of the retransmission timeout (seconds). Default: 8s.
+        max_retransmits: How often a message is resent before giving up on it, and how often its
+            SKIP is resent after that. Default: 8.
+        max_held: How many early messages are held per peer, later ones are dropped and resent. Default: 64.
+    """
+
+    def __init__(self, peer: 'Peer', deliver, initial_rto: float = 1.0, min_rto: float = 0.2,
+                 max_rto: float = 8.0, max_retransmits: int = 8, max_held: int = 64):
+        self.peer = peer
+        self.reactor = peer.reactor
+        self.logger = peer.logger.get_module_logger("reliable")
+        self.deliver = deliver
+        self.initial_rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.max_retransmits = max_retransmits
+        self.max_held = max_held
+        self.states: Dict[Tuple[str, int], ChannelState] = {}
+        # peers to acknowledge at the end of this reactor iteration, one ACK covers a whole batch
+        self.ack_targets = set()
+
+    def state_of(self, addr: Tuple[str, int]) -> ChannelState:
+        state = self.states.get(addr)
+        if state is None:
+            state = self.states[addr] = ChannelState(self.initial_rto)
+        return state
+
+    def send(self, message: str, clock: Optional[int], addr: Tuple[str, int]):
+        """Sends a message reliably.
+
+        Args:
+            message: The message in text form.
+            clock: The Lamport clock value to attach.
+            addr: The address of the peer.
+        """
+        state = self.state_of(addr)
+        seq = state.next_seq
+        state.next_seq += 1
+        pending = state.unacked[seq] = PendingMessage(f"RELIABLE!{seq}!{message}", clock, self.reactor.seconds())
+        # the first transmission is batched with the other messages of this reactor iteration
+        self.peer.queue_message(pending.message, addr)
+        pending.timer = self.reactor.callLater(state.rto, self.retransmit, addr, seq)
+
+    def transmit(self, addr: Tuple[str, int], seq: int, pending: PendingMessage, state: ChannelState):
+        """Resends a message right away and restarts its retransmission timer."""
+        if pending.timer is not None and pending.timer.active():
+            pending.timer.cancel()
+        self.peer.send_message(pending.message, addr, pending.clock)
+        pending.timer = self.reactor.callLater(state.rto, self.retransmit, addr, seq)
+
+    def retransmit(self, addr: Tuple[str, int], seq: int):
+        """Resends a message whose retransmission timer expired.
+
+        Args:
+            addr: The address of the peer.
+            seq: The sequence number of the message.
+        """
+        state = self.states.get(addr)
+        pending = state.unacked.get(seq) if state is not None else None
+        if pending is None:
+            return
+        if pending.retransmits >= self.max_retransmits and not pending.skipped:
+            # the peer would hold every later message until this one arrives
+            self.logger.warn("Giving up on message %s to %s, telling it to skip it", seq, addr)
+            pending.skipped = True
+            pending.retransmits = 0
+            pending.message = f"SKIP!{seq}!{seq}"
+            pending.clock = None
+            self.transmit(addr, seq, pending, state)
+            return
+        if pending.retransmits >= self.max_retransmits:
+            # the failure detector decides whether the peer is gone
+            self.logger.warn("Giving up on skipping message %s to %s", seq, addr)
+            del state.unacked[seq]
+            return
+        pending.retransmits += 1
+        state.rto = min(state.rto * 2, self.max_rto)
+        self.logger.debug("Resending message %s to %s, timeout now %.2fs", seq, addr, state.rto)
+        self.transmit(addr, seq, pending, state)
+
+    def handle_message(self, splitted_command: List[str], clock: Optional[int], addr: Tuple[str, int]):
+        """Handles RELIABLE, SKIP and ACK messages.
+
+        Args:
+            splitted_command: The message split into fields.
+            clock: The Lamport clock value of the message, or None.
+            addr: The address of the sender.
+        """
+        if splitted_command[0] == "ACK":
+            self.handle_ack(int(splitted_command[1]), [int(seq) for seq in splitted_command[2:]], addr)
+            return
+
+        state = self.state_of(addr)
+        if splitted_command[0] == "SKIP":
+            self.skip(state, int(splitted_command[1]), int(splitted_command[2]), addr)
+        else:
+            seq = int(splitted_command[1])
+            message = splitted_command[2:]
+            if seq < state.expected_seq or seq in state.held:
+                self.logger.debug("Duplicate message %s from %s", seq, addr)
+            elif seq == state.expected_seq:
+                state.expected_seq += 1
+                self.deliver(message, clock, addr)
+                self.deliver_held(state, addr)
+            elif len(state.held) < self.max_held:
+                state.held[seq] = (message, clock)
+        if not self.ack_targets:
+            self.reactor.callLater(0, self.send_acks)
+        self.ack_targets.add(addr)
+
+    def skip(self, state: ChannelState, first: int, last: int, addr: Tuple[str, int]):
+        """Stops waiting for the sequence numbers first to last, which the sender will not send.
+        Messages held in that range are still delivered.
+
+        Args:
+            state: The channel state of the sender.
+            first: The first skipped sequence number.
+            last: The last skipped sequence number.
+            addr: The address of the sender.
+        """
+        self.logger.debug("Skipping messages %s to %s from %s", first, last, addr)
+        if first > state.expected_seq:
+            # an earlier message is still on its way, the skipped ones take their place after it
+            for seq in range(first, min(last + 1, first + self.max_held)):
+                state.held.setdefault(seq, (None, None))
+            return
+        for seq in sorted(seq for seq in state.held if seq <= last):
+            held_message, held_clock = state.held.pop(seq)
+            if held_message is not None:
+                self.deliver(held_message, held_clock, addr)
+        state.expected_seq = max(state.expected_seq, last + 1)
+        self.deliver_held(state, addr)
+
+    def deliver_held(self, state: ChannelState, addr: Tuple[str, int]):
+        """Delivers the held messages that are next in order."""
+        while state.expected_seq in state.held:
+            held_message, held_clock = state.held.pop(state.expected_seq)
+            state.expected_seq += 1
+            # a skipped sequence number takes its place in the order, but nothing is delivered for it
+            if held_message is not None:
+                self.deliver(held_message, held_clock, addr)
+
+    def send_acks(self):
+        """Acknowledges everything received so far from the peers that sent reliable messages."""
+        targets, self.ack_targets = self.ack_targets, set()
+        for addr in targets:
+            state = self.states.get(addr)
+            if state is None:
+                continue
+            selective = [str(seq) for seq in sorted(state.held)]
+            self.peer.send_message("!".join(["ACK", str(state.expected_seq), *selective]), addr)
+
+    def handle_ack(self, expected_seq: int, selective: List[int], addr: Tuple[str, int]):
+        """Stops resending acknowledged messages, and resends messages the peer is missing
+        once right away if it already got later ones.
+
+        If the peer's channel state does not match ours, e.g. because one side forgot the other
+        when it left the table for a moment, the peer is told to skip the messages we no longer
+        have, or our pending messages are numbered again after the ones the peer already saw.
+
+        Args:
+            expected_seq: The next sequence number the peer expects.
+            selective: Sequence numbers above expected_seq the peer received.
+            addr: The address of the peer.
+        """
+        state = self.states.get(addr)
+        if state is None:
+            return
+        if expected_seq > state.next_seq:
+            # the peer dropped our pending messages as duplicates of an earlier channel
+            self.renumber(state, expected_seq, addr)
+            return
+        if expected_seq < state.acked_seq and not any(seq in state.unacked for seq in selective):
+            # a reordered ACK: a later one already acknowledged everything it does
+            return
+        # an ACK below the floor that got a pending message is from a peer that started over
+        state.acked_seq = expected_seq
+        now = self.reactor.seconds()
+        for seq in [seq for seq in state.unacked if seq < expected_seq]:
+            self.acknowledge(state, seq, now)
+        for seq in selective:
+            if seq in state.unacked:
+                self.acknowledge(state, seq, now)
+
+        oldest = min(state.unacked, default=state.next_seq)
+        if expected_seq < oldest:
+            # the peer waits for messages that were acknowledged by an earlier channel, or given up on
+            self.peer.send_message(f"SKIP!{expected_seq}!{oldest - 1}", addr)
+
+        if selective:
+            highest = max(selective)
+            for seq, pending in list(state.unacked.items()):
+                if seq < highest and not pending.fast_retransmitted:
+                    pending.fast_retransmitted = True
+                    self.transmit(addr, seq, pending, state)
+
+    def renumber(self, state: ChannelState, first_seq: int, addr: Tuple[str, int]):
+        """Sends the pending messages again with sequence numbers from first_seq on.
+
+        Args:
+            state: The channel state of the peer.
+            first_seq: The next sequence number the peer expects.
+            addr: The address of the peer.
+        """
+        self.logger.debug("Channel to %s was reset, resending from %s", addr, first_seq)
+        pending_messages = [state.unacked[seq] for seq in sorted(state.unacked)]
+        state.unacked = {}
+        state.next_seq = first_seq
+        state.acked_seq = first_seq
+        for pending in pending_messages:
+            if pending.timer is not None and pending.timer.active():
+                pending.timer.cancel()
+            if pending.skipped:
+                continue
+            seq = state.next_seq
+            state.next_seq += 1
+            pending.message = f"RELIABLE!{seq}!{pending.message.split('!', 2)[2]}"
+            state.unacked[seq] = pending
+            self.transmit(addr, seq, pending, state)
+
+    def acknowledge(self, state: ChannelState, seq: int, now: float):
+        """Removes an acknowledged message and measures the round trip time."""
+        pending = state.unacked.pop(seq)
+        if pending.timer is not None and pending.timer.active():
+            pending.timer.cancel()
+        # resent messages do not give a usable round trip time (Karn's algorithm)
+        if pending.retransmits == 0 and not pending.fast_retransmitted and not pending.skipped:
+            self.update_rto(state, now - pending.sent_at)
+
+    def update_rto(self, state: ChannelState, rtt: float):
+        """Updates the smoothed round trip time and the retransmission timeout (RFC 6298)."""
+        if state.srtt is None:
+            state.srtt = rtt
+            state.rttvar = rtt / 2
+        else:
+            state.rttvar = 0.75 * state.rttvar + 0.25 * abs(state.srtt - rtt)
+            state.srtt = 0.875 * state.srtt + 0.125 * rtt
+        state.rto = min(max(state.srtt + 4 * state.rttvar, self.min_rto), self.max_rto)
+
+    def forget(self, addr: Tuple[str, int]):
+        """Drops the state of a peer that left the table, so it starts fresh if it comes back.
+
+        Args:
+            addr: The address of the peer.
+        """
+        state = self.states.pop(addr, None)
+        if state is None:
+            return
+        for pending in state.unacked.values():
+            if pending.timer is not None and pending.timer.active():
+                pending.timer.cancel()
+
+    def stop(self):
+        """Stops all retransmissions."""
+        for addr in list(self.states):
+            self.forget(addr)
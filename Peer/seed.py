@@ -0,0 +1,125 @@
+import hashlib
+import random
+import secrets
+from typing import Dict, List, Optional, Tuple
+from deck import Deck
+
+SHARE_SIZE = 16
+
+
+def commitment(round_id: int, share: bytes) -> bytes:
+    """Returns the commitment to a seed share, a truncated SHA-256 of the round and the share."""
+    return hashlib.sha256(round_id.to_bytes(4, "big") + share).digest()[:SHARE_SIZE]
+
+
+def deck_from_seed(seed: bytes, number_of_decks: int) -> Deck:
+    """Shuffles a shoe with a PRNG seeded from a shared seed. Every peer gets the same shoe
+    from the same seed, as long as they run the same random module (Python 3).
+
+    Args:
+        seed: The combined seed of a round.
+        number_of_decks: How many 52 card decks the shoe contains.
+    """
+    return Deck.shuffled(number_of_decks, random.Random(int.from_bytes(seed, "big")))
+
+
+def parse_tag(fields: List[str]) -> Tuple[int, str, int]:
+    """Returns the round tag of the stamp, IP and port fields of a seed message.
+
+    Args:
+        fields: The three fields.
+    """
+    return int(fields[0]), fields[1], int(fields[2])
+
+
+class SeedRound:
+    """One commit-reveal round that agrees on the seed of a shoe.
+
+    Every player picks a random share and broadcasts a commitment to it (SEED_COMMIT). Once a
+    player has the commitments of everyone, it reveals its share (SEED_REVEAL). The seed is the
+    hash of all shares in turn order, so no player can pick the shoe: a share chosen after seeing
+    the others would not match its commitment.
+
+    Every message of the round carries its tag, the Lamport clock value of the player who started
+    it and that player's address, so the players can tell a late message of an earlier round
+    from the start of a new one.
+
+    Args:
+        round_id: Identifies the round, picked by the player who started it.
+        number_of_decks: How many decks the shoe has.
+        players: How many players take part.
+        own_index: The turn index of this player.
+        tag: (Lamport clock value, IP, port) of the round's start. Default: (0, "0.0.0.0", 0).
+    """
+
+    def __init__(self, round_id: int, number_of_decks: int, players: int, own_index: int,
+                 tag: Tuple[int, str, int] = (0, "0.0.0.0", 0)):
+        self.round_id = round_id
+        self.tag = tag
+        self.number_of_decks = number_of_decks
+        self.players = players
+        self.own_index = own_index
+        self.share = secrets.token_bytes(SHARE_SIZE)
+        self.commits: Dict[int, bytes] = {own_index: commitment(round_id, self.share)}
+        self.shares: Dict[int, bytes] = {}
+        self.revealed = False
+        # how often the own messages were sent again, see Gameplay.resend_seed_round
+        self.resends = 0
+
+    def tag_fields(self) -> str:
+        """Returns the tag of the round as message fields, stamp!ip!port."""
+        return "!".join(map(str, self.tag))
+
+    def commit_message(self) -> str:
+        """Returns the SEED_COMMIT!round!decks!commitment!stamp!ip!port message of this player."""
+        return (f"SEED_COMMIT!{self.round_id}!{self.number_of_decks}!{self.commits[self.own_index].hex()}"
+                f"!{self.tag_fields()}")
+
+    def add_commit(self, index: int, commit: str):
+        """Records the commitment of a player.
+
+        Args:
+            index: The turn index of the player.
+            commit: The commitment as hex.
+        """
+        self.commits[index] = bytes.fromhex(commit)
+
+    def add_reveal(self, index: int, share: str):
+        """Records the revealed share of a player. It is checked once every share is in.
+
+        Args:
+            index: The turn index of the player.
+            share: The share as hex.
+        """
+        self.shares[index] = bytes.fromhex(share)
+
+    def reveal_message(self) -> Optional[str]:
+        """Returns the SEED_REVEAL message once every player has committed, and only once."""
+        if self.revealed or len(self.commits) < self.players:
+            return None
+        self.revealed = True
+        self.shares[self.own_index] = self.share
+        return self.share_message()
+
+    def share_message(self) -> str:
+        """Returns the SEED_REVEAL!round!share!stamp!ip!port message of this player."""
+        return f"SEED_REVEAL!{self.round_id}!{self.share.hex()}!{self.tag_fields()}"
+
+    def resend_messages(self) -> List[str]:
+        """Returns the messages this player sent in the round so far, for the players that lost them."""
+        if self.revealed:
+            return [self.commit_message(), self.share_message()]
+        return [self.commit_message()]
+
+    def seed(self) -> Optional[bytes]:
+        """Returns the combined seed, or None while shares are missing.
+
+        Raises:
+            ValueError: If a share does not match its commitment.
+        """
+        if len(self.shares) < self.players or len(self.commits) < self.players:
+            return None
+        for index, share in self.shares.items():
+            if commitment(self.round_id, share) != self.commits.get(index):
+                raise ValueError(f"the seed share of player {index} does not match its commitment")
+        return hashlib.sha256(b"".join(self.shares[index] for index in sorted(self.shares))).digest()
@@ -0,0 +1,291 @@
+import math
+import random
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from heartbeat import HeartbeatManager
+
+# member states, as used in the piggybacked updates
+ALIVE = "a"
+SUSPECT = "s"
+DEAD = "d"
+
+SWIM_COMMANDS = ("SWIM_PING", "SWIM_ACK", "SWIM_PING_REQ")
+
+
+class SwimDetector:
+    """SWIM-style failure detection, used by HeartbeatManager in "swim" mode.
+
+    Every protocol period the peer pings one member, picked in a shuffled round-robin order.
+    If there is no ack within ack_timeout, k other members are asked to ping the member for us
+    (SWIM_PING_REQ). A member that does not answer either way is only suspected. The suspicion
+    is gossiped, and the member has suspicion_periods protocol periods to refute it by gossiping
+    a higher incarnation number before it is declared dead.
+
+    Membership updates (alive, suspect, dead) are piggybacked on the pings and acks, so every
+    peer sends a constant number of messages per period regardless of the table size.
+
+    Args:
+        manager: Reference to the HeartbeatManager instance.
+        indirect_probes: How many members are asked to ping a member that did not ack. Default: 3.
+        suspicion_periods: How many protocol periods a suspected member has to refute. Default: 3.
+        max_piggyback: Maximum number of updates attached to one message. Default: 6.
+    """
+
+    def __init__(self, manager: 'HeartbeatManager', indirect_probes: int = 3,
+                 suspicion_periods: int = 3, max_piggyback: int = 6):
+        self.manager = manager
+        self.peer = manager.peer
+        self.reactor = manager.peer.reactor
+        self.logger = manager.logger
+        self.period = manager.heartbeat_interval
+        self.ack_timeout = self.period / 3
+        self.indirect_probes = indirect_probes
+        self.suspicion_periods = suspicion_periods
+        self.max_piggyback = max_piggyback
+
+        self.incarnation = 0
+        # state and incarnation of each member, members without an entry are alive with incarnation 0
+        self.states: Dict[Tuple[str, int], Tuple[str, int]] = {}
+        self.suspicion_timers = {}
+        # updates to piggyback: member -> [update, sends left]
+        self.updates: Dict[Tuple[str, int], List] = {}
+        self.probe_order: List[Tuple[str, int]] = []
+        self.probe_target: Optional[Tuple[str, int]] = None
+        self.probe_seq = -1
+        self.acked = True
+        self.next_seq = 0
+        # pings sent for another member's SWIM_PING_REQ: our seq -> (requester, requester's seq)
+        self.relays: Dict[int, Tuple[Tuple[str, int], int]] = {}
+        self.probe_loop = None
+        self.indirect_call = None
+
+    def start(self):
+        """Start the protocol periods."""
+        self.probe_loop = self.reactor.callLater(0, self.probe)
+
+    def stop(self):
+        """Stop the protocol periods and the suspicion timers."""
+        for call in [self.probe_loop, self.indirect_call, *self.suspicion_timers.values()]:
+            if call is not None and call.active():
+                call.cancel()
+        self.suspicion_timers = {}
+
+    def members(self) -> List[Tuple[str, int]]:
+        """Returns the other peers of the table."""
+        return [addr for addr in self.peer.members if addr != self.peer.id]
+
+    def probe(self):
+        """Runs one protocol period: suspects the last target if it never acked, then pings the next one."""
+        try:
+            if not self.acked and self.probe_target in self.peer.members:
+                self.suspect(self.probe_target)
+
+            self.probe_target = self.next_target()
+            self.acked = True
+            if self.probe_target is not None:
+                self.acked = False
+                self.probe_seq = self.new_seq()
+                self.send("SWIM_PING", [str(self.probe_seq)], self.probe_target)
+                self.indirect_call = self.reactor.callLater(
+                    self.ack_timeout, self.probe_indirectly, self.probe_target, self.probe_seq)
+        except Exception as e:
+            self.logger.warn("Error in SWIM probe: %s", e)
+        self.probe_loop = self.reactor.callLater(self.period, self.probe)
+
+    def probe_indirectly(self, target: Tuple[str, int], seq: int):
+        """Asks other members to ping a target that did not ack in time.
+
+        Args:
+            target: The member that did not ack.
+            seq: The sequence number of the unanswered ping.
+        """
+        if self.acked or seq != self.probe_seq:
+            return
+        helpers = [addr for addr in self.members() if addr != target]
+        for helper in random.sample(helpers, min(self.indirect_probes, len(helpers))):
+            self.send("SWIM_PING_REQ", [str(seq), target[0], str(target[1])], helper)
+
+    def next_target(self) -> Optional[Tuple[str, int]]:
+        """Returns the next member to ping. Members are pinged in a shuffled round-robin order,
+        so every member is pinged once per len(members) periods."""
+        while self.probe_order:
+            target = self.probe_order.pop()
+            if target in self.peer.members:
+                return target
+        members = self.members()
+        if not members:
+            return None
+        random.shuffle(members)
+        self.probe_order = members
+        return self.probe_order.pop()
+
+    def handle_message(self, splitted_command: List[str], addr: Tuple[str, int]):
+        """Handles SWIM_PING, SWIM_ACK and SWIM_PING_REQ messages.
+
+        Args:
+            splitted_command: The message split into fields.
+            addr: The address of the sender.
+        """
+        command = splitted_command[0]
+        seq = int(splitted_command[1])
+
+        if command == "SWIM_PING":
+            self.apply_updates(splitted_command[2:])
+            self.send("SWIM_ACK", [str(seq)], addr)
+        elif command == "SWIM_ACK":
+            self.apply_updates(splitted_command[2:])
+            if seq == self.probe_seq:
+                self.acked = True
+            elif seq in self.relays:
+                requester, requester_seq = self.relays.pop(seq)
+                self.send("SWIM_ACK", [str(requester_seq)], requester)
+        elif command == "SWIM_PING_REQ":
+            target = (splitted_command[2], int(splitted_command[3]))
+            self.apply_updates(splitted_command[4:])
+            relay_seq = self.new_seq()
+            self.relays[relay_seq] = (addr, seq)
+            # forget the relay if the target never answers
+            self.reactor.callLater(self.period, self.relays.pop, relay_seq, None)
+            self.send("SWIM_PING", [str(relay_seq)], target)
+
+    def suspect(self, addr: Tuple[str, int]):
+        """Marks a member that did not answer a direct or indirect ping as suspected.
+
+        Args:
+            addr: The address of the member.
+        """
+        state, incarnation = self.states.get(addr, (ALIVE, 0))
+        if state == ALIVE:
+            self.logger.debug("Suspecting %s", addr)
+            self.set_suspect(addr, incarnation)
+
+    def set_suspect(self, addr: Tuple[str, int], incarnation: int):
+        """Records a suspicion, gossips it and starts the suspicion timer.
+
+        Args:
+            addr: The address of the member.
+            incarnation: The incarnation number the suspicion is about.
+        """
+        self.states[addr] = (SUSPECT, incarnation)
+        self.gossip(SUSPECT, addr, incarnation)
+        self.cancel_suspicion(addr)
+        self.suspicion_timers[addr] = self.reactor.callLater(
+            self.suspicion_periods * self.period, self.confirm_dead, addr, incarnation)
+
+    def cancel_suspicion(self, addr: Tuple[str, int]):
+        """Stops the suspicion timer of a member.
+
+        Args:
+            addr: The address of the member.
+        """
+        call = self.suspicion_timers.pop(addr, None)
+        if call is not None and call.active():
+            call.cancel()
+
+    def confirm_dead(self, addr: Tuple[str, int], incarnation: int):
+        """Declares a suspected member dead, if it did not refute the suspicion in time.
+
+        Args:
+            addr: The address of the member.
+            incarnation: The incarnation number the suspicion was about.
+        """
+        self.suspicion_timers.pop(addr, None)
+        if self.states.get(addr) == (SUSPECT, incarnation):
+            self.declare_dead(addr, incarnation)
+
+    def declare_dead(self, addr: Tuple[str, int], incarnation: int):
+        """Removes a dead member from the table and gossips its death.
+
+        Args:
+            addr: The address of the member.
+            incarnation: The incarnation number of the member.
+        """
+        self.cancel_suspicion(addr)
+        self.states.pop(addr, None)
+        self.gossip(DEAD, addr, incarnation)
+        if addr in self.peer.members:
+            self.logger.info("Peer disconnected due to heartbeat timeout.")
+            self.logger.debug("%s declared dead by SWIM.", addr)
+            self.peer.handle_peer_disconnection(addr)
+
+    def apply_updates(self, updates: List[str]):
+        """Applies piggybacked membership updates, e.g. "s10.0.0.2:4000:3".
+
+        Args:
+            updates: The updates, a state followed by ip:port:incarnation.
+        """
+        for update in updates:
+            ip, port, incarnation = update[1:].split(":")
+            self.apply_update(update[0], (ip, int(port)), int(incarnation))
+
+    def apply_update(self, state: str, addr: Tuple[str, int], incarnation: int):
+        """Applies one membership update using the SWIM precedence rules.
+
+        Args:
+            state: ALIVE, SUSPECT or DEAD.
+            addr: The address of the member.
+            incarnation: The incarnation number of the update.
+        """
+        if addr == self.peer.id:
+            if state != ALIVE and incarnation >= self.incarnation:
+                # refute the suspicion
+                self.incarnation = incarnation + 1
+                self.gossip(ALIVE, addr, self.incarnation)
+            return
+        if addr not in self.peer.members:
+            return
+
+        current_state, current_incarnation = self.states.get(addr, (ALIVE, 0))
+        if state == DEAD:
+            self.declare_dead(addr, incarnation)
+        elif state == SUSPECT:
+            if incarnation > current_incarnation or (incarnation == current_incarnation and current_state == ALIVE):
+                self.set_suspect(addr, incarnation)
+        elif incarnation > current_incarnation:
+            self.cancel_suspicion(addr)
+            self.states[addr] = (ALIVE, incarnation)
+            self.gossip(ALIVE, addr, incarnation)
+
+    def gossip(self, state: str, addr: Tuple[str, int], incarnation: int):
+        """Queues an update to be piggybacked on the next messages.
+        Each update is sent about 3 * log2(n) times, which is enough to reach every member.
+
+        Args:
+            state: ALIVE, SUSPECT or DEAD.
+            addr: The address of the member.
+            incarnation: The incarnation number of the member.
+        """
+        sends = max(1, math.ceil(3 * math.log2(len(self.peer.members) + 1)))
+        self.updates[addr] = [f"{state}{addr[0]}:{addr[1]}:{incarnation}", sends]
+
+    def piggyback(self) -> List[str]:
+        """Returns the updates to attach to the next message, least sent first."""
+        if not self.updates:
+            return []
+        chosen = sorted(self.updates.items(), key=lambda item: -item[1][1])[:self.max_piggyback]
+        updates = []
+        for addr, entry in chosen:
+            updates.append(entry[0])
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self.updates[addr]
+        return updates
+
+    def send(self, command: str, fields: List[str], addr: Tuple[str, int]):
+        """Sends a SWIM message with piggybacked updates.
+
+        Args:
+            command: The SWIM command.
+            fields: The fields of the command.
+            addr: The address of the receiver.
+        """
+        try:
+            self.peer.send_message("!".join([command, *fields, *self.piggyback()]), addr)
+        except Exception as e:
+            self.logger.warn("Error sending %s to %s: %s", command, addr, e)
+
+    def new_seq(self) -> int:
+        """Returns a new probe sequence number."""
+        self.next_seq += 1
+        return self.next_seq
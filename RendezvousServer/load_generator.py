@@ -0,0 +1,423 @@
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from twisted.internet import reactor
+from twisted.internet.protocol import DatagramProtocol
+from twisted.internet.task import LoopingCall
+
+# the wire codec is shared with the peers
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Peer"))
+import codec # pylint: disable=wrong-import-position
+
+# how often the generator sends the joins, heartbeats and leaves that are due (seconds)
+TICK = 0.01
+
+
+def read_cpu_seconds(pid: int) -> Optional[float]:
+    """Returns the CPU time a process used so far, or None where /proc is not available."""
+    try:
+        with open(f"/proc/{pid}/stat", encoding="utf-8") as stat_file:
+            # the fields after the command name, which is in parentheses and may contain spaces
+            fields = stat_file.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    # utime and stime are fields 14 and 15 of the file
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def percentile(values: List[float], share: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class LoadClient(DatagramProtocol):
+    """One emulated client with its own UDP socket, since the server tells clients apart by address.
+
+    Args:
+        generator: The load generator that drives the client.
+    """
+
+    def __init__(self, generator: 'LoadGenerator'):
+        self.generator = generator
+        # the step and the time of a join that was not answered yet
+        self.pending_join: Optional[Tuple['Step', float]] = None
+
+    def datagramReceived(self, datagram: bytes, addr):
+        self.generator.received += 1
+        if self.pending_join is None or not datagram:
+            return
+        try:
+            command = codec.decode(datagram)[0][0]
+        except ValueError:
+            return
+        if command == "PLAYER_ORDER":
+            step, sent_at = self.pending_join
+            self.pending_join = None
+            step.latencies.append(time.perf_counter() - sent_at)
+            self.generator.answered(self)
+        elif command == "ROOM_FULL":
+            step, _ = self.pending_join
+            self.pending_join = None
+            step.rejected += 1
+            self.generator.idle.append(self)
+
+    def send(self, message: str):
+        self.transport.write(codec.encode(message, version=self.generator.version), self.generator.server)
+
+
+class Step:
+    """The load and the results of one step of the ramp.
+
+    Args:
+        join_rate: Joins per second during the step.
+    """
+
+    def __init__(self, join_rate: float):
+        self.join_rate = join_rate
+        self.joins = 0
+        self.leaves = 0
+        self.heartbeats = 0
+        self.rejected = 0
+        self.lost = 0
+        # joins that could not be sent because every client was seated
+        self.skipped = 0
+        self.latencies: List[float] = []
+        self.seated_at_end = 0
+        self.server_cpu: Optional[float] = None
+        self.generator_cpu = 0.0
+
+    def loss(self) -> float:
+        return self.lost / self.joins if self.joins else 0.0
+
+    def report(self) -> Dict:
+        latency_ms = {name: round(value * 1000, 2) if value is not None else None
+                      for name, value in (("p50", percentile(self.latencies, 0.5)),
+                                          ("p95", percentile(self.latencies, 0.95)),
+                                          ("p99", percentile(self.latencies, 0.99)),
+                                          ("max", max(self.latencies, default=None)))}
+        return {
+            "join_rate": self.join_rate,
+            "joins": self.joins,
+            "answered": len(self.latencies),
+            "lost": self.lost,
+            "loss": round(self.loss(), 4),
+            "rejected": self.rejected,
+            "skipped": self.skipped,
+            "leaves": self.leaves,
+            "heartbeats": self.heartbeats,
+            "seated": self.seated_at_end,
+            "join_latency_ms": latency_ms,
+            "server_cpu": round(self.server_cpu, 3) if self.server_cpu is not None else None,
+            "generator_cpu": round(self.generator_cpu, 3),
+        }
+
+
+class LoadGenerator:
+    """Emulates many clients of a rendezvous server and finds the join rate that saturates it.
+
+    The join rate goes up by rate_step every step_duration seconds. Seated clients send a
+    heartbeat every heartbeat_interval seconds and leave again at the churn rate, either spread
+    out ("steady") or all at once every burst_interval seconds ("burst"), after which they can
+    join again. A join counts as lost if no PLAYER_ORDER comes back within join_timeout.
+
+    A step is saturated when its loss is above max_loss, its 95th percentile join latency is
+    above max_latency, or the server used more than max_cpu of a core. The ramp stops after the
+    first saturated step.
+
+    Args:
+        server: The address of the server.
+        clients: How many clients (sockets) there are at most.
+        start_rate: Joins per second of the first step.
+        rate_step: How much the join rate grows every step.
+        steps: The most steps to run.
+        step_duration: How long each step runs (seconds).
+        heartbeat_interval: Time between heartbeats of a seated client (seconds).
+        churn: The share of seated clients that leave per second.
+        churn_pattern: "steady" or "burst".
+        burst_interval: Time between the leaves of the burst pattern (seconds).
+        join_timeout: How long a join may wait for its PLAYER_ORDER (seconds).
+        max_loss: The highest loss of a step that is not saturated.
+        max_latency: The highest 95th percentile join latency of a step that is not saturated (seconds).
+        max_cpu: The highest share of a core the server may use in a step that is not saturated.
+        server_pid: The process of the server, to measure its CPU time. Default: None.
+        room_seats: Seats of the named rooms the clients ask for, or 0 for auto-assigned rooms. Default: 0.
+        version: Protocol version of the clients. Default: codec.BINARY_VERSION.
+    """
+
+    def __init__(self, server: Tuple[str, int], clients: int, start_rate: float, rate_step: float,
+                 steps: int, step_duration: float, heartbeat_interval: float, churn: float,
+                 churn_pattern: str, burst_interval: float, join_timeout: float, max_loss: float,
+                 max_latency: float, max_cpu: float, server_pid: Optional[int] = None,
+                 room_seats: int = 0, version: int = codec.BINARY_VERSION):
+        self.server = server
+        self.clients = [LoadClient(self) for _ in range(clients)]
+        self.start_rate = start_rate
+        self.rate_step = rate_step
+        self.max_steps = steps
+        self.step_duration = step_duration
+        self.heartbeat_interval = heartbeat_interval
+        self.churn = churn
+        self.churn_pattern = churn_pattern
+        self.burst_interval = burst_interval
+        self.join_timeout = join_timeout
+        self.max_loss = max_loss
+        self.max_latency = max_latency
+        self.max_cpu = max_cpu
+        self.server_pid = server_pid
+        self.room_seats = room_seats
+        self.version = version
+        self.idle = deque(self.clients)
+        # seated clients in heartbeat order, and the clients waiting for a PLAYER_ORDER by join time
+        self.seated = deque()
+        self.waiting = deque()
+        self.received = 0
+        self.steps: List[Step] = []
+        self.step: Optional[Step] = None
+        self.step_started = 0.0
+        self.last_tick = 0.0
+        self.last_burst = 0.0
+        # fractional joins, heartbeats and leaves carried over between ticks
+        self.join_credit = 0.0
+        self.heartbeat_credit = 0.0
+        self.leave_credit = 0.0
+        self.cpu_at_step_start: Optional[float] = None
+        self.own_cpu_at_step_start = 0.0
+        self.loop = LoopingCall(self.tick)
+
+    def start(self):
+        """Binds the sockets of the clients and starts the first step."""
+        for client in self.clients:
+            reactor.listenUDP(0, client, interface="127.0.0.1" if self.server[0] == "127.0.0.1" else "")
+        self.last_tick = time.perf_counter()
+        self.next_step()
+        self.loop.start(TICK, now=False)
+
+    def next_step(self):
+        """Closes the current step, then starts the next one or stops once a step was saturated."""
+        now = time.perf_counter()
+        if self.step is not None:
+            self.finish_step(now)
+            # the losses of a step are only known join_timeout after it, so this may be the step after the saturated one
+            if any(self.is_saturated(step) for step in self.steps) or len(self.steps) >= self.max_steps:
+                # let the last joins be answered or time out
+                self.step = None
+                reactor.callLater(self.join_timeout, self.stop)
+                return
+        self.step = Step(self.start_rate + self.rate_step * len(self.steps))
+        self.steps.append(self.step)
+        self.step_started = now
+        self.cpu_at_step_start = read_cpu_seconds(self.server_pid) if self.server_pid else None
+        self.own_cpu_at_step_start = time.process_time()
+        reactor.callLater(self.step_duration, self.next_step)
+
+    def finish_step(self, now: float):
+        step = self.step
+        elapsed = now - self.step_started
+        step.seated_at_end = len(self.seated)
+        step.generator_cpu = (time.process_time() - self.own_cpu_at_step_start) / elapsed
+        if self.cpu_at_step_start is not None:
+            cpu = read_cpu_seconds(self.server_pid)
+            if cpu is not None:
+                step.server_cpu = (cpu - self.cpu_at_step_start) / elapsed
+
+    def is_saturated(self, step: Step) -> bool:
+        p95 = percentile(step.latencies, 0.95)
+        return (step.loss() > self.max_loss
+                or (p95 is not None and p95 > self.max_latency)
+                or (step.server_cpu is not None and step.server_cpu > self.max_cpu))
+
+    def tick(self):
+        now = time.perf_counter()
+        elapsed = now - self.last_tick
+        self.last_tick = now
+        self.expire_joins(now)
+        if self.step is None:
+            return
+
+        self.join_credit += self.step.join_rate * elapsed
+        while self.join_credit >= 1:
+            self.join_credit -= 1
+            if not self.idle:
+                self.step.skipped += 1
+                continue
+            self.join(self.idle.popleft(), now)
+
+        self.heartbeat_credit += len(self.seated) * elapsed / self.heartbeat_interval
+        for _ in range(min(int(self.heartbeat_credit), len(self.seated))):
+            client = self.seated[0]
+            self.seated.rotate(-1)
+            client.send("HEARTBEAT")
+            self.step.heartbeats += 1
+        self.heartbeat_credit -= int(self.heartbeat_credit)
+
+        self.leave_credit += len(self.seated) * self.churn * elapsed
+        if self.churn_pattern == "burst" and now - self.last_burst < self.burst_interval:
+            return
+        self.last_burst = now
+        for _ in range(min(int(self.leave_credit), len(self.seated))):
+            self.leave(self.seated.popleft())
+        self.leave_credit -= int(self.leave_credit)
+
+    def join(self, client: LoadClient, now: float):
+        self.step.joins += 1
+        client.pending_join = (self.step, now)
+        self.waiting.append(client)
+        if self.room_seats:
+            # a named room per group of clients, so every room fills up
+            room = f"load-{self.step.joins // self.room_seats}-{len(self.steps)}"
+            client.send(f"ready!{self.version}!{room}!{self.room_seats}")
+        else:
+            client.send(f"ready!{self.version}!")
+
+    def answered(self, client: LoadClient):
+        self.seated.append(client)
+
+    def expire_joins(self, now: float):
+        """Counts the joins that waited longer than join_timeout as lost, and frees their clients."""
+        while self.waiting and (self.waiting[0].pending_join is None
+                                or now - self.waiting[0].pending_join[1] > self.join_timeout):
+            client = self.waiting.popleft()
+            if client.pending_join is None:
+                continue # answered or rejected
+            step, _ = client.pending_join
+            client.pending_join = None
+            step.lost += 1
+            # the server may have seated it anyway
+            client.send("disconnect")
+            self.idle.append(client)
+
+    def leave(self, client: LoadClient):
+        client.send("disconnect")
+        self.step.leaves += 1
+        self.idle.append(client)
+
+    def stop(self):
+        self.expire_joins(float("inf"))
+        for client in self.seated:
+            client.send("disconnect")
+        self.seated.clear()
+        self.loop.stop()
+        reactor.stop()
+
+    def report(self) -> Dict:
+        """Returns the results of every step and the saturation point."""
+        steps = [step.report() for step in self.steps]
+        saturated = next((step for step in self.steps if self.is_saturated(step)), None)
+        healthy = [step for step in self.steps if not self.is_saturated(step)]
+        return {
+            "server": f"{self.server[0]}:{self.server[1]}",
+            "clients": len(self.clients),
+            "datagrams_received": self.received,
+            "steps": steps,
+            "saturation_join_rate": saturated.join_rate if saturated is not None else None,
+            "max_healthy_join_rate": healthy[-1].join_rate if healthy else None,
+            "max_healthy_seated": max((step.seated_at_end for step in healthy), default=None),
+        }
+
+
+def free_udp_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def raise_file_limit(sockets: int):
+    """Raises the open file limit towards the hard limit, since every client has a socket."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = sockets + 64
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted if hard == resource.RLIM_INFINITY else min(wanted, hard), hard))
+
+
+def print_report(report: Dict):
+    print(f"{'rate/s':>8} {'joins':>7} {'lost':>6} {'loss':>7} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'skipped':>7} {'seated':>7} {'hb':>7} {'srv cpu':>8} {'gen cpu':>8}")
+    for step in report["steps"]:
+        server_cpu = f"{step['server_cpu']:.0%}" if step["server_cpu"] is not None else "-"
+        print(f"{step['join_rate']:>8} {step['joins']:>7} {step['lost']:>6} {step['loss']:>7.2%} "
+              f"{step['join_latency_ms']['p50'] or '-':>8} {step['join_latency_ms']['p95'] or '-':>8} "
+              f"{step['skipped']:>7} {step['seated']:>7} {step['heartbeats']:>7} {server_cpu:>8} {step['generator_cpu']:>8.0%}")
+    if any(step["skipped"] for step in report["steps"]):
+        print("Some joins were skipped because every client was seated, try more --clients or more --churn.")
+    if report["saturation_join_rate"] is None:
+        print("The server was not saturated, try a higher --rate-step or more --steps.")
+    else:
+        print(f"Saturated at {report['saturation_join_rate']} joins/s. Highest healthy rate: "
+              f"{report['max_healthy_join_rate']} joins/s with up to {report['max_healthy_seated']} seated clients.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load generator for the rendezvous server")
+    parser.add_argument("--server", default=None,
+                        help="host:port of a running server. By default a server is started on a free local port.")
+    parser.add_argument("--server-pid", type=int, default=None,
+                        help="Process id of the server given with --server, to measure its CPU time.")
+    parser.add_argument("--server-runtime", choices=["twisted", "asyncio"], default="twisted",
+                        help="Event loop of the server that is started.")
+    parser.add_argument("--clients", type=int, default=2000, help="Most clients (sockets) to emulate.")
+    parser.add_argument("--rate", type=float, default=50.0, help="Joins per second of the first step.")
+    parser.add_argument("--rate-step", type=float, default=50.0, help="How much the join rate grows every step.")
+    parser.add_argument("--steps", type=int, default=20, help="Most steps to run.")
+    parser.add_argument("--step-duration", type=float, default=5.0, help="How long each step runs (seconds).")
+    parser.add_argument("--heartbeat-interval", type=float, default=1.0,
+                        help="Time between heartbeats of a seated client (seconds).")
+    parser.add_argument("--churn", type=float, default=0.1, help="Share of seated clients that leave per second.")
+    parser.add_argument("--churn-pattern", choices=["steady", "burst"], default="steady",
+                        help="Whether clients leave spread out or all at once every --burst-interval.")
+    parser.add_argument("--burst-interval", type=float, default=2.0, help="Time between leave bursts (seconds).")
+    parser.add_argument("--room-seats", type=int, default=0,
+                        help="Ask for named rooms of this many seats instead of auto-assigned rooms.")
+    parser.add_argument("--protocol", choices=["text", "binary"], default="binary", help="Wire protocol of the clients.")
+    parser.add_argument("--join-timeout", type=float, default=2.0,
+                        help="How long a join waits for its PLAYER_ORDER before it counts as lost (seconds).")
+    parser.add_argument("--max-loss", type=float, default=0.01, help="Highest loss of a healthy step.")
+    parser.add_argument("--max-latency", type=float, default=0.5,
+                        help="Highest 95th percentile join latency of a healthy step (seconds).")
+    parser.add_argument("--max-cpu", type=float, default=0.9, help="Highest share of a core the server may use.")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    args = parser.parse_args()
+
+    server_process = None
+    if args.server is None:
+        port = free_udp_port()
+        server_process = subprocess.Popen(
+            [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py"),
+             "--port", str(port), "--runtime", args.server_runtime],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        server_address = ("127.0.0.1", port)
+        server_pid = server_process.pid
+        # give the server time to bind its port
+        time.sleep(1.0)
+    else:
+        host, port = args.server.rsplit(":", 1)
+        server_address = (socket.gethostbyname(host), int(port))
+        server_pid = args.server_pid
+
+    raise_file_limit(args.clients)
+    generator = LoadGenerator(
+        server_address, args.clients, args.rate, args.rate_step, args.steps, args.step_duration,
+        args.heartbeat_interval, args.churn, args.churn_pattern, args.burst_interval, args.join_timeout,
+        args.max_loss, args.max_latency, args.max_cpu, server_pid=server_pid, room_seats=args.room_seats,
+        version=codec.BINARY_VERSION if args.protocol == "binary" else codec.TEXT_VERSION)
+    reactor.callWhenRunning(generator.start)
+    try:
+        reactor.run()
+    finally:
+        if server_process is not None:
+            server_process.terminate()
+            server_process.wait()
+
+    result = generator.report()
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
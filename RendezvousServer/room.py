@@ -0,0 +1,73 @@
+from typing import Dict, List, Optional, Set, Tuple
+
+
+class Room:
+    """A table of players. Player order, joins and disconnections are only sent inside the room.
+
+    Clients are (IP, port, table id) addresses, and every host (IP, port) has at most one seat.
+    Every membership update the server sends increases the epoch of the room. Changes made
+    within the coalescing window are collected in pending_changes and sent as one update.
+
+    Args:
+        name: The name of the room.
+        max_seats: How many players the room can hold.
+        auto_assigned: Whether the server created the room for players who did not ask for one.
+    """
+
+    def __init__(self, name: str, max_seats: int, auto_assigned: bool = False):
+        self.name = name
+        self.max_seats = max_seats
+        self.auto_assigned = auto_assigned
+        # insertion-ordered, so iterating gives the player order, while lookups and removals are O(1)
+        self.clients: Dict[Tuple[str, int, int], None] = {}
+        self.hosts: Set[Tuple[str, int]] = set()
+        self.epoch = 0
+        self.pending_changes: List[str] = []
+        # clients that joined since the last update, they get a full snapshot instead of a delta
+        self.new_clients: Set[Tuple[str, int, int]] = set()
+        self.update_call = None
+
+    def is_full(self) -> bool:
+        """Checks if every seat of the room is taken."""
+        return len(self.clients) >= self.max_seats
+
+    def is_empty(self) -> bool:
+        """Checks if the room has no players."""
+        return not self.clients
+
+    def has_host(self, host: Optional[Tuple[str, int]]) -> bool:
+        """Checks if a client of a host is seated in the room.
+
+        Args:
+            host: The address (IP, port) of the host.
+        """
+        return host in self.hosts
+
+    def add(self, addr: Tuple[str, int, int]):
+        """Seats a client at the end of the player order.
+
+        Args:
+            addr: The address (IP, port, table id) of the client.
+        """
+        self.clients[addr] = None
+        self.hosts.add(addr[:2])
+
+    def remove(self, addr: Tuple[str, int, int]):
+        """Removes a client from the room.
+
+        Args:
+            addr: The address (IP, port, table id) of the client.
+        """
+        del self.clients[addr]
+        self.hosts.discard(addr[:2])
+
+    def seat_of(self, addr: Tuple[str, int, int]) -> int:
+        """Returns the index of a client in the player order.
+
+        Args:
+            addr: The address (IP, port, table id) of the client.
+        """
+        for index, client_addr in enumerate(self.clients):
+            if client_addr == addr:
+                return index
+        raise ValueError(f"{addr} is not in room {self.name}")
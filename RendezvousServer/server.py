@@ -1,24 +1,67 @@
+import argparse
+import heapq
 import os
+import sys
 from twisted.internet.protocol import DatagramProtocol
-from twisted.internet import reactor
-from twisted.internet.task import LoopingCall
-from typing_extensions import Tuple
+from twisted.internet import reactor as twisted_reactor
+from typing_extensions import Tuple, Dict
+from room import Room
+
+# the wire codec is shared with the peers
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Peer"))
+import codec # pylint: disable=wrong-import-position
 
 class Server(DatagramProtocol):
-    """Handles peers finding each other."""
-    def __init__(self):
-        self.clients = []
-        self.last_recv = {}
+    """Handles peers finding each other.
+
+    Clients are seated in rooms (tables). A client can ask for a room by name, otherwise it is
+    seated in the first auto-assigned room with a free seat. Player orders and disconnections
+    are only sent to the clients of the same room, so a join costs O(room size) messages.
+
+    Joins and leaves are collected for coalesce_window seconds and then sent as one versioned
+    MEMBERSHIP_DELTA. Only new clients, text clients and clients that missed an update
+    (SNAPSHOT_REQUEST, or a HEARTBEAT with an older epoch) get the full player order.
 
-    def startProtocol(self):
-        """Periodic cleanup start."""
-        self.cleanup_task = LoopingCall(self.cleanup_inactive_clients)
-        self.cleanup_task.start(60.0)
+    A client is identified by (IP, port, table id). A peer host (Peer/host.py) plays many tables
+    on one socket, each with its own table id, and wraps its messages in a TABLE frame. It is
+    seated at most once per room, so the peers of a room still know each other by (IP, port).
+    Other clients have table id 0.
+
+    Every message from a host renews the lease of all its seats. Lease deadlines are kept in a
+    min-heap, and a single timer fires at the earliest deadline, so expiring clients costs
+    O(expired * log n) instead of a scan of every client.
+
+    Args:
+        max_seats: How many players one room can hold. Default: 7.
+        coalesce_window: How long membership changes are collected before an update (seconds). Default: 0.05s.
+        client_timeout: How long a client can stay silent before it is removed (seconds). Default: 300s.
+        reactor: The reactor that runs the timers, e.g. an aio.AsyncioReactor. Default: the Twisted reactor.
+    """
+    def __init__(self, max_seats: int = 7, coalesce_window: float = 0.05, client_timeout: float = 300.0,
+                 reactor=None):
+        self.reactor = reactor if reactor is not None else twisted_reactor
+        self.max_seats = max_seats
+        self.coalesce_window = coalesce_window
+        self.client_timeout = client_timeout
+        self.rooms: Dict[str, Room] = {}
+        self.client_rooms: Dict[Tuple[str, int, int], Room] = {}
+        # auto-assigned rooms that have a free seat, in creation order
+        self.open_rooms: Dict[str, Room] = {}
+        self.next_room_number = 0
+        self.versions = {}
+        # time of the last message from each host with a seated client, and how many it has
+        self.last_recv = {}
+        self.host_clients: Dict[Tuple[str, int], int] = {}
+        # heap of (deadline, client), and the deadline each client currently has in the heap.
+        # Renewing a lease only updates last_recv, the heap entry is moved when it comes due.
+        self.deadlines = []
+        self.deadline_of = {}
+        self.cleanup_call = None
 
     def stopProtocol(self):
-        """Periodic cleanup stop."""
-        if hasattr(self, "cleanup_task"):
-            self.cleanup_task.stop()
+        """Cleanup timer stop."""
+        if self.cleanup_call is not None and self.cleanup_call.active():
+            self.cleanup_call.cancel()
         print("Server stopped")
 
     def datagramReceived(self, datagram: bytes, addr: Tuple[str, int]):
@@ -26,83 +69,364 @@ class Server(DatagramProtocol):
 
         Args:
             datagram: The received message.
-            addr: The address of the client sending the message.
+            addr: The address (IP, port) of the host sending the message.
         """
-        datagram = datagram.decode("utf-8")
+        try:
+            table, datagram = codec.unwrap_table(datagram)
+            datagram_data, _ = codec.decode(datagram)
+        except ValueError as e:
+            print(f"Could not decode message from {addr}: {e}")
+            return
 
-        if "HEARTBEAT" not in datagram:
-            print(f"Received message: {datagram} from {addr}")
+        if addr in self.last_recv:
+            # any message renews the seats of the host, not only heartbeats
+            self.last_recv[addr] = self.reactor.seconds()
 
-        self.last_recv[addr] = reactor.seconds() # Timeout disconnection
+        client = (addr[0], addr[1], table)
+        command = datagram_data[0]
+        if command != "HEARTBEAT":
+            print(f"Received message: {'!'.join(datagram_data)} from {client}")
 
-        if datagram == "ready":
-            self.client_connection(addr)
-        elif datagram == "disconnect":
-            self.client_disconnection(addr)
+        if command == "ready":
+            # old text clients send a plain "ready", newer clients send ready!version!room!seats
+            try:
+                version = int(datagram_data[1]) if len(datagram_data) > 1 else codec.TEXT_VERSION
+            except ValueError:
+                print(f"Malformed protocol version {datagram_data[1]!r} from {client}, using text")
+                version = codec.TEXT_VERSION
+            room_name = datagram_data[2] if len(datagram_data) > 2 else ""
+            try:
+                max_seats = int(datagram_data[3]) if len(datagram_data) > 3 else self.max_seats
+            except ValueError:
+                print(f"Malformed seat count {datagram_data[3]!r} from {client}, using {self.max_seats}")
+                max_seats = self.max_seats
+            self.client_connection(client, codec.negotiate_version(codec.PROTOCOL_VERSION, version),
+                                   room_name, max_seats)
+        elif command == "disconnect":
+            self.client_disconnection(client)
+        elif command == "SNAPSHOT_REQUEST":
+            self.handle_snapshot_request(client)
+        elif command == "HEARTBEAT" and len(datagram_data) > 1:
+            self.handle_heartbeat_epoch(client, datagram_data[1])
 
-    def client_connection(self, addr: Tuple[str, int]):
+    def client_connection(self, addr: Tuple[str, int, int], version: int = codec.TEXT_VERSION,
+                          room_name: str = "", max_seats: int = None):
         """Handle a new client connection.
 
         Args:
-            addr: The address of the connected client.
+            addr: The address (IP, port, table id) of the connected client.
+            version: The protocol version used with the client. Default: codec.TEXT_VERSION.
+            room_name: The room the client wants to join, or "" for any room. Default: "".
+            max_seats: The seat count of the room, if the client creates it. Default: self.max_seats.
+        """
+        if addr in self.client_rooms:
+            # a peer that restarted on its old address, or whose player order was lost, keeps its
+            # seat. The other peers may have dropped it in the meantime for missing heartbeats, so
+            # the whole room gets the full player order with the next membership update.
+            room = self.client_rooms[addr]
+            self.versions[addr] = version
+            room.new_clients.update(room.clients)
+            if room.update_call is None:
+                room.update_call = self.reactor.callLater(self.coalesce_window, self.send_membership_update, room)
+            return
+
+        host = addr[:2]
+        room = self.find_room(room_name, max_seats or self.max_seats, host)
+        if room is None:
+            print(f"Room {room_name} is full, rejected {addr}")
+            self.send_datagram(codec.encode(f"ROOM_FULL!{room_name}", version=version), addr)
+            return
+
+        room.add(addr)
+        self.client_rooms[addr] = room
+        self.versions[addr] = version
+        self.last_recv[host] = self.reactor.seconds()
+        self.host_clients[host] = self.host_clients.get(host, 0) + 1
+        self.schedule_expiry(addr, self.last_recv[host] + self.client_timeout)
+        if room.auto_assigned and room.is_full():
+            self.open_rooms.pop(room.name, None)
+        print(f"Client connected: {addr} to room {room.name}")
+        room.new_clients.add(addr)
+        self.queue_membership_change(room, "+", addr)
+
+    def find_room(self, room_name: str, max_seats: int, host: Tuple[str, int] = None):
+        """Returns the room a new client is seated in, creating it if needed.
+
+        Args:
+            room_name: The name of the room, or "" for the first auto-assigned room with a free seat.
+            max_seats: The seat count of the room, if it has to be created.
+            host: The address (IP, port) of the client's host, which can have one seat per room. Default: None.
+
+        Returns:
+            The room, or None if the named room is full or the host already has a seat in it.
+        """
+        if room_name:
+            room = self.rooms.get(room_name)
+            if room is None:
+                room = Room(room_name, max(1, max_seats))
+                self.rooms[room_name] = room
+            return None if room.is_full() or room.has_host(host) else room
+
+        for room in self.open_rooms.values():
+            if not room.has_host(host):
+                return room
+
+        # skip numbers that a client already used as a room name
+        while f"table-{self.next_room_number}" in self.rooms:
+            self.next_room_number += 1
+        room = Room(f"table-{self.next_room_number}", self.max_seats, auto_assigned=True)
+        self.next_room_number += 1
+        self.rooms[room.name] = room
+        self.open_rooms[room.name] = room
+        return room
+
+    def remove_client(self, addr: Tuple[str, int, int]):
+        """Removes a client from its room and from the server's bookkeeping.
+
+        Args:
+            addr: The address (IP, port, table id) of the client.
+
+        Returns:
+            The room the client was in, or None if the client was not seated.
         """
-        if addr not in self.clients:
-            self.clients.append(addr)
-            print(f"Client connected: {addr}")
-            self.player_order()
+        # the heap entry stays until it comes due and is then skipped
+        self.deadline_of.pop(addr, None)
+        room = self.client_rooms.pop(addr, None)
+        if room is None:
+            self.versions.pop(addr, None)
+            return None
+
+        host = addr[:2]
+        self.host_clients[host] -= 1
+        if not self.host_clients[host]:
+            del self.host_clients[host]
+            self.last_recv.pop(host, None)
 
-    def client_disconnection(self, addr: Tuple[str, int]):
+        room.remove(addr)
+        room.new_clients.discard(addr)
+        self.queue_membership_change(room, "-", addr)
+        self.versions.pop(addr, None)
+        if room.is_empty():
+            del self.rooms[room.name]
+            self.open_rooms.pop(room.name, None)
+            if room.update_call is not None and room.update_call.active():
+                room.update_call.cancel()
+        elif room.auto_assigned:
+            self.open_rooms[room.name] = room
+        return room
+
+    def client_disconnection(self, addr: Tuple[str, int, int]):
         """Handle a client disconnection.
 
         Args:
-            addr: The address of the disconnected client.
+            addr: The address (IP, port, table id) of the disconnected client.
         """
-        if addr in self.clients:
+        if addr in self.client_rooms:
             print(f"Client disconnected: {addr}")
-            if addr in self.clients:
-                self.clients.remove(addr)
-            del self.last_recv[addr] # Timeout disconnection
-            self.player_order()
+            self.remove_client(addr)
+
+    def queue_membership_change(self, room: Room, operation: str, addr: Tuple[str, int, int]):
+        """Adds a join or a leave to the next membership update of a room.
+
+        Args:
+            room: The room that changed.
+            operation: "+" for a join, "-" for a leave.
+            addr: The address (IP, port, table id) of the client that joined or left.
+        """
+        room.pending_changes.append(operation + self.member(addr))
+        if room.update_call is None:
+            room.update_call = self.reactor.callLater(self.coalesce_window, self.send_membership_update, room)
+
+    def send_membership_update(self, room: Room):
+        """Sends the changes collected during the coalescing window to the clients of a room.
+        Binary clients that were already seated get a delta, everyone else the full player order.
+
+        Args:
+            room: The room that changed.
+        """
+        room.update_call = None
+        room.epoch += 1
+        changes = room.pending_changes
+        new_clients = room.new_clients
+        room.pending_changes = []
+        room.new_clients = set()
+
+        delta = None
+        members_cache = {}
+        for index, client_addr in enumerate(room.clients):
+            if self.versions[client_addr] < codec.BINARY_VERSION or client_addr in new_clients:
+                self.send_player_order(room, client_addr, index, members_cache)
+                continue
+            if delta is None:
+                # without changes, e.g. after a restarted client got its seat back, only the epoch moves on
+                delta = codec.encode("!".join([f"MEMBERSHIP_DELTA!{room.epoch}", *changes]),
+                                     version=codec.BINARY_VERSION)
+            self.send_datagram(delta, client_addr)
 
-    def player_order(self):
-        """Sends the current player order to the clients."""
-        addresses = "!".join([f"{x[0]}:{x[1]}" for x in self.clients])
-        for index, client_addr in enumerate(self.clients):
-            message = f"PLAYER_ORDER!{index}!{addresses}"
-            self.transport.write(message.encode("utf-8"), client_addr)
+    def handle_snapshot_request(self, addr: Tuple[str, int, int]):
+        """Sends the full player order to a client that missed a membership update.
 
-    def send_all(self, message, exclude=None):
-        """Send a message to all clients.
+        Args:
+            addr: The address (IP, port, table id) of the client.
+        """
+        room = self.client_rooms.get(addr)
+        if room is not None:
+            self.send_player_order(room, addr, room.seat_of(addr))
+
+    def handle_heartbeat_epoch(self, addr: Tuple[str, int, int], epoch: str):
+        """Sends the full player order to a binary client whose heartbeat carries an older
+        membership epoch than its room's, e.g. because the last update of a burst was lost.
+
+        Args:
+            addr: The address (IP, port, table id) of the client.
+            epoch: The membership epoch the client has.
+        """
+        room = self.client_rooms.get(addr)
+        if room is None or self.versions[addr] < codec.BINARY_VERSION or addr in room.new_clients:
+            return
+        try:
+            behind = int(epoch) < room.epoch
+        except ValueError:
+            print(f"Malformed membership epoch {epoch!r} from {addr}")
+            return
+        if behind:
+            print(f"Client {addr} is at membership epoch {epoch} of {room.epoch}, sending the player order")
+            self.send_player_order(room, addr, room.seat_of(addr))
+
+    def send_player_order(self, room: Room, client_addr: Tuple[str, int, int], index: int, members_cache=None):
+        """Sends the full player order of a room to one client.
+        Binary clients also get the epoch of the room and the protocol version of every peer,
+        so they know which peers they can talk to in binary.
+
+        Args:
+            room: The room of the client.
+            client_addr: The address of the client.
+            index: The seat of the client in the room.
+            members_cache: A dict that keeps the member list between calls for the same room state. Default: None.
+        """
+        if members_cache is None:
+            members_cache = {}
+        binary = self.versions[client_addr] >= codec.BINARY_VERSION
+        if binary not in members_cache:
+            if binary:
+                members_cache[binary] = "!".join([self.member(x) for x in room.clients])
+            else:
+                members_cache[binary] = "!".join([f"{x[0]}:{x[1]}" for x in room.clients])
+
+        if binary:
+            message = f"PLAYER_ORDER!{index}!{room.epoch}!{members_cache[binary]}"
+        else:
+            message = f"PLAYER_ORDER!{index}!{members_cache[binary]}"
+        self.send_datagram(codec.encode(message, version=self.versions[client_addr]), client_addr)
+
+    def member(self, addr: Tuple[str, int, int]) -> str:
+        """Returns a client as a member of a binary player order: "ip:port:version", and
+        ":table id" after it if the client plays at a table other than 0 of its host.
+
+        Args:
+            addr: The address (IP, port, table id) of the client.
+        """
+        member = f"{addr[0]}:{addr[1]}:{self.versions[addr]}"
+        return f"{member}:{addr[2]}" if addr[2] else member
+
+    def send_datagram(self, datagram: bytes, addr: Tuple[str, int, int]):
+        """Sends a datagram to a client, in a TABLE frame if it plays at a table other than 0 of its host.
 
         Args:
-            message: The message to be sent to all clients.
+            datagram: The encoded message.
+            addr: The address (IP, port, table id) of the client.
+        """
+        self.transport.write(codec.wrap_table(addr[2], datagram), addr[:2])
+
+    def player_order(self, room: Room):
+        """Sends the current player order to all clients of a room.
+
+        Args:
+            room: The room whose player order is sent.
+        """
+        members_cache = {}
+        for index, client_addr in enumerate(room.clients):
+            self.send_player_order(room, client_addr, index, members_cache)
+
+    def send_to_room(self, room: Room, message, exclude=None, below_version: int = None):
+        """Send a message to all clients of a room.
+
+        Args:
+            room: The room to send the message to.
+            message: The message to be sent to all clients of the room.
             exclude: The address of a client to exclude from receiving the message. Default: None.
+            below_version: Only send to clients with an older protocol version than this. Default: None, all clients.
         """
-        for peer_address in self.clients:
-            if peer_address != exclude:
-                self.transport.write(message.encode("utf-8"), peer_address)
+        encoded_messages = {}
+        for peer_address in room.clients:
+            version = self.versions[peer_address]
+            if peer_address != exclude and (below_version is None or version < below_version):
+                if version not in encoded_messages:
+                    encoded_messages[version] = codec.encode(message, version=version)
+                self.send_datagram(encoded_messages[version], peer_address)
+
+    def schedule_expiry(self, addr: Tuple[str, int, int], deadline: float):
+        """Puts a client's lease deadline in the heap, and makes sure the cleanup timer runs by then.
+
+        Args:
+            addr: The address (IP, port, table id) of the client.
+            deadline: When the client expires unless it sends something.
+        """
+        heapq.heappush(self.deadlines, (deadline, addr))
+        self.deadline_of[addr] = deadline
+        if self.cleanup_call is None or not self.cleanup_call.active():
+            self.cleanup_call = self.reactor.callLater(
+                max(0.0, deadline - self.reactor.seconds()), self.cleanup_inactive_clients)
 
     def cleanup_inactive_clients(self):
-        """Timeout remove."""
-        current_time = reactor.seconds()
-        inactive_clients = [
-            addr for addr, last_time in self.last_recv.items()
-            if current_time - last_time > 300  # Timeout: 300 seconds
-        ]
+        """Timeout remove. Pops the deadlines that have come due: clients that sent something
+        since get a new deadline, the others are removed. Binary clients get the removals as
+        one membership update per room. Text clients get the full player order with it, and a
+        PEER_DISCONNECTED per removed client to keep the seats of the current game."""
+        current_time = self.reactor.seconds()
+        inactive_clients = []
+        while self.deadlines and self.deadlines[0][0] <= current_time:
+            deadline, addr = heapq.heappop(self.deadlines)
+            if self.deadline_of.get(addr) != deadline:
+                continue # the client left, or this is an old entry of a client that rejoined
+            new_deadline = self.last_recv[addr[:2]] + self.client_timeout
+            if new_deadline > current_time:
+                heapq.heappush(self.deadlines, (new_deadline, addr))
+                self.deadline_of[addr] = new_deadline
+            else:
+                inactive_clients.append(addr)
+
         for addr in inactive_clients:
             print(f"Remove inactive client: {addr}")
-            if addr in self.clients:
-                self.clients.remove(addr)
-            del self.last_recv[addr]
-            self.player_order()
+            room = self.remove_client(addr)
+            if room is None or room.is_empty():
+                continue
 
             disconnect_message = f"PEER_DISCONNECTED!{addr[0]}!{addr[1]}"
-            self.send_all(disconnect_message)
+            self.send_to_room(room, disconnect_message, below_version=codec.BINARY_VERSION)
+
+        self.cleanup_call = None
+        if self.deadlines:
+            self.cleanup_call = self.reactor.callLater(
+                max(0.0, self.deadlines[0][0] - current_time), self.cleanup_inactive_clients)
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Peer-To-Peer Blackjack rendezvous server")
+    parser.add_argument("--max-seats", type=int, default=7,
+                        help="Seats per auto-assigned room, and the default for named rooms.")
+    parser.add_argument("--runtime", choices=["twisted", "asyncio"], default="twisted",
+                        help="Event loop to run on. asyncio uses uvloop if it is installed.")
+    parser.add_argument("--port", type=int, default=9999, help="UDP port to listen on.")
+    args = parser.parse_args()
+
+    if args.runtime == "asyncio":
+        from aio import AsyncioReactor # pylint: disable=wrong-import-position
+        reactor = AsyncioReactor()
+    else:
+        reactor = twisted_reactor
+
     os.system("clear")
     print("Starting server...")
-    PORT = 9999
-    reactor.listenUDP(PORT, Server())
-    print(f"Server is running on UDP port {PORT}")
+    reactor.listenUDP(args.port, Server(args.max_seats, reactor=reactor))
+    print(f"Server is running on UDP port {args.port}")
     reactor.run()
@@ -0,0 +1,161 @@
+import heapq
+import os
+import random
+import sys
+from collections import Counter
+from typing import Dict, List, Tuple
+from twisted.internet.base import DelayedCall
+from twisted.internet.task import Clock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Peer"))
+import codec # pylint: disable=wrong-import-position
+
+# commands that wrap other commands, and the field where the wrapped command starts
+WRAPPERS = {"RELIABLE": 2, "CAUSAL": 2}
+
+
+class VirtualClock(Clock):
+    """A task.Clock that keeps its pending calls in a heap.
+
+    task.Clock sorts its whole call list on every callLater and pops from its front, which gets
+    slow with the timers of thousands of peers. Cancelled and rescheduled calls are left in the
+    heap and skipped when they come due.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.heap: List[Tuple[float, int, DelayedCall]] = []
+        self.sequence = 0
+
+    def callLater(self, delay, f, *args, **kw):
+        call = DelayedCall(self.seconds() + delay, f, args, kw,
+                           lambda call: None, self.push, seconds=self.seconds)
+        self.push(call)
+        return call
+
+    def push(self, call: DelayedCall):
+        self.sequence += 1
+        heapq.heappush(self.heap, (call.getTime(), self.sequence, call))
+
+    def getDelayedCalls(self):
+        return [call for _, _, call in self.heap if call.active()]
+
+    def advance(self, amount):
+        self.rightNow += amount
+        while self.heap and self.heap[0][0] <= self.rightNow:
+            due, _, call = heapq.heappop(self.heap)
+            if not call.active() or call.getTime() != due:
+                continue # cancelled, or a stale entry of a call that was rescheduled
+            call.called = 1
+            call.func(*call.args, **call.kw)
+
+
+class FabricTransport:
+    """The transport of one endpoint of the fabric, with the write(datagram, addr) method
+    of a Twisted UDP port."""
+
+    def __init__(self, fabric: 'Fabric', addr: Tuple[str, int]):
+        self.fabric = fabric
+        self.addr = addr
+
+    def write(self, datagram: bytes, addr: Tuple[str, int]):
+        self.fabric.send(datagram, self.addr, addr)
+
+
+class Fabric:
+    """An in-memory datagram network between the protocols of one process.
+
+    Every datagram is delivered after latency plus a random share of jitter seconds on the
+    virtual clock. A datagram can be lost, duplicated, or held back by reorder_delay so that
+    datagrams sent after it overtake it. Every datagram is counted by the commands it carries.
+
+    Args:
+        clock: The virtual clock that delivers the datagrams.
+        latency: One-way delay of every datagram (seconds). Default: 0.02s.
+        jitter: Upper bound of the random delay added to the latency (seconds). Default: 0.
+        loss: Probability that a datagram is lost. Default: 0.
+        duplicate: Probability that a datagram is delivered twice. Default: 0.
+        reorder: Probability that a datagram is held back by reorder_delay. Default: 0.
+        reorder_delay: How long a reordered datagram is held back (seconds). Default: 0.1s.
+        rng: The random number generator. Default: a new one seeded with 0.
+    """
+
+    def __init__(self, clock: Clock, latency: float = 0.02, jitter: float = 0.0, loss: float = 0.0,
+                 duplicate: float = 0.0, reorder: float = 0.0, reorder_delay: float = 0.1,
+                 rng: random.Random = None):
+        self.clock = clock
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.duplicate = duplicate
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self.rng = rng or random.Random(0)
+        self.endpoints: Dict[Tuple[str, int], object] = {}
+        self.datagrams = 0
+        self.bytes = 0
+        self.lost = 0
+        # sent datagrams by their outer command, and the commands they carry with batches unwrapped
+        self.datagram_counts = Counter()
+        self.command_counts = Counter()
+
+    def attach(self, protocol, addr: Tuple[str, int]):
+        """Connects a protocol (a Peer or the Server) to the fabric at an address and starts it.
+
+        Args:
+            protocol: The Twisted DatagramProtocol.
+            addr: Its address.
+        """
+        protocol.transport = FabricTransport(self, addr)
+        self.endpoints[addr] = protocol
+        protocol.startProtocol()
+
+    def detach(self, addr: Tuple[str, int]):
+        """Stops the protocol at an address. Datagrams to it are lost from then on.
+
+        Args:
+            addr: Its address.
+        """
+        protocol = self.endpoints.pop(addr, None)
+        if protocol is not None:
+            protocol.stopProtocol()
+
+    def send(self, datagram: bytes, source: Tuple[str, int], target: Tuple[str, int]):
+        """Counts a datagram and schedules its delivery, unless it is lost."""
+        self.datagrams += 1
+        self.bytes += len(datagram)
+        self.count(datagram)
+        if self.rng.random() < self.loss:
+            self.lost += 1
+            return
+        copies = 2 if self.rng.random() < self.duplicate else 1
+        for _ in range(copies):
+            delay = self.latency + self.rng.uniform(0, self.jitter)
+            if self.rng.random() < self.reorder:
+                delay += self.reorder_delay
+            self.clock.callLater(delay, self.deliver, datagram, source, target)
+
+    def deliver(self, datagram: bytes, source: Tuple[str, int], target: Tuple[str, int]):
+        protocol = self.endpoints.get(target)
+        if protocol is not None:
+            protocol.datagramReceived(datagram, source)
+
+    def count(self, datagram: bytes):
+        try:
+            # datagrams for a table of a peer host are counted by what they carry
+            _, datagram = codec.unwrap_table(datagram)
+            fields, _ = codec.decode(datagram)
+        except ValueError:
+            self.datagram_counts["?"] += 1
+            return
+        self.datagram_counts[fields[0]] += 1
+        self.count_commands(fields)
+
+    def count_commands(self, fields: List[str]):
+        if fields[0] == "BATCH":
+            for message in fields[1:]:
+                self.count_commands(message.split("!"))
+        elif fields[0] in WRAPPERS and len(fields) > WRAPPERS[fields[0]]:
+            self.count_commands(fields[WRAPPERS[fields[0]]:])
+        else:
+            self.command_counts[fields[0]] += 1
@@ -0,0 +1,321 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+# the simulation runs the real peer and server code
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Peer"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RendezvousServer"))
+import codec # pylint: disable=wrong-import-position
+from fabric import Fabric, VirtualClock # pylint: disable=wrong-import-position
+from logger import WARN # pylint: disable=wrong-import-position
+from peer import Peer # pylint: disable=wrong-import-position
+from server import Server # pylint: disable=wrong-import-position
+
+SERVER_ADDRESS = ("127.0.0.1", 9999)
+FIRST_PEER_PORT = 10000
+# the virtual clock starts here rather than at 0, "never" is 0 in several places of the peer
+START_TIME = 1000.0
+# above every log level, the peers of a simulation log nothing
+SILENT = WARN + 1
+SYNC_COMMANDS = ("SYNC_ERROR", "REQUEST_DECK", "SYNC_REQUEST", "SYNC_STATE")
+
+
+class RandomPlayer:
+    """Draws cards until its points reach a random target, then passes.
+
+    Args:
+        rng: The random number generator.
+        min_target: Lowest point total the player stops at. Default: 12.
+        max_target: Highest point total the player stops at. Default: 19.
+    """
+
+    def __init__(self, rng: random.Random, min_target: int = 12, max_target: int = 19):
+        self.rng = rng
+        self.min_target = min_target
+        self.max_target = max_target
+
+    def next_command(self, gameplay) -> str:
+        points = gameplay.players.points_of(gameplay.own_turn_identifier)
+        if points < self.rng.randint(self.min_target, self.max_target):
+            return "DRAW_CARD"
+        return "PASS_TURN"
+
+
+class ScriptedPlayer:
+    """Plays a fixed list of commands, one per turn, and passes once the list is used up.
+
+    Args:
+        commands: The commands, e.g. ["DRAW_CARD", "DRAW_CARD", "PASS_TURN"].
+    """
+
+    def __init__(self, commands: List[str]):
+        self.commands = deque(commands)
+
+    def next_command(self, gameplay) -> str:
+        return self.commands.popleft() if self.commands else "PASS_TURN"
+
+
+class Table:
+    """The peers of one table and the players that type their commands.
+
+    Every tick the table looks for a peer that sees its own turn, records how long that took
+    since the last move, and has its player move after a think time. Between games the first
+    player starts the next game.
+
+    Args:
+        simulation: The simulation the table belongs to.
+        peers: The peers of the table.
+        players: The player of each peer.
+    """
+
+    def __init__(self, simulation: 'Simulation', peers: List[Peer], players: list):
+        self.simulation = simulation
+        self.peers = peers
+        self.players = dict(zip((peer.id for peer in peers), players))
+        self.games_started = 0
+        self.games_finished = 0
+        self.moves = 0
+        self.desynced_moves = 0
+        self.errors = 0
+        self.turn_latencies: List[float] = []
+        self.last_move_at: Optional[float] = None
+        self.in_game = False
+        self.acting = False
+        self.stalled = False
+
+    def is_seated(self) -> bool:
+        return all(peer.gameplay.own_turn_identifier >= 0 and peer.gameplay.connected_peers == len(self.peers) - 1
+                   for peer in self.peers)
+
+    def tick(self):
+        if self.acting or self.stalled:
+            return
+        if not self.is_seated():
+            # a table that lost a player, e.g. to a false failure detection, or that was not seated
+            # in time, cannot finish its games
+            waited = self.simulation.clock.seconds() - START_TIME
+            self.stalled = self.games_started > 0 or waited > self.simulation.stall_timeout
+            return
+        now = self.simulation.clock.seconds()
+        # a seed round in progress is part of the game, initiating again would abort it
+        in_game = any(peer.gameplay.is_game_initiated() or peer.gameplay.seed_round is not None
+                      for peer in self.peers)
+        if self.in_game and not in_game:
+            self.games_finished += 1
+        self.in_game = in_game
+
+        if not in_game:
+            if self.games_started < self.simulation.games:
+                leader = min(self.peers, key=lambda peer: peer.gameplay.own_turn_identifier)
+                self.games_started += 1
+                self.act(leader, "INITIATE_GAME")
+            return
+
+        for peer in self.peers:
+            if peer.gameplay.is_game_initiated() and peer.gameplay.is_my_turn():
+                if self.last_move_at is not None:
+                    self.turn_latencies.append(now - self.last_move_at)
+                self.act(peer, self.players[peer.id].next_command(peer.gameplay))
+                return
+        if self.last_move_at is not None and now - self.last_move_at > self.simulation.stall_timeout:
+            # nobody sees its turn, the table would wait for the players to notice forever
+            self.stalled = True
+
+    def act(self, peer: Peer, command: str):
+        """Has the player of a peer type a command after its think time."""
+        self.acting = True
+        self.simulation.clock.callLater(self.simulation.think_time(), self.type_command, peer, command)
+
+    def type_command(self, peer: Peer, command: str):
+        self.acting = False
+        if command != "INITIATE_GAME":
+            self.moves += 1
+            if not self.digests_match():
+                self.desynced_moves += 1
+        try:
+            peer.handle_user_input(command)
+        except Exception: # pylint: disable=broad-except
+            # the peer is in a state it cannot play on from, retrying would only repeat the error
+            self.errors += 1
+            self.stalled = True
+        self.last_move_at = self.simulation.clock.seconds()
+
+    def digests_match(self) -> bool:
+        """Checks that every peer that is in a game has the same game state."""
+        try:
+            digests = {peer.gameplay.state_digest() for peer in self.peers if peer.gameplay.is_game_initiated()}
+        except Exception: # pylint: disable=broad-except
+            return False
+        return len(digests) <= 1
+
+
+class Simulation:
+    """One rendezvous server and many tables of peers in one process, on a virtual clock and an
+    in-memory datagram fabric.
+
+    Args:
+        tables: How many tables to simulate.
+        players: Players per table.
+        games: How many games each table plays.
+        seed: Seed of every random choice, so a run can be repeated. Default: 0.
+        think_time: Range of the time a player takes for a move (seconds). Default: (0.2, 1.0).
+        tick: How often the tables look for a peer whose turn it is (seconds). Default: 0.01s.
+        stall_timeout: How long a table may go without anybody's turn, or wait to be seated, before
+            it counts as stalled. A table that loses a player or whose peer raises an error on a
+            command is stalled as well. Default: 10s.
+        script: Commands every player plays instead of drawing randomly. Default: None.
+        fabric_options: Keyword arguments of the Fabric (latency, jitter, loss, duplicate, reorder).
+        peer_options: Keyword arguments of every Peer (failure_detector, reliable, deck_mode, ...).
+        protocol_version: The wire protocol version of the peers. Default: codec.PROTOCOL_VERSION.
+    """
+
+    def __init__(self, tables: int, players: int, games: int, seed: int = 0, think_time=(0.2, 1.0),
+                 tick: float = 0.01, stall_timeout: float = 10.0, script: Optional[List[str]] = None,
+                 fabric_options: Optional[Dict] = None, peer_options: Optional[Dict] = None,
+                 protocol_version: int = codec.PROTOCOL_VERSION):
+        # the game shuffles with the random module
+        random.seed(seed)
+        self.rng = random.Random(seed)
+        self.games = games
+        self.think_range = think_time
+        self.tick = tick
+        self.stall_timeout = stall_timeout
+        self.clock = VirtualClock()
+        self.clock.advance(START_TIME)
+        self.fabric = Fabric(self.clock, rng=random.Random(seed + 1), **(fabric_options or {}))
+        self.server = Server(max_seats=players, reactor=self.clock)
+        self.tables: List[Table] = []
+
+        with self.quiet():
+            self.fabric.attach(self.server, SERVER_ADDRESS)
+            port = FIRST_PEER_PORT
+            for table_number in range(tables):
+                peers = []
+                for _ in range(players):
+                    peer = Peer("localhost", port, protocol_version, f"table-{table_number}", players,
+                                reactor=self.clock, input_reader=lambda callback: None, log_level=SILENT,
+                                **(peer_options or {}))
+                    self.fabric.attach(peer, peer.id)
+                    peers.append(peer)
+                    port += 1
+                table_players = [ScriptedPlayer(script) if script else RandomPlayer(self.rng) for _ in peers]
+                self.tables.append(Table(self, peers, table_players))
+
+    @staticmethod
+    @contextlib.contextmanager
+    def quiet():
+        """Keeps the server's console output out of the report."""
+        with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+            yield
+
+    def think_time(self) -> float:
+        return self.rng.uniform(*self.think_range)
+
+    def is_done(self) -> bool:
+        return all(table.stalled or (table.games_finished >= self.games and not table.in_game)
+                   for table in self.tables)
+
+    def run(self, duration: float) -> Dict:
+        """Runs until every table played its games, or for duration virtual seconds.
+
+        Args:
+            duration: The longest virtual time to run (seconds).
+
+        Returns:
+            The report, see report().
+        """
+        started = time.perf_counter()
+        end = self.clock.seconds() + duration
+        with self.quiet():
+            while self.clock.seconds() < end and not self.is_done():
+                for table in self.tables:
+                    table.tick()
+                self.clock.advance(self.tick)
+        return self.report(self.clock.seconds() - START_TIME, time.perf_counter() - started)
+
+    def report(self, virtual_seconds: float, wall_seconds: float) -> Dict:
+        """Collects the message counts, desync rate and turn latencies of every table."""
+        latencies = sorted(latency for table in self.tables for latency in table.turn_latencies)
+        moves = sum(table.moves for table in self.tables)
+        fabric = self.fabric
+        return {
+            "tables": len(self.tables),
+            "peers": sum(len(table.peers) for table in self.tables),
+            "virtual_seconds": round(virtual_seconds, 2),
+            "wall_seconds": round(wall_seconds, 2),
+            "speedup": round(virtual_seconds / wall_seconds, 1) if wall_seconds else None,
+            "games_finished": sum(table.games_finished for table in self.tables),
+            "moves": moves,
+            "desync_rate": round(sum(table.desynced_moves for table in self.tables) / moves, 4) if moves else 0.0,
+            "stalled_tables": sum(table.stalled for table in self.tables),
+            "errors": sum(table.errors for table in self.tables),
+            "turn_latency_ms": {
+                "mean": round(statistics.mean(latencies) * 1000, 1) if latencies else None,
+                "p50": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+                "p95": round(latencies[int(len(latencies) * 0.95)] * 1000, 1) if latencies else None,
+                "max": round(latencies[-1] * 1000, 1) if latencies else None,
+            },
+            "datagrams": fabric.datagrams,
+            "bytes": fabric.bytes,
+            "lost": fabric.lost,
+            "datagrams_per_move": round(fabric.datagrams / moves, 1) if moves else None,
+            "sync_messages": sum(fabric.command_counts[command] for command in SYNC_COMMANDS),
+            "datagram_counts": dict(fabric.datagram_counts.most_common()),
+            "command_counts": dict(fabric.command_counts.most_common()),
+        }
+
+
+def print_report(report: Dict):
+    for key, value in report.items():
+        if isinstance(value, dict):
+            print(f"{key}:")
+            for inner_key, inner_value in value.items():
+                print(f"  {inner_key}: {inner_value}")
+        else:
+            print(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulates many Blackjack tables in one process")
+    parser.add_argument("--tables", type=int, default=10, help="Number of tables.")
+    parser.add_argument("--players", type=int, default=4, help="Players per table.")
+    parser.add_argument("--games", type=int, default=3, help="Games each table plays.")
+    parser.add_argument("--duration", type=float, default=600.0,
+                        help="Longest virtual time to simulate (seconds).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of every random choice.")
+    parser.add_argument("--latency", type=float, default=0.02, help="One-way datagram delay (seconds).")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra delay of up to this much (seconds).")
+    parser.add_argument("--loss", type=float, default=0.0, help="Probability that a datagram is lost.")
+    parser.add_argument("--duplicate", type=float, default=0.0, help="Probability that a datagram arrives twice.")
+    parser.add_argument("--reorder", type=float, default=0.0,
+                        help="Probability that a datagram is held back so that later ones overtake it.")
+    parser.add_argument("--script", default=None,
+                        help="Comma separated commands every player plays, e.g. DRAW_CARD,PASS_TURN. "
+                        "By default players draw up to a random target.")
+    parser.add_argument("--protocol", choices=["text", "binary"], default="binary", help="Wire protocol of the peers.")
+    parser.add_argument("--failure-detector", choices=["all-to-all", "swim"], default="all-to-all")
+    parser.add_argument("--reliable", action="store_true", help="Send game commands over the reliable channel.")
+    parser.add_argument("--deck", choices=["full", "seed"], default="full")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    args = parser.parse_args()
+
+    simulation = Simulation(
+        args.tables, args.players, args.games, args.seed,
+        script=args.script.split(",") if args.script else None,
+        fabric_options={"latency": args.latency, "jitter": args.jitter, "loss": args.loss,
+                        "duplicate": args.duplicate, "reorder": args.reorder},
+        peer_options={"failure_detector": args.failure_detector, "reliable": args.reliable,
+                      "deck_mode": args.deck},
+        protocol_version=codec.BINARY_VERSION if args.protocol == "binary" else codec.TEXT_VERSION)
+    result = simulation.run(args.duration)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
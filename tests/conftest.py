@@ -0,0 +1,44 @@
+import os
+import sys
+import pytest
+# the tests run the real peer and server code, which import their modules by plain name
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+for directory in ("Peer", "RendezvousServer", "Simulation"):
+    sys.path.append(os.path.join(ROOT, directory))
+
+import codec  # noqa: E402
+from simulate import Simulation  # noqa: E402
+
+
+def advance(simulation: Simulation, seconds: float):
+    """Advances the virtual clock in small steps, so that timers set on the way fire in time."""
+    with simulation.quiet():
+        for _ in range(round(seconds / 0.01)):
+            simulation.clock.advance(0.01)
+
+
+@pytest.fixture
+def run_for():
+    """advance(simulation, seconds), see above."""
+    return advance
+
+
+@pytest.fixture
+def seated_table():
+    """Seats one table of players, as seated_table(players, protocol_version, **peer_options), and
+    returns the simulation and the peers in seat order."""
+    def seat(players: int, protocol_version: int = codec.PROTOCOL_VERSION, **peer_options):
+        simulation = Simulation(1, players, 0, seed=1, peer_options=peer_options, protocol_version=protocol_version)
+        advance(simulation, 1.0)
+        return simulation, simulation.tables[0].peers
+    return seat
+
+
+@pytest.fixture
+def seated_pair(seated_table):
+    """Two seated peers with the reliable channel and without heartbeats, so that a lost
+    message does not end the table."""
+    simulation, (sender, receiver) = seated_table(2, reliable=True)
+    for peer in (sender, receiver):
+        peer.heartbeat_manager.stop()
+    return simulation, sender, receiver
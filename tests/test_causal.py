@@ -0,0 +1,83 @@
+from causal import CausalOrder
+from fabric import VirtualClock
+from logger import Logger, WARN
+
+OWN = ("127.0.0.1", 10000)
+LEFT = ("127.0.0.1", 10001)
+RIGHT = ("127.0.0.1", 10002)
+
+
+class TablePeer:
+    """The parts of a peer the causal order uses, with the messages it sends."""
+
+    def __init__(self):
+        self.id = OWN
+        self.reactor = VirtualClock()
+        self.logger = Logger(OWN, level=WARN + 1)
+        self.members = [OWN, LEFT, RIGHT]
+        self.sent = []
+
+    def send_message(self, message, addr):
+        self.sent.append((message, addr))
+
+    def queue_message(self, message, addr):
+        self.sent.append((message, addr))
+
+
+def causal_order():
+    peer = TablePeer()
+    delivered = []
+    causal = CausalOrder(peer, lambda fields, clock, addr: delivered.append((fields[0], addr)))
+    return peer, causal, delivered
+
+
+def command(name: str, clock: str):
+    return ["CAUSAL", clock, name]
+
+
+def test_command_waits_for_the_one_it_answers():
+    _, causal, delivered = causal_order()
+    # RIGHT answers the first command of LEFT, which is still on its way
+    causal.handle_message(command("PASS_TURN", "127.0.0.1:10001:1,127.0.0.1:10002:1"), None, RIGHT)
+    assert delivered == []
+
+    causal.handle_message(command("DRAW_CARD", "127.0.0.1:10001:1"), None, LEFT)
+    assert delivered == [("DRAW_CARD", LEFT), ("PASS_TURN", RIGHT)]
+    assert causal.held == []
+
+
+def test_missing_commands_are_asked_for_and_then_given_up_on():
+    peer, causal, delivered = causal_order()
+    causal.handle_message(command("PASS_TURN", "127.0.0.1:10001:3"), None, LEFT)
+
+    peer.reactor.advance(0.5)
+    assert peer.sent == []
+    peer.reactor.advance(0.5)
+    assert peer.sent == [("GAP_REQUEST!1", LEFT)]
+    assert delivered == []
+
+    peer.reactor.advance(1.0)
+    assert delivered == [("PASS_TURN", LEFT)]
+    assert causal.delivered[LEFT] == 3
+
+
+def test_gap_request_is_answered_from_the_history():
+    peer, causal, _ = causal_order()
+    first = causal.stamp("DRAW_CARD!C05!1")
+    second = causal.stamp("PASS_TURN!2")
+
+    causal.handle_message(["GAP_REQUEST", "2"], None, LEFT)
+    assert peer.sent == [(second, LEFT)]
+    assert first == "CAUSAL!127.0.0.1:10000:1!DRAW_CARD!C05!1"
+
+
+def test_duplicates_are_delivered_once():
+    _, causal, delivered = causal_order()
+    # the copy of a held command and the copy of a delivered one are both dropped
+    causal.handle_message(command("PASS_TURN", "127.0.0.1:10001:2"), None, LEFT)
+    causal.handle_message(command("PASS_TURN", "127.0.0.1:10001:2"), None, LEFT)
+    assert len(causal.held) == 1
+
+    causal.handle_message(command("DRAW_CARD", "127.0.0.1:10001:1"), None, LEFT)
+    causal.handle_message(command("DRAW_CARD", "127.0.0.1:10001:1"), None, LEFT)
+    assert delivered == [("DRAW_CARD", LEFT), ("PASS_TURN", LEFT)]
@@ -0,0 +1,86 @@
+import pytest
+import codec
+
+
+@pytest.mark.parametrize("message", [
+    "HEARTBEAT",
+    "DRAW_CARD!C05!47!123",
+    "PASS_TURN!4294967295",
+    "CREATE_DECK!S14!C02!H10",
+    "SYNC_STATE!1!2!0!1!3.1!C02!D03",
+    "SEED_COMMIT!7!1!0a1b!5!127.0.0.1!5000",
+    "PLAYER_ORDER!1!3!127.0.0.1:5000:2!127.0.0.1:5001:1:4",
+    "MEMBERSHIP_DELTA!4!+127.0.0.1:5000:2!-127.0.0.1:5001:2",
+    "ACK!3!5!7",
+    "SKIP!3!9",
+    "RELIABLE!2!PASS_TURN!7",
+])
+def test_binary_round_trip(message):
+    assert codec.decode(codec.encode(message, 300, codec.BINARY_VERSION)) == (message.split("!"), 300)
+
+
+def test_vector_clock_counts_are_varints():
+    clock = "127.0.0.1:5000:300,10.0.0.2:6000:0"
+    small = codec.encode("CAUSAL!127.0.0.1:5000:1!PASS_TURN!7", version=codec.BINARY_VERSION)
+    large = codec.encode(f"CAUSAL!{clock}!PASS_TURN!7", version=codec.BINARY_VERSION)
+
+    assert codec.decode(large) == (["CAUSAL", clock, "PASS_TURN", "7"], None)
+    # 300 takes two varint bytes, the second entry one byte and its address and port six
+    assert len(large) == len(small) + 1 + 7
+
+
+def test_chat_is_plain_text_in_both_protocols():
+    assert codec.decode(codec.encode("CHAT!hi there", 5, codec.BINARY_VERSION)) == (["hi there"], 5)
+    assert codec.decode(codec.encode("UNKNOWN!x", None, codec.BINARY_VERSION)) == (["UNKNOWN!x"], None)
+
+
+def test_text_fallback():
+    datagram = codec.encode("DRAW_CARD!C05!47", 12, codec.TEXT_VERSION)
+
+    assert datagram == b"DRAW_CARD!C05!47^12"
+    assert not codec.is_binary(datagram)
+    assert codec.decode(datagram) == (["DRAW_CARD", "C05", "47"], 12)
+    assert codec.decode(b"CHAT!a^b") == (["CHAT", "a^b"], None)
+
+
+def test_table_frames():
+    datagram = codec.encode("PASS_TURN!1", 3, codec.BINARY_VERSION)
+
+    assert codec.wrap_table(0, datagram) == datagram
+    assert codec.unwrap_table(datagram) == (0, datagram)
+    table, inner = codec.unwrap_table(codec.wrap_table(70000, datagram))
+    assert (table, codec.decode(inner)) == (70000, (["PASS_TURN", "1"], 3))
+    assert codec.unwrap_table(b"PASS_TURN!1") == (0, b"PASS_TURN!1")
+    with pytest.raises(ValueError):
+        codec.unwrap_table(bytes((codec.MAGIC, codec.COMMANDS["TABLE"][0], 0x80)))
+
+
+def test_batch_keeps_the_order_and_the_size_limit():
+    messages = ["PASS_TURN!1", "DRAW_CARD!C05!47!123", "END_GAME"]
+    datagrams = codec.encode_batch(messages, 9)
+
+    assert len(datagrams) == 1
+    assert codec.decode(datagrams[0]) == (["BATCH", *messages], 9)
+    # a batch of one message is a plain frame
+    assert codec.encode_batch(["PASS_TURN!1"], 9) == [codec.encode("PASS_TURN!1", 9, codec.BINARY_VERSION)]
+
+    chats = [f"CHAT!{index}" + "x" * 500 for index in range(5)]
+    datagrams = codec.encode_batch(chats, 9)
+    assert all(len(datagram) <= codec.MAX_DATAGRAM_SIZE for datagram in datagrams)
+    decoded = []
+    for datagram in datagrams:
+        fields, _ = codec.decode(datagram)
+        decoded.extend(fields[1:] if fields[0] == "BATCH" else fields)
+    # chat messages arrive as their text, in a batch as well
+    assert decoded == [chat[len("CHAT!"):] for chat in chats]
+
+
+@pytest.mark.parametrize("datagram", [
+    bytes((codec.MAGIC, 200, 0)),
+    # trailing fields are optional, but a field may not be cut off, here the two byte clock
+    codec.encode("DRAW_CARD!C05!47!123", 300, codec.BINARY_VERSION)[:3],
+    b"\xff\xfe",
+])
+def test_malformed_datagrams_raise_value_error(datagram):
+    with pytest.raises(ValueError):
+        codec.decode(datagram)
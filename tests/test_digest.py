@@ -0,0 +1,39 @@
+import random
+from deck import Deck
+from players import PlayerStates
+
+
+def test_deck_digest_matches_a_shoe_of_the_cards_left():
+    rng = random.Random(1)
+    deck = Deck.shuffled(2, rng)
+    while len(deck) > 1:
+        if rng.random() < 0.8:
+            deck.draw()
+        else:
+            deck.move_to(deck.cursor + rng.randint(-3, 3))
+        assert deck.digest == Deck(deck.remaining()).digest
+
+
+def test_player_digest_matches_rehashing_every_seat():
+    rng = random.Random(2)
+    players = PlayerStates(6)
+    for _ in range(200):
+        seat = rng.randrange(len(players))
+        action = rng.random()
+        if action < 0.6:
+            players.add_points(seat, rng.randint(2, 14))
+        elif action < 0.8:
+            players.set_passed(seat)
+        elif action < 0.9:
+            players.set_lost(seat)
+        elif len(players) > 2:
+            players.remove(seat)
+        else:
+            players.resize(len(players) + 3)
+        assert players.digest == players.full_digest()
+        assert players.digest == PlayerStates.from_masks(
+            players.points.tolist(), players.pass_mask, players.loser_mask).digest
+
+
+def test_player_digest_tells_swapped_points_apart():
+    assert PlayerStates.from_masks([5, 7], 0, 0).digest != PlayerStates.from_masks([7, 5], 0, 0).digest
@@ -0,0 +1,52 @@
+import os
+import random
+from event_log import EventLog, read_port, write_port
+from fabric import VirtualClock
+from gameplay import Gameplay
+from logger import Logger, WARN
+
+PLAYER = ("127.0.0.1", 10000)
+
+
+def first_player() -> Gameplay:
+    """The only player of a table, so every move is its own."""
+    gameplay = Gameplay(Logger(PLAYER, level=WARN + 1), PLAYER)
+    gameplay.update_order_number(0)
+    return gameplay
+
+
+def started_game() -> Gameplay:
+    random.seed(1)
+    gameplay = first_player()
+    gameplay.initialize_players()
+    gameplay.initiate_game_input()
+    return gameplay
+
+
+def segment_size(event_log: EventLog) -> int:
+    return os.path.getsize(event_log.segment_path(event_log.segment_number))
+
+
+def test_records_of_one_iteration_are_flushed_together(tmp_path):
+    clock = VirtualClock()
+    gameplay = started_game()
+    event_log = EventLog(str(tmp_path), gameplay, gameplay.logger.parent, reactor=clock)
+    event_log.snapshot()
+    clock.advance(0)
+    flushed = segment_size(event_log)
+
+    for move in range(2):
+        event_log.record(gameplay.draw_card_input().split("!"), move + 1, 0)
+    assert segment_size(event_log) == flushed
+    clock.advance(0)
+    assert segment_size(event_log) > flushed
+
+    recovered = first_player()
+    assert EventLog(str(tmp_path), recovered, recovered.logger.parent).recover() == 2
+    assert recovered.state_digest() == gameplay.state_digest()
+
+
+def test_port_is_kept_with_the_log(tmp_path):
+    assert read_port(str(tmp_path)) is None
+    write_port(str(tmp_path), 40000)
+    assert read_port(str(tmp_path)) == 40000
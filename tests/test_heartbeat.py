@@ -0,0 +1,26 @@
+from simulate import Simulation
+
+PLAYERS = 4
+# directed peer pairs of a table, each pair exchanges one heartbeat per second when idle
+PAIRS = PLAYERS * (PLAYERS - 1)
+
+
+def heartbeats_per_pair_second(simulation: Simulation, seconds: float) -> float:
+    return simulation.fabric.command_counts["HEARTBEAT"] / PAIRS / seconds
+
+
+def test_idle_table_sends_one_heartbeat_per_interval(run_for):
+    simulation = Simulation(1, PLAYERS, 0, seed=1)
+    run_for(simulation, 30.0)
+
+    assert 0.9 <= heartbeats_per_pair_second(simulation, 30.0) <= 1.1
+
+
+def test_game_traffic_replaces_heartbeats():
+    simulation = Simulation(1, PLAYERS, 10, seed=1, peer_options={"reliable": True})
+    report = simulation.run(300)
+
+    assert report["games_finished"] == 10
+    # the player whose turn it is talks to everybody and everybody acknowledges it
+    assert heartbeats_per_pair_second(simulation, report["virtual_seconds"]) < 0.6
+    assert report["command_counts"].get("PEER_DISCONNECTED", 0) == 0
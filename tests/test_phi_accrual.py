@@ -0,0 +1,45 @@
+import math
+from phi_accrual import PhiAccrualDetector
+
+PEER = ("127.0.0.1", 10001)
+
+
+def regular_peer(interval: float, arrivals: int = 100) -> PhiAccrualDetector:
+    """A detector that heard the peer every interval, and last at arrivals * interval."""
+    detector = PhiAccrualDetector(1.0)
+    for arrival in range(arrivals + 1):
+        detector.heartbeat(PEER, arrival * interval)
+    return detector
+
+
+def test_phi_of_an_unknown_peer_is_zero():
+    assert PhiAccrualDetector(1.0).phi(PEER, 10.0) == 0.0
+
+
+def test_early_heartbeats_do_not_overflow():
+    # heartbeats every 6 s, far apart compared with the minimum deviation of 0.25 s
+    detector = regular_peer(6.0)
+
+    assert detector.phi(PEER, 600.0) == 0.0
+    assert detector.phi(PEER, 603.0) == 0.0
+    assert detector.is_available(PEER, 600.0)
+
+
+def test_phi_grows_after_the_expected_arrival():
+    detector = regular_peer(1.0)
+
+    on_time = detector.phi(PEER, 101.0)
+    assert math.isclose(on_time, math.log10(2))
+    assert on_time < detector.phi(PEER, 101.3) < detector.phi(PEER, 101.6) < 8.0
+    assert not detector.is_available(PEER, 102.5)
+    assert detector.phi(PEER, 200.0) == math.inf
+
+
+def test_irregular_heartbeats_get_more_time():
+    regular = regular_peer(1.0)
+    irregular = PhiAccrualDetector(1.0)
+    for arrival in range(101):
+        irregular.heartbeat(PEER, arrival + (0.8 if arrival % 2 else 0.0))
+
+    # the irregular peer was last heard at 100.0, after a short interval
+    assert irregular.phi(PEER, 101.6) < regular.phi(PEER, 101.6)
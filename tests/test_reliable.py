@@ -0,0 +1,103 @@
+import codec
+from simulate import Simulation
+
+
+def drop_reliable(simulation: Simulation, source, target, seq: int):
+    """Loses every transmission of one reliable message from source to target."""
+    send = simulation.fabric.send
+
+    def lossy_send(datagram, datagram_source, datagram_target):
+        fields, _ = codec.decode(codec.unwrap_table(datagram)[1])
+        if (datagram_source, datagram_target) == (source, target) and fields[:2] == ["RELIABLE", str(seq)]:
+            simulation.fabric.lost += 1
+            return
+        send(datagram, datagram_source, datagram_target)
+
+    simulation.fabric.send = lossy_send
+
+
+def test_receiver_resumes_after_sender_gives_up(seated_pair, run_for):
+    simulation, sender, receiver = seated_pair
+    sender.reliable.max_retransmits = 2
+    delivered = []
+    receiver.reliable.deliver = lambda fields, clock, addr: delivered.append(fields)
+    # the seat takeover may have sent the first reliable messages, see Peer.request_game_snapshot
+    first_seq = sender.reliable.state_of(receiver.id).next_seq
+    drop_reliable(simulation, sender.id, receiver.id, first_seq)
+
+    sender.reliable.send("lost", None, receiver.id)
+    # sent in another reactor iteration, so not in the same batch datagram
+    run_for(simulation, 0.01)
+    sender.reliable.send("held", None, receiver.id)
+    run_for(simulation, 0.1)
+    assert not delivered
+    run_for(simulation, 30.0)
+    sender.reliable.send("after", None, receiver.id)
+    run_for(simulation, 0.1)
+
+    assert delivered == [["held"], ["after"]]
+    assert receiver.reliable.states[sender.id].expected_seq == first_seq + 3
+    assert not sender.reliable.states[receiver.id].unacked
+
+
+def test_skip_of_a_delivered_message_is_a_duplicate(seated_pair, run_for):
+    simulation, sender, receiver = seated_pair
+    delivered = []
+    receiver.reliable.deliver = lambda fields, clock, addr: delivered.append(fields)
+
+    first_seq = sender.reliable.state_of(receiver.id).next_seq
+    sender.reliable.send("first", None, receiver.id)
+    run_for(simulation, 0.1)
+    # the sender gave up because the acknowledgements were lost, not the message
+    receiver.reliable.handle_message(["SKIP", str(first_seq), str(first_seq)], None, sender.id)
+    sender.reliable.send("second", None, receiver.id)
+    run_for(simulation, 0.1)
+
+    assert delivered == [["first"], ["second"]]
+
+
+def test_receiver_that_forgot_the_channel_resumes(seated_pair, run_for):
+    simulation, sender, receiver = seated_pair
+    delivered = []
+    receiver.reliable.deliver = lambda fields, clock, addr: delivered.append(fields)
+
+    sender.reliable.send("before", None, receiver.id)
+    run_for(simulation, 0.1)
+    # e.g. the sender left the table for a moment, only on the receiver's side
+    receiver.reliable.forget(sender.id)
+    sender.reliable.send("after", None, receiver.id)
+    run_for(simulation, 0.2)
+
+    assert delivered == [["before"], ["after"]]
+
+
+def test_sender_that_forgot_the_channel_is_not_dropped_as_duplicate(seated_pair, run_for):
+    simulation, sender, receiver = seated_pair
+    delivered = []
+    receiver.reliable.deliver = lambda fields, clock, addr: delivered.append(fields)
+
+    # the receiver expects a later seq than the one the sender starts over with
+    for message in ("first", "before"):
+        sender.reliable.send(message, None, receiver.id)
+        run_for(simulation, 0.1)
+    sender.reliable.forget(receiver.id)
+    sender.reliable.send("after", None, receiver.id)
+    run_for(simulation, 0.2)
+
+    assert delivered == [["first"], ["before"], ["after"]]
+
+
+def test_reordered_ack_sends_no_skip(seated_pair, run_for):
+    simulation, sender, receiver = seated_pair
+    first_seq = sender.reliable.state_of(receiver.id).next_seq
+    for message in ("first", "second", "third"):
+        sender.reliable.send(message, None, receiver.id)
+        run_for(simulation, 0.1)
+    assert not sender.reliable.states[receiver.id].unacked
+
+    # the ACKs of the first two messages, overtaken by the one of the third
+    sender.reliable.handle_message(["ACK", str(first_seq + 1)], None, receiver.id)
+    sender.reliable.handle_message(["ACK", str(first_seq), str(first_seq + 1)], None, receiver.id)
+    run_for(simulation, 0.1)
+
+    assert "SKIP" not in simulation.fabric.command_counts
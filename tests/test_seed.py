@@ -0,0 +1,48 @@
+from gameplay import Gameplay
+from logger import Logger, WARN
+from seed import SeedRound
+
+INITIATOR = ("127.0.0.1", 10000)
+
+
+def second_player() -> Gameplay:
+    gameplay = Gameplay(Logger(("127.0.0.1", 10001), level=WARN + 1), ("127.0.0.1", 10001), deck_mode="seed")
+    gameplay.connected_peers = 1
+    gameplay.update_order_number(1)
+    return gameplay
+
+
+def play_round(gameplay: Gameplay, initiator_round: SeedRound):
+    """Has the initiator commit and reveal, the second player answers on its own."""
+    gameplay.handle_incoming_commands(initiator_round.commit_message().split("!"), 0)
+    initiator_round.add_commit(1, gameplay.seed_round.commit_message().split("!")[3])
+    gameplay.handle_incoming_commands(initiator_round.reveal_message().split("!"), 0)
+
+
+def test_late_commit_of_an_earlier_round_does_not_cancel_the_game():
+    gameplay = second_player()
+    earlier = SeedRound(1, 1, 2, 0, (5, *INITIATOR))
+    gameplay.handle_incoming_commands(earlier.commit_message().split("!"), 0)
+    newer = SeedRound(2, 1, 2, 0, (9, *INITIATOR))
+    play_round(gameplay, newer)
+    assert gameplay.is_game_initiated()
+    gameplay.handle_incoming_commands(["DRAW_CARD", "C05", "50"], 0)
+
+    answer = gameplay.handle_incoming_commands(earlier.commit_message().split("!"), 0)
+
+    assert answer == []
+    assert gameplay.is_game_initiated()
+    assert gameplay.players.points_of(0) == 5
+    assert gameplay.seed_round is None
+
+
+def test_commit_of_a_newer_round_starts_it():
+    gameplay = second_player()
+    play_round(gameplay, SeedRound(1, 1, 2, 0, (5, *INITIATOR)))
+
+    answer = gameplay.handle_incoming_commands(SeedRound(2, 1, 2, 0, (6, *INITIATOR)).commit_message().split("!"), 0)
+
+    assert not gameplay.is_game_initiated()
+    assert gameplay.seed_round.round_id == 2
+    # with two players, both commitments are in and the share is revealed right away
+    assert answer == [gameplay.seed_round.commit_message(), gameplay.seed_round.share_message()]
@@ -0,0 +1,90 @@
+from typing import List
+import codec
+from fabric import VirtualClock
+from server import Server
+from simulate import Simulation
+
+ROOM = "friday"
+
+
+class RecordingTransport:
+    def __init__(self):
+        self.sent = []
+
+    def write(self, datagram: bytes, addr):
+        self.sent.append((addr, codec.decode(datagram)[0]))
+
+    def received_by(self, addr) -> List[List[str]]:
+        return [fields for target, fields in self.sent if target == addr]
+
+
+def seated_room(versions: List[int]):
+    """A server with one room of clients on ports 10000 and up, after their player orders went out."""
+    clock = VirtualClock()
+    server = Server(max_seats=len(versions), client_timeout=10.0, reactor=clock)
+    server.transport = RecordingTransport()
+    clients = [("127.0.0.1", 10000 + index) for index in range(len(versions))]
+    for client, version in zip(clients, versions):
+        server.datagramReceived(codec.encode(f"ready!{version}!{ROOM}", version=version), client)
+    clock.advance(0.1)
+    server.transport.sent.clear()
+    return clock, server, clients
+
+
+def test_clients_that_expire_together_cost_one_update_per_binary_peer():
+    clock, server, clients = seated_room([2, 2, 1, 2, 2])
+    # the last two clients go silent, the others keep their seats
+    for _ in range(12):
+        for client in clients[:3]:
+            epoch = server.rooms[ROOM].epoch
+            server.datagramReceived(codec.encode(f"HEARTBEAT!{epoch}", version=codec.BINARY_VERSION), client)
+        clock.advance(1.0)
+
+    for binary_client in clients[:2]:
+        assert server.transport.received_by(binary_client) == [
+            ["MEMBERSHIP_DELTA", "2", "-127.0.0.1:10003:2", "-127.0.0.1:10004:2"]]
+    # the text client keeps the seats of a game with a disconnection per client
+    assert sorted(fields[0] for fields in server.transport.received_by(clients[2])) == [
+        "PEER_DISCONNECTED", "PEER_DISCONNECTED", "PLAYER_ORDER"]
+
+
+def test_heartbeat_with_an_old_epoch_gets_the_player_order():
+    clock, server, clients = seated_room([2, 2])
+    server.datagramReceived(codec.encode("HEARTBEAT!1", version=codec.BINARY_VERSION), clients[0])
+    assert not server.transport.sent
+
+    server.datagramReceived(codec.encode("HEARTBEAT!0", version=codec.BINARY_VERSION), clients[1])
+    assert server.transport.received_by(clients[1]) == [
+        ["PLAYER_ORDER", "1", "1", "127.0.0.1:10000:2", "127.0.0.1:10001:2"]]
+    clock.advance(0.1)
+    assert len(server.transport.sent) == 1
+
+
+def test_ready_of_a_seated_client_sends_the_player_order_to_the_room():
+    clock, server, clients = seated_room([2, 2, 2])
+    server.datagramReceived(codec.encode(f"ready!2!{ROOM}", version=codec.BINARY_VERSION), clients[1])
+    clock.advance(0.1)
+
+    for seat, client in enumerate(clients):
+        assert server.transport.received_by(client) == [
+            ["PLAYER_ORDER", str(seat), "2", *(f"127.0.0.1:{port}:2" for port in (10000, 10001, 10002))]]
+
+
+def test_peer_whose_player_order_was_lost_is_seated_again(run_for):
+    simulation = Simulation(1, 3, 0, seed=1)
+    late = simulation.tables[0].peers[2]
+    send = simulation.fabric.send
+    lost = []
+
+    def lossy_send(datagram, source, target):
+        fields, _ = codec.decode(codec.unwrap_table(datagram)[1])
+        if target == late.id and fields[0] == "PLAYER_ORDER" and not lost:
+            lost.append(fields)
+            return
+        send(datagram, source, target)
+    simulation.fabric.send = lossy_send
+
+    # the others drop the unseated peer for missing heartbeats, until it asks for its seat again
+    run_for(simulation, 10.0)
+
+    assert simulation.tables[0].is_seated()
@@ -0,0 +1,52 @@
+import codec
+
+
+def test_table_seated_together_asks_for_no_snapshot(seated_table):
+    simulation, _ = seated_table(4)
+
+    assert "GAME_SNAPSHOT_REQUEST" not in simulation.fabric.command_counts
+
+
+def test_text_table_asks_for_no_snapshot(seated_table):
+    # text peers get no membership epoch, so they cannot tell a new table from a running one
+    simulation, peers = seated_table(3, codec.TEXT_VERSION)
+
+    assert "GAME_SNAPSHOT_REQUEST" not in simulation.fabric.command_counts
+    assert not any(peer.causal.waiting_for_baseline for peer in peers)
+
+
+def test_empty_snapshot_does_not_end_a_game_started_after_the_request(seated_table, run_for):
+    simulation, (leader, player) = seated_table(2)
+    leader.request_game_snapshot()
+    leader.handle_user_input("INITIATE_GAME")
+    run_for(simulation, 0.5)
+
+    assert leader.gameplay.is_game_initiated()
+    assert player.gameplay.is_game_initiated()
+
+
+def test_answer_to_an_earlier_request_is_ignored(seated_table, run_for):
+    simulation, (_, player) = seated_table(2)
+    player.request_game_snapshot()
+    first_request = player.snapshot_request_id
+    player.request_game_snapshot()
+    player.handle_snapshot_message(["GAME_SNAPSHOT", str(first_request), "", "0"], None)
+
+    assert player.snapshot_call is not None
+    run_for(simulation, 0.5)
+    assert player.snapshot_call is None
+
+
+def test_peer_restarted_on_its_address_keeps_its_seat_and_gets_the_game(seated_table, run_for):
+    simulation, (leader, player, _) = seated_table(3)
+    leader.handle_user_input("INITIATE_GAME")
+    run_for(simulation, 0.3)
+    # the restarted peer knows nothing but its address, which it kept with its event log
+    player.members.reset([])
+    player.gameplay.reset_gameplay_variables()
+    player.send_message(player.get_ready_message(), player.server)
+    run_for(simulation, 0.5)
+
+    assert player.gameplay.own_turn_identifier == 1
+    assert player.gameplay.is_game_initiated()
+    assert player.gameplay.state_digest() == leader.gameplay.state_digest()